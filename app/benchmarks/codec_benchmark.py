@@ -0,0 +1,90 @@
+# ./app/benchmarks/codec_benchmark.py
+
+# Compares the Redis payloads of the cache codecs: bytes stored and encode/decode time per cache entry.
+#
+# The entries are the ones the app caches for a SWAPI snapshot (films data, every character and species, by default
+# the tests' fixture), wrapped in the cache envelope. The baseline is what the cache used to store: the whole SWAPI
+# objects as JSON text.
+#
+# Usage (from ./app): python -m benchmarks.codec_benchmark [--snapshot path.json] [--repeat 200] [--json]
+
+from .fake_upstream import FIXTURE_PATH
+import argparse
+import json
+import time
+
+
+def cache_entries(snapshot: dict, projected: bool) -> list:
+    from src.codec import project
+    from src.schemas import Character, Film, Species
+
+    def shape(item, schema):
+        return project(item, schema) if projected else item
+
+    films_data = {"count": len(snapshot["films"]), "next": None, "previous": None,
+                  "results": [shape(film, Film) for film in snapshot["films"]]}
+    data = [films_data] + [shape(character, Character) for character in snapshot["people"]] \
+        + [shape(species, Species) for species in snapshot["species"]]
+    return [{"fetched_at": time.time(), "hash": "0" * 64, "data": item} for item in data]
+
+
+def measure(entries: list, encode, decode, repeat: int) -> dict:
+    payloads = [encode(entry) for entry in entries]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for entry in entries:
+            encode(entry)
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for payload in payloads:
+            decode(payload)
+    decode_time = time.perf_counter() - start
+
+    return {
+        "bytes": sum(len(payload) for payload in payloads),
+        "encode_us": round(encode_time / (repeat * len(entries)) * 1e6, 2),
+        "decode_us": round(decode_time / (repeat * len(entries)) * 1e6, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Redis payloads of the cache codecs.")
+    parser.add_argument("--snapshot", default=FIXTURE_PATH, help="SWAPI snapshot (JSON, as written by src.warmup)")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    from src import codec
+
+    with open(args.snapshot) as f:
+        snapshot = json.load(f)
+    raw_entries = cache_entries(snapshot, projected=False)
+    projected_entries = cache_entries(snapshot, projected=True)
+
+    results = {"legacy json (whole objects)": measure(raw_entries, lambda entry: json.dumps(entry).encode("utf-8"),
+                                                      lambda payload: json.loads(payload.decode("utf-8")),
+                                                      args.repeat)}
+    threshold = codec.settings.cache_compression_threshold
+    for name in codec.CODECS:
+        codec.codec_name = name
+        for compression in (0, threshold or 1024):
+            codec.settings.cache_compression_threshold = compression
+            label = f"{name} (projected{', zlib >= %d B' % compression if compression else ''})"
+            results[label] = measure(projected_entries, codec.encode, codec.decode, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = results["legacy json (whole objects)"]
+    print(f"{len(raw_entries)} cache entries\n")
+    print(f"{'codec':<38}{'bytes':>10}{'vs legacy':>11}{'encode (us)':>13}{'decode (us)':>13}")
+    for label, result in results.items():
+        change = (result["bytes"] - baseline["bytes"]) / baseline["bytes"] * 100
+        print(f"{label:<38}{result['bytes']:>10}{change:>+10.1f}%{result['encode_us']:>13}{result['decode_us']:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# ./app/benchmarks/csv_export_benchmark.py
+
+# Compares the previous pandas CSV path of /characters/top_10_sorted with the streaming csv_export module:
+# latency per call and peak RSS of a fresh process (what every gunicorn worker pays).
+#
+# Usage (from ./app): python -m benchmarks.csv_export_benchmark [--iterations 2000] [--json]
+# pandas is only needed to run this benchmark (it's in requirements_test.txt).
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROWS = [{"name": f"Character {i}", "species": "Droid" if i % 3 else "", "height": 250 - i * 7, "appearances": 6 - i % 4,
+         "films": [], "url": f"https://swapi.dev/api/people/{i}/"} for i in range(10)]
+
+PANDAS_PATH = """
+import pandas as pd
+import os
+
+def export(rows, path):
+    df = pd.DataFrame(rows)
+    df = df[["name", "species", "height", "appearances"]]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False)
+    df.to_csv(index=False)  # It was serialised a second time just to log it
+    with open(path, "rb") as f:  # And read back to be uploaded
+        return f.read()
+"""
+
+STREAMING_PATH = """
+from src.csv_export import build_csv, save_csv
+
+def export(rows, path):
+    content = build_csv(rows)
+    save_csv(content, path)
+    return content
+"""
+
+RSS_SCRIPT = """
+import json, sys, tempfile
+{path}
+rows = json.loads(sys.argv[1])
+export(rows, tempfile.mkdtemp() + "/csv/top_10_sorted.csv")
+# Peak RSS in KB (ru_maxrss isn't reset by exec on Linux, VmHWM is)
+with open("/proc/self/status") as f:
+    print(next(line.split()[1] for line in f if line.startswith("VmHWM:")))
+"""
+
+
+def measure_latency(path_code: str, iterations: int) -> dict:
+    namespace = {}
+    exec(path_code, namespace)
+    export = namespace["export"]
+    path = tempfile.mkdtemp() + "/csv/top_10_sorted.csv"
+    export(ROWS, path)  # Warm up
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        export(ROWS, path)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 4),
+        "p50_ms": round(timings[len(timings) // 2], 4),
+        "p95_ms": round(timings[int(len(timings) * 0.95)], 4)
+    }
+
+
+def measure_rss(path_code: str) -> float:
+    # Peak RSS (in MB) of a fresh interpreter that imports the path and exports the CSV once
+    output = subprocess.check_output([sys.executable, "-c", RSS_SCRIPT.format(path=path_code), json.dumps(ROWS)])
+    return round(int(output.decode().strip().splitlines()[-1]) / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pandas CSV path against the streaming CSV writer.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, path_code in (("pandas", PANDAS_PATH), ("streaming", STREAMING_PATH)):
+        results[name] = {**measure_latency(path_code, args.iterations), "peak_rss_mb": measure_rss(path_code)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'path':<12}{'mean (ms)':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'peak RSS (MB)':>16}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['mean_ms']:>12}{result['p50_ms']:>12}{result['p95_ms']:>12}"
+              f"{result['peak_rss_mb']:>16}")
+
+
+if __name__ == "__main__":
+    main()
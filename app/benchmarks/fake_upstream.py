@@ -0,0 +1,122 @@
+# ./app/benchmarks/fake_upstream.py
+
+# Local stand-in for swapi.dev and httpbin.org, serving a SWAPI snapshot (by default the tests' fixture).
+# Used by the tests and by the load-testing harness, so both run offline and reproducibly.
+#
+# Latency (for every path or per path) and errors can be injected, and every request path is counted so callers can
+# check how many upstream calls were made.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from typing import Optional
+from urllib.parse import urlsplit
+import json
+import os
+import random
+import threading
+import time
+
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "tests", "fixtures", "swapi_snapshot.json")
+FIXTURE_BASE_URL = "https://swapi.dev/api"
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, snapshot_path: str = FIXTURE_PATH,
+                 seed: Optional[int] = 0):
+        super().__init__(("127.0.0.1", 0), FakeUpstreamHandler)
+        self.latency = latency  # Seconds every request takes
+        self.path_latency = {}  # Request path -> seconds, for the paths that don't take self.latency
+        self.error_rate = error_rate  # Fraction of the GETs (SWAPI calls) that fail with a 500
+        self.random = random.Random(seed)  # Seeded, so the same GETs fail on every run
+        self.failing_posts = 0  # The next failing_posts POSTs (uploads) fail with a 503
+        self.down = False  # While set, every GET (SWAPI call) fails with a 500
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.root_url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.base_url = f"{self.root_url}/api"
+        self.httpbin_url = f"{self.root_url}/post"
+        self.thread = None
+
+        with open(snapshot_path) as f:
+            data = json.loads(f.read().replace(FIXTURE_BASE_URL, self.base_url))
+        # Paginated collections (10 items per page, like SWAPI) and the individual items
+        self.routes = {}
+        for resource in ("films", "people", "species"):
+            items = data[resource]
+            pages = [items[i:i + 10] for i in range(0, len(items), 10)]
+            for number, page in enumerate(pages, start=1):
+                self.routes[self.page_path(resource, number)] = {
+                    "count": len(items),
+                    "next": self.root_url + self.page_path(resource, number + 1) if number < len(pages) else None,
+                    "previous": self.root_url + self.page_path(resource, number - 1) if number > 1 else None,
+                    "results": page
+                }
+            for item in items:
+                self.routes[urlsplit(item["url"]).path] = item
+
+    @staticmethod
+    def page_path(resource: str, number: int) -> str:
+        return f"/api/{resource}/" if number == 1 else f"/api/{resource}/?page={number}"
+
+    def count(self, prefix: str) -> int:
+        with self.lock:
+            return sum(n for path, n in self.calls.items() if path.startswith(prefix))
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+    def start(self) -> "FakeUpstream":
+        # Serve on a background thread
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real upstreams
+
+    def _reply(self, status_code: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls[self.path] += 1
+            failing = self.server.down or self.server.random.random() < self.server.error_rate
+        time.sleep(self.server.path_latency.get(self.path, self.server.latency))
+        if failing:
+            self._reply(500, {"detail": "Internal server error"})
+        elif self.path in self.server.routes:
+            self._reply(200, self.server.routes[self.path])
+        else:
+            self._reply(404, {"detail": "Not found"})
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.calls[self.path] += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            failing = self.server.failing_posts > 0
+            self.server.failing_posts -= failing
+        time.sleep(self.server.latency)
+        if failing:
+            self._reply(503, {"detail": "Service unavailable"})
+        else:
+            self._reply(200, {"files": {}})
+
+    def log_message(self, format, *args):
+        pass
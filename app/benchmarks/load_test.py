@@ -0,0 +1,257 @@
+# ./app/benchmarks/load_test.py
+
+# Load-testing harness for /characters/top_10_sorted. It runs fully offline: the app is called in-process (no web
+# server in between), SWAPI and httpbin.org are replaced by a local stand-in with configurable latency and error
+# injection, and Redis is in-memory (fakeredis) unless a real one is given.
+#
+# Scenarios:
+#   cold           Every request starts with an empty cache (full films -> characters -> species fan-out)
+#   warm           Every request is served from a warm cache
+#   stampede       Bursts of concurrent requests right after the cached entries expired
+#   slow_upstream  Warm but stale cache while SWAPI is slow (stale entries are served and refreshed in the background)
+#   bypass         Requests with use_cache=false on a warm cache (everything is fetched from SWAPI, nothing is cached)
+#
+# It reports throughput, p50/p95/p99 latency and upstream call counts per scenario, and the JSON results of two
+# runs (e.g. two commits) can be compared.
+#
+# Usage (from ./app): python -m benchmarks.load_test [--scenarios cold warm] [--requests 500] [--concurrency 20]
+#                         [--latency 0.02] [--slow-latency 0.5] [--error-rate 0.0] [--redis fake|redis://...]
+#                         [--output results.json] [--compare baseline.json] [--json]
+# fakeredis is only needed for the default in-memory Redis (it's in requirements_test.txt).
+
+from .fake_upstream import FakeUpstream
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+
+SCENARIOS = ("cold", "warm", "stampede", "slow_upstream", "bypass")
+ENDPOINT = "/characters/top_10_sorted"
+
+
+def percentile(timings: list, p: float) -> float:
+    # Nearest-rank percentile of already sorted timings
+    return timings[max(math.ceil(p / 100 * len(timings)) - 1, 0)]
+
+
+def git_commit() -> str:
+    try:
+        output = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL)
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Harness:
+
+    def __init__(self, upstream: FakeUpstream, redis_client, client):
+        self.upstream = upstream
+        self.redis_client = redis_client
+        self.client = client
+
+    async def reset(self):
+        # Empty every cache tier, as if the entries had expired (or the service had just started)
+        from src import appearances, bulk, cache, delivery
+        from src.routes import character
+
+        await self.wait_for_background_tasks()
+        self.redis_client.flushdb()
+        cache.local_cache.clear()
+        bulk.local_entities.clear()
+        delivery.recent_jobs.clear()
+        character.exported_csv.clear()
+        appearances.indexed_films_hash = None
+
+    async def fire(self, requests: int, concurrency: int, params: dict = None):
+        # Send requests (at most concurrency at a time) and return their latencies and the number of errors
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await self.client.get(ENDPOINT, params=params)
+                timings.append((time.perf_counter() - start) * 1000)
+                errors += response.status_code != 200
+
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return timings, errors
+
+    async def run(self, scenario: str, args) -> dict:
+        from src import cache
+
+        self.upstream.latency = args.latency
+        await self.reset()
+        if scenario != "cold":
+            await self.client.get(ENDPOINT)  # Warm up
+        await self.wait_for_background_tasks()
+        self.upstream.reset_calls()
+
+        timings, errors = [], 0
+        start = time.perf_counter()
+        if scenario == "cold":
+            for _ in range(args.rounds):
+                await self.reset()
+                round_timings, round_errors = await self.fire(1, 1)
+                timings += round_timings
+                errors += round_errors
+        elif scenario == "stampede":
+            for _ in range(args.rounds):
+                await self.reset()
+                round_timings, round_errors = await self.fire(args.concurrency, args.concurrency)
+                timings += round_timings
+                errors += round_errors
+        elif scenario == "warm":
+            timings, errors = await self.fire(args.requests, args.concurrency)
+        elif scenario == "slow_upstream":
+            self.upstream.latency = args.slow_latency
+            cache_ttl, cache.settings.cache_ttl = cache.settings.cache_ttl, 0  # Every entry is stale
+            try:
+                timings, errors = await self.fire(args.requests, args.concurrency)
+            finally:
+                cache.settings.cache_ttl = cache_ttl
+        elif scenario == "bypass":
+            timings, errors = await self.fire(args.rounds, 1, params={"use_cache": "false"})
+        duration = time.perf_counter() - start
+        await self.wait_for_background_tasks()
+
+        timings.sort()
+        return {
+            "requests": len(timings),
+            "concurrency": 1 if scenario in ("cold", "bypass") else args.concurrency,
+            "errors": errors,
+            "duration_s": round(duration, 4),
+            "throughput_rps": round(len(timings) / duration, 2),
+            "mean_ms": round(statistics.mean(timings), 3),
+            "p50_ms": round(percentile(timings, 50), 3),
+            "p95_ms": round(percentile(timings, 95), 3),
+            "p99_ms": round(percentile(timings, 99), 3),
+            "upstream_calls": {
+                "films": self.upstream.count("/api/films/"),
+                "people": self.upstream.count("/api/people/"),
+                "species": self.upstream.count("/api/species/"),
+                "httpbin": self.upstream.count("/post")
+            }
+        }
+
+    async def wait_for_background_tasks(self):
+        # Let the background refreshes (and queued deliveries) finish so they're counted in the right scenario
+        from src import bulk, cache, delivery
+
+        while cache.background_tasks or bulk.background_tasks or self.redis_client.llen(delivery.QUEUE_KEY) \
+                or self.redis_client.llen(delivery.PROCESSING_KEY):
+            await asyncio.sleep(0.01)
+
+
+def connect_redis(url: str):
+    # The sync and asyncio clients of the app, both connected to the same Redis
+    if url == "fake":
+        import fakeredis
+        import fakeredis.aioredis
+        server = fakeredis.FakeServer()
+        return fakeredis.FakeRedis(server=server), fakeredis.aioredis.FakeRedis(server=server)
+    import redis.asyncio
+    return redis.Redis.from_url(url), redis.asyncio.Redis.from_url(url)
+
+
+async def run_benchmark(args, upstream: FakeUpstream) -> dict:
+    # The app is imported here, once the settings it reads from the environment point at the stand-in
+    import httpx
+    from src import utils
+    from src.app import app
+
+    utils.redis_client, utils.async_redis_client = connect_redis(args.redis)
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            harness = Harness(upstream, utils.get_redis_client(), client)
+            for scenario in args.scenarios:
+                results[scenario] = await harness.run(scenario, args)
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    # Relative change of every latency/throughput figure against a previous run
+    print(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    print(f"{'scenario':<16}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}")
+    for scenario, result in results["scenarios"].items():
+        previous = baseline["scenarios"].get(scenario)
+        if previous is None:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            change = (result[metric] - previous[metric]) / previous[metric] * 100 if previous[metric] else 0.0
+            print(f"{scenario:<16}{metric:<16}{previous[metric]:>12}{result[metric]:>12}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /characters/top_10_sorted against a local SWAPI stand-in.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="Requests of the warm and slow_upstream scenarios")
+    parser.add_argument("--rounds", type=int, default=10, help="Rounds of the cold, stampede and bypass scenarios")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every upstream call takes")
+    parser.add_argument("--slow-latency", type=float, default=0.5,
+                        help="Seconds every upstream call takes in the slow_upstream scenario")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the SWAPI calls that fail")
+    parser.add_argument("--redis", default="fake",
+                        help="'fake' (in-memory) or a Redis URL. The database is flushed, don't use a shared one")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(latency=args.latency, error_rate=args.error_rate).start()
+    os.environ.update({
+        "SWAPI_BASE_URL": upstream.base_url,
+        "HTTPBIN_URL": upstream.httpbin_url,
+        "CSV_OUTPUT_PATH": os.path.join(tempfile.mkdtemp(), "top_10_sorted.csv"),
+        "SNAPSHOT_PATH": "",
+        "SNAPSHOT_REFRESH_INTERVAL": "0",
+        "LOGGING_LEVEL": os.environ.get("LOGGING_LEVEL", "WARNING")
+    })
+    try:
+        scenarios = asyncio.run(run_benchmark(args, upstream))
+    finally:
+        upstream.stop()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "parameters": {key: value for key, value in vars(args).items()
+                           if key not in ("output", "compare", "json")}
+        },
+        "scenarios": scenarios
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<16}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+              f"{'p99 (ms)':>10}  upstream calls (films/people/species/httpbin)")
+        for scenario, result in scenarios.items():
+            calls = "/".join(str(n) for n in result["upstream_calls"].values())
+            print(f"{scenario:<16}{result['requests']:>10}{result['errors']:>8}{result['throughput_rps']:>10}"
+                  f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}  {calls}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
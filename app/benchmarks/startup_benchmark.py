@@ -0,0 +1,149 @@
+# ./app/benchmarks/startup_benchmark.py
+
+# Measures how long the app takes to start and how much memory its workers take.
+#
+# - import: time to import the app (src.app) in a fresh interpreter, and its RSS afterwards
+# - gunicorn: starts gunicorn with gunicorn.conf.py, with and without preload_app, and reports the time until every
+#   worker has booted and answers, and the RSS, PSS (RSS with the shared pages split between the processes sharing
+#   them) and private memory of every worker. PSS is what a worker really costs: with preload_app, the code and
+#   modules imported by the master are shared copy-on-write.
+#
+# Redis isn't needed: the workers start degraded without it (no snapshot is loaded).
+# Memory figures come from /proc, so the gunicorn part only runs on Linux.
+#
+# Usage (from ./app): python -m benchmarks.startup_benchmark [--workers 4] [--repeat 5] [--json]
+
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import resource, time
+start = time.perf_counter()
+import src.app
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure_import(repeat: int) -> dict:
+    times, rss = [], []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=APP_DIR, check=True,
+                                capture_output=True, text=True).stdout.split()
+        times.append(float(output[0]))
+        rss.append(int(output[1]) / 1024)  # ru_maxrss is in KiB on Linux
+    return {"import_ms": round(statistics.median(times) * 1000, 1), "rss_mb": round(statistics.median(rss), 1)}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory(pid: int) -> dict:
+    # RSS, PSS and private memory of a process, in MB
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {"rss_mb": round(fields.get("Rss", 0) / 1024, 1), "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+            "private_mb": round(private / 1024, 1)}
+
+
+def wait_until_ready(process: subprocess.Popen, port: int, workers: int, timeout: float):
+    # Every worker booted (they log it) and the app answers
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            booted = len(children(process.pid)) == workers
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                if booted and response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError("gunicorn didn't start in time")
+
+
+def measure_gunicorn(workers: int, preload: bool, settle: float, timeout: float) -> dict:
+    port = free_port()
+    env = {**os.environ, "WEB_HOST": "127.0.0.1", "WEB_PORT": str(port), "WEB_CONCURRENCY": str(workers),
+           "GUNICORN_PRELOAD": str(preload).lower(), "LOGGING_LEVEL": "WARNING",
+           "REDIS_HOST": "127.0.0.1", "REDIS_PORT": "1", "REDIS_RETRY_ATTEMPTS": "0",
+           "DELIVERY_WORKER_ENABLED": "false", "METRICS_ENABLED": "false"}
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "src.app:app"],
+                               cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(process, port, workers, timeout)
+        ready = time.perf_counter() - start
+        time.sleep(settle)  # Let the workers finish their startup (lifespan) before measuring them
+        worker_memory = [memory(pid) for pid in children(process.pid)]
+        return {
+            "ready_ms": round(ready * 1000, 1),
+            "master": memory(process.pid),
+            "workers": len(worker_memory),
+            "worker_rss_mb": round(statistics.mean(m["rss_mb"] for m in worker_memory), 1),
+            "worker_pss_mb": round(statistics.mean(m["pss_mb"] for m in worker_memory), 1),
+            "worker_private_mb": round(statistics.mean(m["private_mb"] for m in worker_memory), 1),
+            "total_pss_mb": round(memory(process.pid)["pss_mb"] + sum(m["pss_mb"] for m in worker_memory), 1)
+        }
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time and per-worker memory of the app.")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--repeat", type=int, default=5, help="Imports measured (the median is reported)")
+    parser.add_argument("--settle", type=float, default=1.0, help="Seconds to wait after startup before measuring")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for gunicorn to start")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {"import": measure_import(args.repeat)}
+    if sys.platform.startswith("linux"):
+        for preload in (False, True):
+            results["gunicorn_preload" if preload else "gunicorn"] = measure_gunicorn(args.workers, preload,
+                                                                                      args.settle, args.timeout)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"import: {results['import']['import_ms']} ms, RSS {results['import']['rss_mb']} MB")
+    print(f"{'server':<18}{'ready (ms)':>12}{'workers':>9}{'RSS/w (MB)':>12}{'PSS/w (MB)':>12}"
+          f"{'private/w':>11}{'total PSS':>11}")
+    for name in ("gunicorn", "gunicorn_preload"):
+        if name in results:
+            r = results[name]
+            print(f"{name:<18}{r['ready_ms']:>12}{r['workers']:>9}{r['worker_rss_mb']:>12}{r['worker_pss_mb']:>12}"
+                  f"{r['worker_private_mb']:>11}{r['total_pss_mb']:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ sleep 2
 echo "Selected server: $WEB_SERVER"
 echo "Starting server..."
 if [ "$WEB_SERVER" = "gunicorn" ]; then
-    exec gunicorn -k uvicorn.workers.UvicornWorker -w 4 src.app:app --bind ${WEB_HOST}:${WEB_PORT}
+    exec gunicorn -c gunicorn.conf.py src.app:app
 elif [ "$WEB_SERVER" = "uvicorn" ]; then
     exec uvicorn src.app:app --host ${WEB_HOST} --port ${WEB_PORT}
 else
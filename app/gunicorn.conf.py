@@ -0,0 +1,31 @@
+# ./app/gunicorn.conf.py
+
+# Gunicorn settings (gunicorn -c gunicorn.conf.py src.app:app, see entrypoint.sh).
+#
+# With preload_app (the default), the app is imported once, in the master, and the workers are forked from it: they
+# start without importing anything, and share the master's memory (code, modules, settings) copy-on-write instead of
+# each holding a copy. Everything a worker owns (Redis and upstream clients, the fallback cache file, background tasks)
+# is created in the app's lifespan, after the fork. The master's garbage collector is disabled while it imports and
+# everything it imported is then frozen (gc.freeze), so the workers' collections don't write to (and copy) the shared
+# pages.
+
+import gc
+import os
+
+bind = f"{os.environ.get('WEB_HOST', '0.0.0.0')}:{os.environ.get('WEB_PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+if preload_app:
+    gc.disable()
+
+
+def when_ready(server):
+    # The app is imported: move everything to the permanent generation before the workers are forked
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
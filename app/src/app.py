@@ -2,17 +2,88 @@
 
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from .config import Settings
-from .routes import general, character
-from .utils import get_redis_client
+from .config import get_settings
+from .routes import general, character, delivery, admin, profiling
+from .utils import async_redis_dependency, close_redis_clients, open_redis_clients
+from .upstream import close_upstream_client
+from .cache import fallback_cache, start_invalidation_listener, stop_invalidation_listener
+from .warmup import load_snapshot_file, refresh_periodically
+from .delivery import run_delivery_worker
+from .metrics import MetricsMiddleware, flush, flush_periodically
+from .redis_health import watch_redis
+from .profiling import ProfilingMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import logging
 
-settings = Settings()
+settings = get_settings()
 
 logging.basicConfig(level=logging.getLevelName(settings.logging_level))
 logger = logging.getLogger(__name__)
 logger.info("Logging level set to %s (%s)" % (settings.logging_level, logging.getLevelName(settings.logging_level)))
-app = FastAPI()
+
+
+async def wait_for_task(task: asyncio.Task):
+    # Wait for a background task to end on shutdown. If it failed, that's logged and the shutdown carries on.
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    except Exception as exc:
+        logger.error(f"Background task {task.get_name()} raised an exception: {exc!r}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create this worker's Redis clients (connection pools)
+    await open_redis_clients()
+
+    # Load the fallback cache file (if any), with a connection of this worker's own
+    if settings.fallback_cache_path:
+        fallback_cache.open(settings.fallback_cache_path)
+
+    # Keep this worker's local cache in sync with the other workers
+    start_invalidation_listener()
+
+    # Start hot: load the SWAPI snapshot (if any) into the cache before accepting traffic, and precompute the popular
+    # variants of the top list from it in the background
+    if await load_snapshot_file(settings.snapshot_path):
+        await character.precompute_top_variants()
+    background_tasks = []
+    if settings.snapshot_refresh_interval > 0:
+        background_tasks.append(asyncio.create_task(refresh_periodically(settings.snapshot_refresh_interval,
+                                                                         settings.snapshot_path)))
+
+    # Deliver the queued CSVs to httpbin.org in the background
+    delivery_stopping = asyncio.Event()
+    delivery_worker = None
+    if settings.delivery_worker_enabled:
+        delivery_worker = asyncio.create_task(run_delivery_worker(delivery_stopping))
+
+    # Reconnect to Redis in the background if it goes down (meanwhile the fallback cache is served)
+    background_tasks.append(asyncio.create_task(watch_redis(settings.redis_reconnect_interval)))
+
+    # Add this worker's metrics to the totals shared by all the workers
+    if settings.metrics_enabled:
+        background_tasks.append(asyncio.create_task(flush_periodically(settings.metrics_flush_interval)))
+
+    yield
+
+    # Let the delivery worker finish the job it's delivering (if any), the other tasks are just cancelled
+    delivery_stopping.set()
+    if delivery_worker is not None:
+        await wait_for_task(delivery_worker)
+    for task in background_tasks:
+        task.cancel()
+        await wait_for_task(task)
+    flush()
+    stop_invalidation_listener()
+    # Close the pooled upstream and Redis connections of this worker
+    await close_upstream_client()
+    await close_redis_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Middlewares
 app.add_middleware(
@@ -22,8 +93,13 @@ app.add_middleware(
     allow_methods=settings.allowed_methods,
     allow_headers=settings.allowed_headers
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
 
 # Routes
-app.include_router(general.router, dependencies=[Depends(get_redis_client)])
-app.include_router(character.router, dependencies=[Depends(get_redis_client)])
\ No newline at end of file
+app.include_router(general.router, dependencies=[Depends(async_redis_dependency)])
+app.include_router(character.router, dependencies=[Depends(async_redis_dependency)])
+app.include_router(delivery.router, dependencies=[Depends(async_redis_dependency)])
+app.include_router(admin.router, dependencies=[Depends(async_redis_dependency)])
+app.include_router(profiling.router, dependencies=[Depends(async_redis_dependency)])
\ No newline at end of file
@@ -0,0 +1,80 @@
+# ./app/src/appearances.py
+
+from typing import List, Tuple
+from collections import Counter
+from .utils import get_async_redis_client
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+import hashlib
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+APPEARANCES_KEY = "character_appearances"  # Sorted set: character url -> appearances score
+APPEARANCES_FILMS_HASH_KEY = "character_appearances:films_hash"  # Hash of the films data the index was built from
+
+# Scores are appearances * TIE_BREAK_SCALE - order of first appearance, so characters with the same number of
+# appearances keep the order in which they first show up in the films (the order a stable sort would give).
+TIE_BREAK_SCALE = 1000000
+
+indexed_films_hash = None  # Hash of the films data this worker last checked the index against
+
+
+def films_hash(films_data: dict) -> str:
+    # Only the character lists matter for the index
+    characters = [film["characters"] for film in films_data["results"]]
+    return hashlib.sha256(json.dumps(characters).encode("utf-8")).hexdigest()
+
+
+def appearance_counts(films_data: dict) -> Counter:
+    # Character url -> appearances, in order of first appearance (most_common keeps that order for ties)
+    appearances = Counter()
+    for film in films_data["results"]:
+        appearances.update(film["characters"])
+    return appearances
+
+
+async def update_appearance_index(films_data: dict, force: bool = False):
+    # Rebuild the appearance index, but only if the films data changed since it was built (by any worker)
+    global indexed_films_hash
+
+    current_hash = films_hash(films_data)
+    if current_hash == indexed_films_hash and not force:
+        return
+
+    redis_client = get_async_redis_client()
+    stored_hash = await redis_client.get(APPEARANCES_FILMS_HASH_KEY)
+    if force or stored_hash is None or stored_hash.decode("utf-8") != current_hash:
+        logger.info(" - Rebuilding the character appearance index")
+        appearances = appearance_counts(films_data)
+        scores = {url: count * TIE_BREAK_SCALE - order for order, (url, count) in enumerate(appearances.items())}
+
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(APPEARANCES_KEY)
+            if scores:
+                pipe.zadd(APPEARANCES_KEY, scores)
+            pipe.set(APPEARANCES_FILMS_HASH_KEY, current_hash)
+            await pipe.execute()
+
+    indexed_films_hash = current_hash
+
+
+async def top_appearances(films_data: dict, n: int, use_cache: bool = True) -> List[Tuple[str, int]]:
+    # Return the n characters with the most appearances as (url, appearances), most appearances first.
+    # The sorted set only hands back the top n, there's no full sort of all the characters.
+    # With use_cache=False, or while Redis is down, they're counted in process instead (same order).
+    if not use_cache or not redis_available():
+        return appearance_counts(films_data).most_common(n)
+    try:
+        await update_appearance_index(films_data)
+        entries = await get_async_redis_client().zrevrange(APPEARANCES_KEY, 0, n - 1, withscores=True)
+        if not entries and any(film["characters"] for film in films_data["results"]):
+            # The index is gone (e.g. Redis was flushed), rebuild it
+            await update_appearance_index(films_data, force=True)
+            entries = await get_async_redis_client().zrevrange(APPEARANCES_KEY, 0, n - 1, withscores=True)
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        return appearance_counts(films_data).most_common(n)
+
+    return [(url.decode("utf-8"), -(-int(score) // TIE_BREAK_SCALE)) for url, score in entries]
@@ -0,0 +1,71 @@
+# ./app/src/batch_loader.py
+
+# Dependency-driven fan-out: callers ask for keys one at a time, as soon as they know them, and get a future per key.
+# The keys asked for within the same event loop iteration are loaded with a single batch call (so a warm cache is
+# still read in one round trip), every key is only loaded once, and every future resolves as soon as its own data
+# arrives, not when the whole batch is done. So a step that depends on a key (e.g. the species of a character)
+# starts as soon as that key is there, instead of waiting for the slowest key of the batch.
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import time
+
+
+# load_many(keys, on_result=...) loads the keys, calling on_result(key, data) as each one arrives (data is the raised
+# exception for the failed ones), and returns a dict key -> data with all of them
+LoadMany = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+class BatchLoader:
+
+    def __init__(self, load_many: LoadMany):
+        self.load_many = load_many
+        self.futures = {}  # key -> asyncio.Future of its data
+        self.pending = []  # Keys asked for in this event loop iteration, not loaded yet
+        self.tasks = set()  # Running batches (referenced so they aren't garbage collected)
+        self.started_at = None  # When the first batch started and the last key arrived (perf_counter)
+        self.finished_at = None
+
+    def load(self, key: str) -> asyncio.Future:
+        future = self.futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.futures[key] = loop.create_future()
+            if not self.pending:
+                loop.call_soon(self.dispatch)
+            self.pending.append(key)
+        return future
+
+    def dispatch(self):
+        batch, self.pending = self.pending, []
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        task = asyncio.ensure_future(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: List[str]):
+        try:
+            results = await self.load_many(batch, on_result=self.resolve)
+        except Exception as exc:
+            results = {key: exc for key in batch}
+        # Keys load_many didn't report as they arrived
+        for key in batch:
+            self.resolve(key, results.get(key, LookupError(f"{key} wasn't loaded")))
+
+    def resolve(self, key: str, data: Any):
+        future = self.futures[key]
+        if future.done():
+            return
+        self.finished_at = time.perf_counter()
+        if isinstance(data, BaseException):
+            future.set_exception(data)
+            future.exception()  # Retrieved, there may be no caller waiting for it anymore
+        else:
+            future.set_result(data)
+
+    def elapsed(self) -> Optional[float]:
+        # From the first batch to the last key, None if nothing was loaded
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
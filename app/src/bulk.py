@@ -0,0 +1,207 @@
+# ./app/src/bulk.py
+
+# Bulk store of the SWAPI people and species.
+#
+# Instead of fetching characters and species one URL at a time, whole collections are crawled (10 entities per
+# request, pages fetched in parallel) into Redis hashes keyed by id. Lookups are then served from those hashes, so
+# the number of upstream requests doesn't depend on how many characters a query touches.
+# The store is crawled on first use (once, across workers), and re-crawled in the background once it's older than
+# settings.bulk_store_ttl.
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from .config import get_settings
+from .utils import get_async_redis_client
+from .circuit_breaker import upstream_get
+from .cache import INVALIDATION_CHANNEL, LocalCache, content_hash, invalidation_listeners, invalidation_message
+from .dependencies import entities_written, entity_key
+from .codec import decode, encode, project
+from .schemas import Character, Species
+from .singleflight import single_flight
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+import asyncio
+import logging
+import math
+import time
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+BULK_RESOURCES = {"people": Character, "species": Species}  # Resource -> schema its entities are validated against
+
+# In front of the hashes, dropped whenever a worker replaces one of them (see on_invalidation)
+local_entities = LocalCache(settings.local_cache_max_entries, settings.local_cache_ttl)
+
+refreshing = set()  # Resources being re-crawled in the background by this worker
+background_tasks = set()
+
+
+def store_key(resource: str) -> str:
+    return f"swapi:{resource}"  # Hash: entity id -> entity JSON
+
+
+def ingested_at_key(resource: str) -> str:
+    return f"swapi:{resource}:ingested_at"
+
+
+def entity_id(url: str) -> str:
+    # https://swapi.dev/api/people/1/ -> 1
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+async def crawl_collection(resource: str) -> List[dict]:
+    # Fetch every item of a paginated SWAPI collection. The first page tells how many pages there are, the rest are
+    # fetched in parallel (at most settings.bulk_crawl_concurrency at a time).
+    url = f"{settings.swapi_base_url}/{resource}/"
+    first_page = await fetch_page(resource, url)
+    page_size = len(first_page["results"]) or 1
+    pages = math.ceil(first_page["count"] / page_size) if first_page.get("next") else 1
+
+    semaphore = asyncio.Semaphore(settings.bulk_crawl_concurrency)
+
+    async def bounded(number):
+        async with semaphore:
+            return await fetch_page(resource, f"{url}?page={number}")
+
+    logger.info(f" - Crawling {pages} pages of {url}")
+    other_pages = await asyncio.gather(*[bounded(number) for number in range(2, pages + 1)])
+    return [item for page in [first_page, *other_pages] for item in page["results"]]
+
+
+async def fetch_page(resource: str, url: str) -> dict:
+    response = await upstream_get(resource, url)
+    if response.status_code != 200:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Unable to fetch {resource} data")
+    return response.json()
+
+
+async def store_entities(resource: str, items: Iterable[dict], ingested_at: Optional[float] = None):
+    # Replace the resource's hash with the items (atomically, readers never see a half-written store).
+    # Items that don't match the resource's schema are left out, they're fetched one by one if they're needed.
+    entities = {}
+    versions = {}
+    for item in items:
+        try:
+            BULK_RESOURCES[resource](**item)
+            projected = project(item, BULK_RESOURCES[resource])
+            entities[entity_id(item["url"])] = encode(projected)
+            versions[entity_key(item["url"])] = content_hash(projected)
+        except (ValidationError, KeyError) as e:
+            logger.error(f"Skipping invalid {resource} entity {item.get('url')}: {e}")
+
+    ttl = max(settings.bulk_store_ttl, settings.cache_stale_if_error_ttl)
+    async with get_async_redis_client().pipeline(transaction=True) as pipe:
+        if entities:
+            pipe.hset(f"{store_key(resource)}:new", mapping=entities)
+            pipe.rename(f"{store_key(resource)}:new", store_key(resource))
+            pipe.expire(store_key(resource), ttl)
+        else:
+            pipe.delete(store_key(resource))
+        pipe.setex(ingested_at_key(resource), ttl, ingested_at or time.time())
+        pipe.publish(INVALIDATION_CHANNEL, invalidation_message(store_key(resource)))
+        await pipe.execute()
+    logger.info(f" - Stored {len(entities)} {resource} in the bulk store")
+
+    # Drop this worker's copies (the other workers drop theirs on the invalidation, the derived entries are
+    # recomputed here) and propagate what changed
+    local_entities.clear()
+    await entities_written(versions)
+
+
+def on_invalidation(key: str):
+    # Another worker replaced a resource's hash: the entities this worker has in memory may be outdated
+    if key in {store_key(resource) for resource in BULK_RESOURCES}:
+        local_entities.clear()
+
+
+invalidation_listeners.append(on_invalidation)
+
+
+async def ingest(resource: str) -> float:
+    # Crawl the collection into the store and return when it was ingested
+    ingested_at = time.time()
+    await store_entities(resource, await crawl_collection(resource), ingested_at)
+    return ingested_at
+
+
+async def read_ingested_at(resource: str) -> Optional[float]:
+    ingested_at = await get_async_redis_client().get(ingested_at_key(resource))
+    return float(ingested_at) if ingested_at is not None else None
+
+
+async def get_entities(resource: str, urls: List[str]) -> Dict[str, Optional[dict]]:
+    # Look up the entities by URL in the bulk store (url -> data, None for the ones it doesn't have).
+    # The store is crawled first if it's empty, and refreshed in the background if it's stale.
+    # While Redis is down, only the entities this worker has in memory are returned.
+    results = {url: local_entities.get(f"{resource}:{entity_id(url)}") for url in urls}
+    missing = [url for url, data in results.items() if data is None]
+    if not missing or not redis_available():
+        return results
+
+    async with get_async_redis_client().pipeline(transaction=False) as pipe:
+        pipe.get(ingested_at_key(resource))
+        pipe.hmget(store_key(resource), [entity_id(url) for url in missing])
+        ingested_at, values = await pipe.execute()
+
+    await ensure_ingested(resource, ingested_at)
+    if ingested_at is None:
+        values = await get_async_redis_client().hmget(store_key(resource), [entity_id(url) for url in missing])
+
+    for url, value in zip(missing, values):
+        data = decode(value) if value is not None else None
+        if data is not None:
+            results[url] = data
+            local_entities.set(f"{resource}:{entity_id(url)}", data)
+    return results
+
+
+async def get_all(resource: str) -> Tuple[float, List[dict]]:
+    # Every entity in the bulk store (in id order) and when they were ingested, crawling the store first if needed
+    redis_client = get_async_redis_client()
+    ingested_at = await ensure_ingested(resource, await redis_client.get(ingested_at_key(resource)))
+    values = await redis_client.hgetall(store_key(resource))
+    ids = sorted(values, key=lambda id: (len(id), id))  # Numeric ids, as bytes
+    entities = [decode(values[id]) for id in ids]
+    return ingested_at, [entity for entity in entities if entity is not None]
+
+
+async def ensure_ingested(resource: str, ingested_at: Optional[bytes]) -> float:
+    # Crawl the store if it's empty (waiting for it) or in the background if it's stale, and return when it was ingested
+    if ingested_at is None:
+        # Only one crawl runs (across workers too), concurrent callers wait for it
+        return await single_flight(f"bulk:{resource}", lambda: ingest(resource), lambda: read_ingested_at(resource))
+    if time.time() - float(ingested_at) > settings.bulk_store_ttl:
+        await schedule_ingest(resource)
+    return float(ingested_at)
+
+
+async def schedule_ingest(resource: str):
+    # Re-crawl the resource in the background unless it's already being re-crawled, in this worker or any other one
+    if resource in refreshing:
+        return
+    lease_ttl = int(settings.single_flight_lease_ttl)
+    if not await get_async_redis_client().set(f"refresh:bulk:{resource}", 1, nx=True, ex=lease_ttl):
+        return
+
+    refreshing.add(resource)
+    task = asyncio.get_running_loop().create_task(_ingest_in_background(resource))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def _ingest_in_background(resource: str):
+    try:
+        await ingest(resource)
+    except Exception as exc:
+        # The stale store is still there, the next lookup will try again
+        logger.error(f"Background crawl of {resource} raised an exception: {exc}")
+    finally:
+        refreshing.discard(resource)
+        try:
+            await get_async_redis_client().delete(f"refresh:bulk:{resource}")
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
@@ -0,0 +1,505 @@
+# ./app/src/cache.py
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import Counter, OrderedDict
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+from .config import get_settings
+from .utils import get_async_redis_client, get_redis_client
+from .metrics import increment, timed
+from .codec import decode, encode
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+# Cache states, also returned to clients in the X-Cache response header
+FRESH = "fresh"  # Younger than the soft TTL
+STALE = "stale"  # Older than the soft TTL but younger than the hard TTL, served while a refresh runs in the background
+MISS = "miss"    # Not cached (or older than the hard TTL), fetched synchronously
+STALE_IF_ERROR = "stale-if-error"  # Older than the hard TTL, only served because fetching it again failed
+
+INVALIDATION_CHANNEL = "cache_invalidation"  # Redis pub/sub channel used to drop entries from every worker's local cache
+worker_id = uuid.uuid4().hex  # Identifies the invalidations published by this worker
+
+refreshing = set()  # Keys being refreshed in the background by this worker
+background_tasks = set()  # Keep a reference to the running refresh tasks so they aren't garbage collected
+
+key_ttls = {}  # Key -> function returning its (soft TTL, hard TTL), for the keys that don't use settings.cache_ttl
+# and cache_hard_ttl. They're resolved on every use, so they follow changes to the settings.
+write_listeners = []  # async functions(items) called after entries are written to Redis (see dependencies.py)
+invalidation_listeners = []  # functions(key) called, on the listener thread, for the other workers' invalidations
+
+
+def after_fork():
+    # A worker forked from a preloaded master (gunicorn preload_app) must not take its invalidations for the master's
+    # (or another worker's)
+    global worker_id
+    worker_id = uuid.uuid4().hex
+
+
+os.register_at_fork(after_in_child=after_fork)
+
+
+class LocalCache:
+    # Size-bounded, per-worker LRU cache where every entry also has its own TTL.
+    # It holds already decoded objects that are shared by every caller, so they must be treated as read-only.
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self.lock = threading.Lock()  # Invalidations arrive on the pub/sub listener thread
+        self.stats = Counter(hits=0, misses=0, evictions=0)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None and item[0] <= time.time():
+                del self.entries[key]
+                self.stats["evictions"] += 1
+                self.evicted(key)
+                item = None
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                evicted_key, _ = self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+                self.evicted(evicted_key)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.evicted(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def evicted(self, key: str):
+        # Called (with the lock held) whenever an entry is dropped
+        pass
+
+
+class FallbackCache(LocalCache):
+    # Per-worker copy of the Redis cache entries, served while Redis is down so an outage costs hit rate rather than
+    # availability. Every entry written to (or read from) Redis is also kept here, least recently used first out.
+    # With a path, it's persisted to a sqlite file (loaded on startup), so a worker restarted during an outage still
+    # has it. Persistence is best effort: sqlite errors are logged and the in-process copy keeps working.
+
+    def __init__(self, max_entries: int, ttl: float, path: Optional[str] = None):
+        super().__init__(max_entries, ttl)
+        self.db = None
+        if path:
+            self.open(path)
+
+    def open(self, path: str):
+        # Every worker opens its own connection (a sqlite connection can't be shared with forked processes), so the
+        # app's one is opened on startup, not on import. sqlite3 is only imported if there's a file.
+        import sqlite3
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")  # Workers can share the file
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires_at REAL, value BLOB)")
+            self.load()
+        except sqlite3.Error as exc:
+            logger.error(f"Unable to open the fallback cache file {path}: {exc}")
+            self.db = None
+
+    def load(self):
+        # Most recently expiring entries first, up to max_entries
+        self.db.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        rows = self.db.execute("SELECT key, expires_at, value FROM entries ORDER BY expires_at DESC LIMIT ?",
+                               (self.max_entries,)).fetchall()
+        with self.lock:
+            for key, expires_at, value in reversed(rows):
+                entry = decode_entry(value)
+                if entry is not None:
+                    self.entries[key] = (expires_at, entry)
+        logger.info(f" - Loaded {len(self.entries)} entries into the fallback cache")
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        super().set(key, value, ttl)
+        if self.db is not None:
+            expires_at = time.time() + (self.ttl if ttl is None else min(ttl, self.ttl))
+            self.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, expires_at, encode(value)))
+
+    def holds(self, key: str, entry: dict) -> bool:
+        # Whether this version of the entry is already kept (then so is its row in the file), made most recently used
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None or (item[1]["fetched_at"], item[1].get("hash")) != (entry["fetched_at"], entry.get("hash")):
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def clear(self):
+        super().clear()
+        if self.db is not None:
+            self.execute("DELETE FROM entries")
+
+    def evicted(self, key: str):
+        if self.db is not None:
+            self.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def execute(self, statement: str, parameters: tuple = ()):
+        import sqlite3  # Already imported by open()
+        try:
+            self.db.execute(statement, parameters)
+        except sqlite3.Error as exc:
+            logger.warning(f"Fallback cache file error: {exc}")
+
+
+local_cache = LocalCache(settings.local_cache_max_entries, settings.local_cache_ttl)  # L1, in front of Redis (L2)
+# Served instead of Redis while it's down. Its file (settings.fallback_cache_path) is opened on startup.
+fallback_cache = FallbackCache(settings.fallback_cache_max_entries, settings.cache_stale_if_error_ttl)
+redis_stats = Counter(hits=0, misses=0)
+
+invalidation_listener = None  # Thread listening to the invalidation channel
+
+
+def content_hash(data: Any) -> str:
+    # Stable hash of the data (the same data always gives the same hash, whatever the order of the dict keys)
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def decode_entry(data: bytes) -> Optional[dict]:
+    # A cache entry ({"fetched_at", "hash", "data"}), None if it can't be decoded or isn't one (e.g. a value stored
+    # under the same key by a version of the app that didn't wrap them)
+    entry = decode(data)
+    if not isinstance(entry, dict) or "fetched_at" not in entry or "data" not in entry:
+        return None
+    return entry
+
+
+def cache_set_ttls(key: str, resolve: Callable[[], Tuple[int, int]]):
+    key_ttls[key] = resolve
+
+
+def ttls(key: str) -> Tuple[int, int]:
+    resolve = key_ttls.get(key)
+    return resolve() if resolve is not None else (settings.cache_ttl, settings.cache_hard_ttl)
+
+
+async def cache_get(key: str) -> Tuple[Optional[Any], str]:
+    # Read a cached entry and classify it as fresh or stale. Redis drops the entry at the hard TTL.
+    # Hot entries are served from the local cache without any network I/O.
+    return (await cache_get_many([key]))[key]
+
+
+async def cache_get_with_hash(key: str) -> Tuple[Optional[Any], str, Optional[str]]:
+    # Same as cache_get, plus the content hash stored next to the data (None on a miss)
+    entry = (await cache_get_entries([key]))[key]
+    state = MISS if entry is None else entry_state(key, entry)
+    if state == MISS:
+        return None, MISS, None
+    return entry["data"], state, entry.get("hash") or content_hash(entry["data"])
+
+
+async def cache_get_last_good(key: str) -> Tuple[Optional[Any], Optional[str]]:
+    # The last cached data and its hash, even if it's older than the hard TTL (kept until the stale-if-error TTL).
+    # Only meant to be served when fetching the data again failed.
+    entry = (await cache_get_entries([key]))[key]
+    if entry is None:
+        return None, None
+    return entry["data"], entry.get("hash") or content_hash(entry["data"])
+
+
+async def cache_get_many(keys: List[str]) -> Dict[str, Tuple[Optional[Any], str]]:
+    # Same as cache_get, but every key missing from the local cache is read from Redis in a single MGET
+    results = {}
+    for key, entry in (await cache_get_entries(keys)).items():
+        state = MISS if entry is None else entry_state(key, entry)
+        results[key] = (None if state == MISS else entry["data"], state)
+    return results
+
+
+async def cache_get_entries(keys: List[str]) -> Dict[str, Optional[dict]]:
+    # Read the raw cache entries ({"fetched_at", "hash", "data"}), None for the missing ones.
+    # Entries older than the hard TTL are kept in Redis (never in the local cache) until the stale-if-error TTL.
+    # While Redis is down, the entries missing from the local cache are read from the fallback cache instead.
+    entries = {key: local_cache.get(key) for key in keys}
+    missing = [key for key, entry in entries.items() if entry is None]
+    increment("cache_lookups_total", len(keys) - len(missing), tier="local", result="hit")
+    if not missing:
+        return entries
+
+    increment("cache_lookups_total", len(missing), tier="local", result="miss")
+    values = await redis_mget(missing)
+    if values is None:
+        for key in missing:
+            entries[key] = fallback_cache.get(key)
+            increment("cache_lookups_total", tier="fallback", result="miss" if entries[key] is None else "hit")
+        return entries
+
+    for key, cache_data in zip(missing, values):
+        if not bool(cache_data):
+            redis_stats["misses"] += 1
+            increment("cache_lookups_total", tier="redis", result="miss")
+            continue
+        entry = decode_entry(cache_data)
+        if entry is None:
+            # Written in a format this worker can't read (e.g. by a newer or an older version), fetched again
+            redis_stats["misses"] += 1
+            increment("cache_lookups_total", tier="redis", result="miss")
+            continue
+        redis_stats["hits"] += 1
+        increment("cache_lookups_total", tier="redis", result="hit")
+        local_ttl = entry["fetched_at"] + ttls(key)[1] - time.time()
+        if local_ttl > 0:
+            local_cache.set(key, entry, local_ttl)
+        if not fallback_cache.holds(key, entry):
+            # Only a version this worker hasn't kept yet is written (with a file, that's a sqlite write on the loop)
+            fallback_cache.set(key, entry, entry["fetched_at"] + settings.cache_stale_if_error_ttl - time.time())
+        entries[key] = entry
+    return entries
+
+
+async def redis_mget(keys: List[str]) -> Optional[List[Optional[bytes]]]:
+    # MGET the keys, None if Redis is down (known to be, or found to be now)
+    if not redis_available():
+        return None
+    try:
+        with timed("redis_command_duration_seconds", command="mget"):
+            return await get_async_redis_client().mget(keys)
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        return None
+
+
+def entry_state(key: str, entry: dict) -> str:
+    age = time.time() - entry["fetched_at"]
+    ttl, hard_ttl = ttls(key)
+    state = FRESH if age < ttl else STALE if age < hard_ttl else MISS
+    logger.debug(f" - Cache {state} for {key} (age: {age:.1f} seconds)")
+    return state
+
+
+async def cache_set(key: str, data: Any):
+    # Store an entry together with the time it was fetched. It's served until the hard TTL, and kept in Redis until
+    # the stale-if-error TTL in case SWAPI fails by then.
+    # The other workers are told to drop their local copy so they don't keep serving the old one.
+    await cache_set_many({key: data})
+
+
+async def cache_set_many(items: Dict[str, Any]):
+    # Same as cache_set, but all the entries are written in a single pipelined round trip.
+    # The content hash of every entry is stored with it, so readers can tell whether the data changed.
+    # The entries are also kept in the fallback cache, and only there while Redis is down.
+    if not items:
+        return
+    fetched_at = time.time()
+    entries = {key: {"fetched_at": fetched_at, "hash": content_hash(data), "data": data} for key, data in items.items()}
+    for key, entry in entries.items():
+        local_cache.set(key, entry, ttls(key)[1])
+        fallback_cache.set(key, entry, settings.cache_stale_if_error_ttl)
+    if not redis_available():
+        return
+
+    try:
+        async with get_async_redis_client().pipeline(transaction=False) as pipe:
+            for key, entry in entries.items():
+                pipe.setex(key, max(ttls(key)[1], settings.cache_stale_if_error_ttl), encode(entry))
+                pipe.publish(INVALIDATION_CHANNEL, invalidation_message(key))
+            with timed("redis_command_duration_seconds", command="set"):
+                await pipe.execute()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        return
+    for listener in write_listeners:
+        await listener(items)
+
+
+async def cache_invalidate(key: str):
+    # Drop an entry from Redis and from the local cache of every worker
+    local_cache.delete(key)
+    fallback_cache.delete(key)
+    if not redis_available():
+        return
+    try:
+        async with get_async_redis_client().pipeline(transaction=False) as pipe:
+            pipe.delete(key)
+            pipe.publish(INVALIDATION_CHANNEL, invalidation_message(key))
+            await pipe.execute()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+
+
+def invalidation_message(key: str) -> str:
+    # What's published on the invalidation channel for key (the other workers drop their copies of it)
+    return f"{worker_id}:{key}"
+
+
+def cache_stats() -> dict:
+    # Hit/miss/eviction counters per cache tier. Redis evictions are the server-wide evicted keys.
+    redis_evictions = None
+    try:
+        if redis_available():
+            redis_evictions = get_redis_client().info("stats").get("evicted_keys")
+    except RedisError as exc:
+        logger.warning(f"Unable to read the Redis stats: {exc}")
+
+    return {
+        "local": {**local_cache.stats, "size": len(local_cache.entries)},
+        "redis": {**redis_stats, "evictions": redis_evictions},
+        "fallback": {**fallback_cache.stats, "size": len(fallback_cache.entries)}
+    }
+
+
+def start_invalidation_listener():
+    # Listen (on a background thread) to the invalidations published by the other workers
+    global invalidation_listener
+
+    def on_invalidation(message):
+        origin, key = message["data"].decode("utf-8").split(":", 1)
+        if origin != worker_id:
+            local_cache.delete(key)
+            for listener in invalidation_listeners:
+                listener(key)
+
+    def on_error(exc, pubsub, thread):
+        # Redis is unreachable, local entries still expire on their own TTL meanwhile
+        logger.warning(f"Cache invalidation listener error: {exc}")
+        time.sleep(1)
+
+    try:
+        pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: on_invalidation})
+        invalidation_listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=on_error)
+    except RedisError as exc:
+        logger.warning(f"Unable to start the cache invalidation listener: {exc}")
+
+
+def stop_invalidation_listener():
+    global invalidation_listener
+
+    if invalidation_listener is not None:
+        invalidation_listener.stop()
+        invalidation_listener = None
+
+
+async def get_or_fetch(key: str, fetch: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+    # Stale-while-revalidate read: fresh entries are returned as they are, stale entries are returned immediately
+    # while a single background task refreshes them, and misses are fetched (and cached) synchronously.
+    # If fetching a miss fails (e.g. SWAPI is down or its circuit breaker is open), the last good data is served.
+    entry = (await cache_get_entries([key]))[key]
+    state = MISS if entry is None else entry_state(key, entry)
+    if state == STALE:
+        await schedule_refresh(key, fetch)
+    elif state == MISS:
+        try:
+            data = await fetch()
+        except HTTPException as exc:
+            if entry is None or exc.status_code < 500:
+                raise
+            logger.warning(f" - Serving the last good data for {key}, fetching it failed: {exc.detail}")
+            return entry["data"], STALE_IF_ERROR
+        await cache_set(key, data)
+        return data, state
+    return entry["data"], state
+
+
+async def get_or_fetch_many(fetchers: Dict[str, Callable[[], Awaitable[Any]]], use_cache: bool = True,
+                            on_result: Optional[Callable[[str, Any], None]] = None,
+                            accept: Optional[Callable[[Any], bool]] = None) -> Dict[str, Any]:
+    # Same as get_or_fetch for several keys at once: they are read in one round trip, only the misses are fetched
+    # (concurrently, the upstream scheduler bounds the calls) and they're written back in one round trip.
+    # A failed fetch doesn't stop the others, its exception is returned in place of the data (unless there's last
+    # good data to serve instead).
+    # on_result(key, data), if given, is called as soon as each key's data is known, before the others are fetched.
+    # accept(data), if given, checks the cached data: entries it rejects are fetched again, like misses.
+    # With use_cache=False nothing is read from or written to the cache.
+    results = {}
+    entries = await cache_get_entries(list(fetchers)) if use_cache else {key: None for key in fetchers}
+    missing = []
+    for key, entry in entries.items():
+        if entry is not None and accept is not None and not accept(entry["data"]):
+            logger.warning(f" - Cached data of {key} is invalid, fetching it again")
+            entries[key] = entry = None
+        state = MISS if entry is None or not use_cache else entry_state(key, entry)
+        if state == MISS:
+            missing.append(key)
+            continue
+        if state == STALE:
+            await schedule_refresh(key, fetchers[key])
+        results[key] = entry["data"]
+        if on_result is not None:
+            on_result(key, entry["data"])
+
+    fetched = {}
+
+    async def fetch(key):
+        try:
+            data = fetched[key] = await fetchers[key]()
+        except HTTPException as exc:
+            data = exc
+            if exc.status_code >= 500 and entries[key] is not None:
+                logger.warning(f" - Serving the last good data for {key}, fetching it failed: {exc.detail}")
+                data = entries[key]["data"]
+        except Exception as exc:
+            data = exc
+        results[key] = data
+        if on_result is not None:
+            on_result(key, data)
+
+    await asyncio.gather(*[fetch(key) for key in missing])
+    if use_cache:
+        await cache_set_many(fetched)
+    return results
+
+
+async def schedule_refresh(key: str, fetch: Callable[[], Awaitable[Any]]):
+    # Start a background refresh of key unless one is already running, in this worker or in any other one.
+    # While Redis is down, the workers can't coordinate: each one refreshes its own copy.
+    if key in refreshing:
+        return
+    if redis_available():
+        try:
+            lease_ttl = int(settings.single_flight_lease_ttl)
+            if not await get_async_redis_client().set(f"refresh:{key}", 1, nx=True, ex=lease_ttl):
+                return
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+
+    refreshing.add(key)
+    task = asyncio.get_running_loop().create_task(_refresh(key, fetch))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def _refresh(key: str, fetch: Callable[[], Awaitable[Any]]):
+    try:
+        await cache_set(key, await fetch())
+        logger.info(f" - Cache refreshed in the background for {key}")
+    except Exception as exc:
+        # The stale entry is still there (until the hard TTL), the next stale read will try again
+        logger.error(f"Background refresh of {key} raised an exception: {exc}")
+    finally:
+        refreshing.discard(key)
+        if redis_available():
+            try:
+                await get_async_redis_client().delete(f"refresh:{key}")
+            except REDIS_ERRORS as exc:
+                mark_redis_down(exc)
@@ -0,0 +1,146 @@
+# ./app/src/character_index.py
+
+# In-memory, columnar index of the whole cast, answering /characters/query without any Redis or SWAPI call.
+#
+# It's built (once per worker) from the bulk store (people and species) and the cached films data:
+# - One column per field, the numeric ones in compact arrays (unknown values are NaN)
+# - Inverted indexes species id -> characters and film id -> characters
+# - The order of the characters by every numeric field, computed once, so queries never sort
+# It's rebuilt when the data it was built from changes, which is checked at most every settings.local_cache_ttl
+# seconds.
+
+from typing import List, Optional, Tuple
+from array import array
+from fastapi import HTTPException, status
+from .config import get_settings
+from .utils import get_async_redis_client
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+from .bulk import entity_id, get_all, ingested_at_key
+from .appearances import films_hash
+import math
+import time
+
+
+settings = get_settings()
+
+index = None  # The CharacterIndex of this worker
+index_version = None  # (people ingested_at, species ingested_at, films hash) it was built from
+index_films = None  # Films data it was last checked against (the cached object, compared by identity)
+index_checked_at = 0.0
+
+
+def parse_number(value) -> float:
+    # SWAPI numbers are strings like "1,358" or "unknown"
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return math.nan
+
+
+def to_optional(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+class CharacterIndex:
+
+    def __init__(self, people: List[dict], species: List[dict], films: List[dict]):
+        species_names = {entity["url"]: entity["name"] for entity in species}
+        rows = {character["url"]: row for row, character in enumerate(people)}
+
+        self.size = len(people)
+        self.urls = [character["url"] for character in people]
+        self.names = [character["name"] for character in people]
+        self.species = [" & ".join(species_names.get(url, "") for url in character["species"]) for character in people]
+        self.columns = {
+            "height": array("d", (parse_number(character["height"]) for character in people)),
+            "mass": array("d", (parse_number(character["mass"]) for character in people)),
+            "appearances": array("d", (len(character["films"]) for character in people))
+        }
+
+        # Inverted indexes (sets, they're intersected when several filters are given)
+        self.by_species = {}
+        for row, character in enumerate(people):
+            for url in character["species"]:
+                self.by_species.setdefault(entity_id(url), set()).add(row)
+        self.species_ids = {entity["name"].lower(): entity_id(entity["url"]) for entity in species}
+        self.by_film = {entity_id(film["url"]): {rows[url] for url in film["characters"] if url in rows}
+                        for film in films}
+
+        # Every numeric order, characters without a value last (ties keep the SWAPI order)
+        self.orders = {}
+        for field, column in self.columns.items():
+            known = [row for row in range(self.size) if not math.isnan(column[row])]
+            unknown = array("i", (row for row in range(self.size) if math.isnan(column[row])))
+            self.orders[(field, False)] = array("i", sorted(known, key=column.__getitem__)) + unknown
+            self.orders[(field, True)] = array("i", sorted(known, key=lambda row: -column[row])) + unknown
+
+    def row(self, row: int) -> dict:
+        height = to_optional(self.columns["height"][row])
+        return {
+            "name": self.names[row],
+            "species": self.species[row],
+            "height": int(height) if height is not None else None,
+            "mass": to_optional(self.columns["mass"][row]),
+            "appearances": int(self.columns["appearances"][row]),
+            "url": self.urls[row]
+        }
+
+    def query(self, species: Optional[str] = None, film: Optional[int] = None,
+              min_height: Optional[float] = None, max_height: Optional[float] = None,
+              sort: str = "height", descending: bool = True, offset: int = 0, limit: int = 10) -> Tuple[int, List[dict]]:
+        # Return the number of matching characters and the requested page of them.
+        # species is a species id or name, film a film id. Characters of unknown height don't match a height range.
+        candidates = None
+        if species is not None:
+            species_id = species if species.isdigit() else self.species_ids.get(species.lower())
+            candidates = self.by_species.get(species_id, set())
+        if film is not None:
+            film_rows = self.by_film.get(str(film), set())
+            candidates = film_rows if candidates is None else candidates & film_rows
+
+        heights = self.columns["height"]
+        low = -math.inf if min_height is None else min_height
+        high = math.inf if max_height is None else max_height
+        check_height = min_height is not None or max_height is not None
+
+        matches = [row for row in self.orders[(sort, descending)]
+                   if (candidates is None or row in candidates) and (not check_height or low <= heights[row] <= high)]
+        return len(matches), [self.row(row) for row in matches[offset:offset + limit]]
+
+
+async def get_character_index(films_data: dict) -> CharacterIndex:
+    # The index of this worker, rebuilt first if the people, species or films data changed
+    global index_films, index_checked_at
+
+    now = time.time()
+    if index is not None and films_data is index_films and now - index_checked_at < settings.local_cache_ttl:
+        return index
+
+    if redis_available():
+        try:
+            await rebuild_if_changed(films_data)
+            index_films = films_data
+            index_checked_at = now
+            return index
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+
+    # The bulk store is in Redis: while it's down, keep serving the index this worker has (if it has one)
+    if index is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="The character index can't be built while Redis is unavailable")
+    return index
+
+
+async def rebuild_if_changed(films_data: dict):
+    global index, index_version
+
+    people_ingested_at, species_ingested_at = await get_async_redis_client().mget(ingested_at_key("people"),
+                                                                                  ingested_at_key("species"))
+    version = (people_ingested_at, species_ingested_at, films_hash(films_data))
+    if index is None or version != index_version or None in version:
+        people_ingested_at, people = await get_all("people")
+        species_ingested_at, species = await get_all("species")
+        index = CharacterIndex(people, species, films_data["results"])
+        version = (str(people_ingested_at).encode("utf-8"), str(species_ingested_at).encode("utf-8"), version[2])
+    index_version = version
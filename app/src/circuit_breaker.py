@@ -0,0 +1,175 @@
+# ./app/src/circuit_breaker.py
+
+# Circuit breakers for the SWAPI calls, one per resource family (films, people, species).
+#
+# The breaker state lives in Redis, so every worker sees it: once a family fails settings.breaker_failure_threshold
+# times within settings.breaker_failure_window seconds, its breaker opens and calls fail fast (no request is sent)
+# for settings.breaker_open_seconds. After that it's half-open: a single probe request is let through, and it closes
+# the breaker if it succeeds or opens it again if it fails.
+# Failed URLs are also cached (negative caching) for settings.negative_cache_ttl seconds, so a URL that just failed
+# isn't requested again by every caller.
+# While Redis is down there are no breakers: every call goes through (timeouts still apply).
+
+from typing import Dict
+from fastapi import HTTPException, status
+from .config import get_settings
+from .utils import get_async_redis_client
+from .upstream import scheduler
+from .metrics import observe
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+import httpx
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+FAMILIES = ("films", "people", "species")
+
+# Breaker states
+CLOSED = "closed"        # Requests go through
+OPEN = "open"            # Requests fail fast
+HALF_OPEN = "half-open"  # A single probe request goes through, the rest fail fast
+
+
+def failures_key(family: str) -> str:
+    return f"breaker:{family}:failures"
+
+
+def open_key(family: str) -> str:
+    return f"breaker:{family}:open"
+
+
+def tripped_key(family: str) -> str:
+    # Set while the breaker hasn't closed again since it last opened (it's half-open once the open key expires)
+    return f"breaker:{family}:tripped"
+
+
+def probe_key(family: str) -> str:
+    return f"breaker:{family}:probe"
+
+
+def negative_key(url: str) -> str:
+    return f"negative:{url}"
+
+
+async def breaker_state(family: str) -> str:
+    is_open, tripped = await get_async_redis_client().mget(open_key(family), tripped_key(family))
+    return OPEN if is_open else HALF_OPEN if tripped else CLOSED
+
+
+async def breaker_states() -> Dict[str, str]:
+    # State of every breaker, for the health check
+    try:
+        if redis_available():
+            return {family: await breaker_state(family) for family in FAMILIES}
+    except REDIS_ERRORS as exc:
+        logger.warning(f"Unable to read the circuit breaker states: {exc}")
+        mark_redis_down(exc)
+    return {family: "unknown" for family in FAMILIES}
+
+
+async def check_circuit(family: str, url: str) -> bool:
+    # Raise (fail fast) if the URL failed recently or the family's breaker is open. In the half-open state only the
+    # caller that gets the probe slot goes through.
+    # Returns whether the family has recent failures, i.e. whether a success has anything to reset.
+    if not redis_available():
+        return False
+    redis_client = get_async_redis_client()
+    try:
+        negative, is_open, tripped, failures = await redis_client.mget(negative_key(url), open_key(family),
+                                                                        tripped_key(family), failures_key(family))
+        # Half-open: try to get the probe slot (only if the call is going to be made)
+        probing = bool(tripped and negative is None and not is_open) and \
+            await redis_client.set(probe_key(family), 1, nx=True, ex=probe_timeout())
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        return False
+
+    if negative is not None:
+        logger.info(f" - Negative cache hit for {url}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"Unable to fetch {url}: {negative.decode('utf-8')}")
+    if is_open or (tripped and not probing):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=f"SWAPI {family} is unavailable (circuit breaker open), try again later")
+    return bool(tripped or failures)
+
+
+def probe_timeout() -> int:
+    # How long a probe may take before another caller gets to probe
+    return int(settings.upstream_connect_timeout + settings.upstream_read_timeout) + 1
+
+
+async def record_success(family: str):
+    # Close the breaker (if it wasn't closed already) and reset the failure count
+    try:
+        async with get_async_redis_client().pipeline(transaction=False) as pipe:
+            pipe.delete(failures_key(family), tripped_key(family), probe_key(family))
+            await pipe.execute()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+
+
+async def record_failure(family: str, url: str, reason: str):
+    # Count the failure (in a fixed window) and open the breaker once there are too many
+    if not redis_available():
+        return
+    redis_client = get_async_redis_client()
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.incr(failures_key(family))
+            pipe.expire(failures_key(family), settings.breaker_failure_window, nx=True)
+            pipe.setex(negative_key(url), settings.negative_cache_ttl, reason)
+            pipe.exists(tripped_key(family))
+            failures, _, _, tripped = await pipe.execute()
+
+        if failures >= settings.breaker_failure_threshold or tripped:
+            logger.warning(f" - Opening the SWAPI {family} circuit breaker for {settings.breaker_open_seconds} "
+                           f"seconds ({failures} failures, last one: {reason})")
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.setex(open_key(family), settings.breaker_open_seconds, 1)
+                pipe.set(tripped_key(family), 1)
+                pipe.delete(probe_key(family))
+                await pipe.execute()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+
+
+async def upstream_get(family: str, url: str) -> httpx.Response:
+    # GET a SWAPI URL through the family's circuit breaker. Server errors and timeouts count as failures; any other
+    # response counts as a success (SWAPI answered), and a non-200 one (e.g. 404) is also negative cached.
+    # The response is returned whatever its status code.
+    # Concurrent callers asking for the same URL share a single call (and its outcome), see upstream.scheduler.
+    return await scheduler.deduplicate(url, lambda: guarded_get(family, url))
+
+
+async def guarded_get(family: str, url: str) -> httpx.Response:
+    has_failures = await check_circuit(family, url)
+    start = time.perf_counter()
+    try:
+        response = await scheduler.request("GET", url)
+    except httpx.HTTPError as exc:
+        observe("upstream_request_duration_seconds", time.perf_counter() - start, resource=family, status="error")
+        reason = f"{type(exc).__name__} {exc}".strip()
+        logger.error(f"Fetching {url} raised an exception: {reason}")
+        await record_failure(family, url, reason)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Unable to fetch {url}")
+
+    observe("upstream_request_duration_seconds", time.perf_counter() - start, resource=family,
+            status=str(response.status_code))
+    if response.status_code >= 500:
+        await record_failure(family, url, f"SWAPI responded with {response.status_code}")
+        return response
+    if response.status_code != 200 and redis_available():
+        try:
+            await get_async_redis_client().setex(negative_key(url), settings.negative_cache_ttl,
+                                                 f"SWAPI responded with {response.status_code}")
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+    if has_failures:
+        # Closes the breaker if this was the half-open probe, and frees the probe slot
+        await record_success(family)
+    return response
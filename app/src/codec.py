@@ -0,0 +1,86 @@
+# ./app/src/codec.py
+
+# Codec of everything the app stores in Redis (cache entries and bulk store entities).
+#
+# Payloads are encoded with a binary-friendly format (orjson by default, msgpack if it's installed, or the stdlib
+# json), zlib-compressed above a size threshold, and prefixed with a small header:
+#   format version (1 byte) | codec id (1 byte) | flags (1 byte, compressed or not)
+# Every worker can read any codec it has installed, whichever one it writes, so the codec (or the format version)
+# can be changed with a rolling restart: payloads a worker can't read are treated as cache misses and fetched again.
+# Payloads written before the header existed (plain JSON) are still read.
+#
+# SWAPI objects are projected to the fields the app uses (the fields of their schemas) before they're stored.
+
+from typing import Any, Optional, Type
+from pydantic import BaseModel
+from .config import get_settings
+import json
+import logging
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+FORMAT_VERSION = 1
+COMPRESSED = 0x01  # Flag: the encoded payload is zlib-compressed
+COMPRESSION_LEVEL = 1  # Payloads are small, the fastest level compresses them almost as well as the best one
+
+
+def json_dumps(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+CODECS = {"json": (0, json_dumps, json.loads)}  # name -> (id, dumps, loads), for the codecs installed
+
+try:
+    import orjson
+    CODECS["orjson"] = (1, orjson.dumps, orjson.loads)
+except ImportError:
+    pass
+
+try:
+    import msgpack
+    CODECS["msgpack"] = (2, msgpack.packb, msgpack.unpackb)
+except ImportError:
+    pass
+
+CODECS_BY_ID = {codec_id: (name, loads) for name, (codec_id, _, loads) in CODECS.items()}
+
+if settings.cache_codec not in CODECS:
+    logger.warning(f"Cache codec {settings.cache_codec} isn't installed, using json")
+codec_name = settings.cache_codec if settings.cache_codec in CODECS else "json"
+
+
+def encode(value: Any) -> bytes:
+    codec_id, dumps, _ = CODECS[codec_name]
+    payload = dumps(value)
+    flags = 0
+    if 0 < settings.cache_compression_threshold <= len(payload):
+        payload = zlib.compress(payload, COMPRESSION_LEVEL)
+        flags |= COMPRESSED
+    return bytes((FORMAT_VERSION, codec_id, flags)) + payload
+
+
+def decode(data: bytes) -> Optional[Any]:
+    # The decoded value, None if it was written in a format or with a codec this worker can't read, or is corrupt
+    try:
+        if data[:1] in (b"{", b"["):
+            return json.loads(data)  # Written before the header existed
+        if len(data) < 3 or data[0] != FORMAT_VERSION or data[1] not in CODECS_BY_ID:
+            logger.warning(f"Unable to decode a payload (format version {data[:1].hex() or None}, "
+                           f"codec {data[1:2].hex() or None})")
+            return None
+        payload = data[3:]
+        if data[2] & COMPRESSED:
+            payload = zlib.decompress(payload)
+        return CODECS_BY_ID[data[1]][1](payload)
+    except (ValueError, zlib.error) as exc:  # The JSON, orjson and msgpack errors are all ValueErrors
+        logger.warning(f"Unable to decode a payload: {exc}")
+        return None
+
+
+def project(data: dict, schema: Type[BaseModel]) -> dict:
+    # Keep only the fields of the schema, the rest of what SWAPI returns isn't used
+    return {field: data[field] for field in schema.__fields__ if field in data}
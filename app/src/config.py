@@ -1,5 +1,6 @@
 from pydantic import BaseSettings, validator
 from typing import List, Optional
+from functools import lru_cache
 
 
 class Settings(BaseSettings):
@@ -16,12 +17,96 @@ class Settings(BaseSettings):
     redis_port: int = 6379
     redis_db: int = 0
     redis_password: Optional[str] = None
+    redis_url: Optional[str] = None  # e.g. unix:///run/redis/redis.sock?db=0 or rediss://host:6380/0, overrides the above
+    redis_sentinels: List[str] = []  # host:port of the Sentinels, the master is discovered through them if set
+    redis_sentinel_master: str = "mymaster"  # name of the master monitored by the Sentinels
+    redis_max_connections: int = 50  # per worker and per client (async and sync)
+    redis_socket_timeout: float = 5.0  # in seconds
+    redis_socket_connect_timeout: float = 2.0  # in seconds
+    redis_health_check_interval: int = 30  # in seconds, connections idle for longer are checked before they're used
+    redis_retry_attempts: int = 1  # retries (with backoff, on a fresh connection) of a command whose connection failed
+    redis_reconnect_interval: float = 2.0  # in seconds, how often a worker checks whether Redis is back
 
-    # Concurrency settings (for internal concurrent functions)
-    max_concurrent_workers: int = 5
+    # Upstream services
+    swapi_base_url: str = "https://swapi.dev/api"
+    httpbin_url: str = "https://httpbin.org/post"
+
+    # CSV export settings
+    csv_output_path: Optional[str] = "csv/top_10_sorted.csv"  # where the top 10 CSV is saved (empty to not save it)
+
+    # CSV delivery settings (background queue that sends the CSV to httpbin.org)
+    delivery_worker_enabled: bool = True  # run a delivery worker in every app worker
+    delivery_max_attempts: int = 5
+    delivery_backoff_base: float = 1.0  # in seconds, doubled after every failed attempt
+    delivery_backoff_max: float = 60.0  # in seconds
+    delivery_dedup_ttl: int = 86400  # in seconds, an unchanged CSV isn't sent again within this time
+    delivery_visibility_timeout: float = 60.0  # in seconds, jobs stuck this long in delivery are requeued
+    delivery_poll_interval: float = 1.0  # in seconds, how long the worker waits before polling the empty queue again
+
+    # Upstream HTTP client settings (one shared keep-alive connection pool per worker)
+    upstream_max_connections: int = 20
+    upstream_max_keepalive_connections: int = 10
+    upstream_keepalive_expiry: float = 30.0  # in seconds
+    upstream_connect_timeout: float = 5.0  # in seconds
+    upstream_read_timeout: float = 10.0  # in seconds
+
+    # Upstream scheduler settings (limits on the concurrent upstream calls of a worker, whoever makes them)
+    upstream_max_concurrency: int = 20  # all hosts together
+    upstream_host_initial_concurrency: int = 5  # starting limit of each host, adjusted by AIMD
+    upstream_host_min_concurrency: int = 1
+    upstream_host_max_concurrency: int = 10
+    upstream_latency_tolerance: float = 2.0  # calls slower than this times the host's baseline latency mean congestion
+    upstream_decrease_factor: float = 0.5  # the host's limit is multiplied by this on errors or congestion
+    upstream_congestion_samples: int = 3  # slow calls in a row that mean congestion (a single one is just jitter)
+
+    # Circuit breaker settings (one breaker per SWAPI resource family, shared by all the workers through Redis)
+    breaker_failure_threshold: int = 5  # failures within the window that open the breaker
+    breaker_failure_window: int = 30  # in seconds
+    breaker_open_seconds: int = 30  # in seconds, how long requests fail fast before a probe request is let through
+    negative_cache_ttl: int = 5  # in seconds, a URL that failed isn't requested again within this time
 
     # Cache settings
-    cache_ttl: int = 10  # in seconds
+    cache_ttl: int = 10  # in seconds, entries older than this are stale and get refreshed in the background (soft TTL)
+    cache_hard_ttl: int = 300  # in seconds, entries older than this are dropped and fetched synchronously (hard TTL)
+    cache_stale_if_error_ttl: int = 86400  # in seconds, entries are kept this long and served past the hard TTL only if SWAPI is failing
+    local_cache_max_entries: int = 1024  # per worker, least recently used entries are evicted first
+    local_cache_ttl: int = 30  # in seconds, upper bound for how long a worker serves an entry without checking Redis
+    cache_codec: str = "orjson"  # json, orjson or msgpack (pip install msgpack), how entries are encoded in Redis
+    cache_compression_threshold: int = 1024  # in bytes, larger encoded entries are zlib-compressed (0 = never)
+    fallback_cache_max_entries: int = 4096  # per worker, entries also kept in process for when Redis is down
+    fallback_cache_path: Optional[str] = None  # sqlite file the fallback cache is persisted to (empty = memory only)
+    validate_cache_hits: bool = False  # validate cached SWAPI data again on every read (invalid entries are fetched again)
+    derived_cache_ttl: Optional[int] = None  # in seconds, soft TTL of the derived entries (top 10 list), defaults to cache_ttl
+    derived_cache_hard_ttl: Optional[int] = None  # in seconds, hard TTL of the derived entries, defaults to cache_hard_ttl
+    popular_variants: List[str] = ["10:height:desc:json", "10:height:desc:csv", "10:appearances:desc:json",
+                                   "10:name:asc:json"]  # n:sort:order:format, top lists precomputed after each refresh
+
+    # Admin settings
+    admin_token: Optional[str] = None  # X-Admin-Token of the /admin endpoints (unset = they're disabled)
+
+    # Profiling settings (opt-in profiling of single requests, see profiling.py)
+    profiling_allowlist: List[str] = []  # client addresses or networks allowed to ask for a profile (empty = disabled)
+    profiling_sample_rate: float = 1.0  # fraction of the requests asking for a profile that are profiled
+    profiling_interval: float = 0.005  # in seconds, how often the CPU profile samples the stack (0 = wall-clock only)
+    profiling_ttl: int = 3600  # in seconds, how long profiles are kept in Redis
+
+    # Bulk store settings (all the people and species, crawled a page at a time into Redis hashes)
+    bulk_store_enabled: bool = True
+    bulk_store_ttl: int = 3600  # in seconds, the store is re-crawled in the background once it's older than this
+    bulk_crawl_concurrency: int = 4  # pages of a collection fetched in parallel
+
+    # Warm-up settings (snapshot of the SWAPI data loaded into the cache on startup)
+    snapshot_path: Optional[str] = None  # e.g. snapshots/swapi.json.gz, created with: python -m src.warmup
+    snapshot_refresh_interval: int = 0  # in seconds, re-crawl SWAPI periodically to keep the cache hot (0 = disabled)
+
+    # Single-flight settings (coalescing of concurrent cache rebuilds, within and across workers)
+    single_flight_lease_ttl: float = 30.0  # in seconds, how long a rebuild may hold the Redis lease
+    single_flight_wait_timeout: float = 30.0  # in seconds, how long other callers wait before rebuilding themselves
+    single_flight_poll_interval: float = 0.05  # in seconds
+
+    # Metrics settings (/metrics, aggregated across the workers through Redis)
+    metrics_enabled: bool = True
+    metrics_flush_interval: float = 1.0  # in seconds, how often each worker adds its metrics to the shared totals
 
     # CORS
     allowed_origins: List[str] = []
@@ -29,10 +114,17 @@ class Settings(BaseSettings):
     allowed_methods: List[str] = []
     allowed_headers: List[str] = []
 
-    @validator("allowed_origins", "allowed_methods", "allowed_headers", pre=True)
+    @validator("allowed_origins", "allowed_methods", "allowed_headers", "redis_sentinels", "profiling_allowlist",
+               "popular_variants", pre=True)
     def parse_lists(cls, v):
         """Parse comma-separated lists"""
         return [s.strip() for s in v.split(',')] if isinstance(v, str) else v
 
     class Config:
         env_file = ".env"
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    # The settings instance shared by every module: the environment (and .env) is only read once per process
+    return Settings()
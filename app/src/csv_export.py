@@ -0,0 +1,45 @@
+# ./app/src/csv_export.py
+
+from typing import Iterable, Iterator, List, Optional
+import csv
+import io
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = ["name", "species", "height", "appearances"]
+
+
+def iter_csv(rows: Iterable[dict], columns: List[str] = CSV_COLUMNS) -> Iterator[str]:
+    # Stream the rows as CSV text, one line at a time (header first), using the stdlib csv writer.
+    # Only the selected columns are written, in that order. Missing values are written as empty fields.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    def flush() -> str:
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(columns)
+    yield flush()
+    for row in rows:
+        writer.writerow([row.get(column) for column in columns])
+        yield flush()
+
+
+def build_csv(rows: Iterable[dict], columns: List[str] = CSV_COLUMNS) -> bytes:
+    # The whole CSV in memory, ready to be uploaded or saved
+    return "".join(iter_csv(rows, columns)).encode("utf-8")
+
+
+def save_csv(content: bytes, path: Optional[str]):
+    # Save the CSV to disk, creating the folder if it doesn't exist. Nothing is saved if there's no path.
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
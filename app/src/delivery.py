@@ -0,0 +1,222 @@
+# ./app/src/delivery.py
+
+# Background delivery of the top 10 CSV to httpbin.org, off the request path.
+#
+# Jobs are queued in a Redis list and moved to a processing list while they're being delivered, so they survive
+# a worker restart. Failed deliveries are retried with exponential backoff (a sorted set holds them until they're
+# due), and a CSV whose content hash was already queued or delivered isn't sent again.
+# The worker runs in the event loop of every app worker, so it only uses the asyncio Redis client, and it waits
+# while Redis is down instead of polling it.
+
+from typing import Optional, Tuple
+from .config import get_settings
+from .utils import get_async_redis_client
+from .upstream import scheduler
+from .cache import LocalCache
+from .metrics import timed
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+from contextlib import suppress
+import asyncio
+import hashlib
+import httpx
+import logging
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+QUEUE_KEY = "csv_delivery:queue"  # Jobs waiting to be delivered
+PROCESSING_KEY = "csv_delivery:processing"  # Jobs being delivered right now
+RETRY_KEY = "csv_delivery:retry"  # Jobs waiting for their next attempt (score: when it's due)
+LAST_JOB_KEY = "csv_delivery:last_job"
+
+recent_jobs = LocalCache(max_entries=16, ttl=settings.local_cache_ttl)  # Content hash -> job id queued by this worker
+
+# Job statuses
+QUEUED = "queued"
+DELIVERING = "delivering"
+RETRYING = "retrying"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+
+def job_key(job_id: str) -> str:
+    return f"csv_delivery:job:{job_id}"
+
+
+def content_key(content_hash: str) -> str:
+    return f"csv_delivery:content:{content_hash}"
+
+
+def hash_key(content_hash: str) -> str:
+    return f"csv_delivery:hash:{content_hash}"
+
+
+async def enqueue_delivery(content: bytes) -> Tuple[str, bool]:
+    # Queue the CSV for delivery and return (job id, whether it was queued). If the same content is already
+    # queued or was delivered (within settings.delivery_dedup_ttl), the existing job is returned instead.
+    content_hash = hashlib.sha256(content).hexdigest()
+    job_id = recent_jobs.get(content_hash)
+    if job_id is not None:
+        # This worker just handled the same CSV, no need to ask Redis
+        return job_id, False
+
+    redis_client = get_async_redis_client()
+    job_id = uuid.uuid4().hex
+    if not await redis_client.set(hash_key(content_hash), job_id, nx=True, ex=settings.delivery_dedup_ttl):
+        existing_job_id = await redis_client.get(hash_key(content_hash))
+        if existing_job_id is not None:
+            existing_job_id = existing_job_id.decode("utf-8")
+            # No status yet means the job is still being queued (by another caller), it's handled too
+            if await redis_client.hget(job_key(existing_job_id), "status") != FAILED.encode("utf-8"):
+                logger.info(f" - CSV unchanged, already handled by delivery job {existing_job_id}")
+                recent_jobs.set(content_hash, existing_job_id)
+                return existing_job_id, False
+        # The previous delivery of this content failed (or expired), try again
+        await redis_client.set(hash_key(content_hash), job_id, ex=settings.delivery_dedup_ttl)
+
+    now = time.time()
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.setex(content_key(content_hash), settings.delivery_dedup_ttl, content)
+        pipe.hset(job_key(job_id), mapping={"id": job_id, "content_hash": content_hash, "status": QUEUED,
+                                            "attempts": 0, "created_at": now, "updated_at": now})
+        pipe.expire(job_key(job_id), settings.delivery_dedup_ttl)
+        pipe.lpush(QUEUE_KEY, job_id)
+        pipe.set(LAST_JOB_KEY, job_id)
+        await pipe.execute()
+
+    recent_jobs.set(content_hash, job_id)
+    logger.info(f" - CSV queued for delivery (job {job_id})")
+    return job_id, True
+
+
+async def get_delivery_job(job_id: str) -> Optional[dict]:
+    job = await get_async_redis_client().hgetall(job_key(job_id))
+    if not job:
+        return None
+    job = {key.decode("utf-8"): value.decode("utf-8") for key, value in job.items()}
+    job["attempts"] = int(job["attempts"])
+    return job
+
+
+async def delivery_stats() -> dict:
+    # Queue depth (per state) and the last queued job
+    async with get_async_redis_client().pipeline(transaction=False) as pipe:
+        pipe.llen(QUEUE_KEY)
+        pipe.llen(PROCESSING_KEY)
+        pipe.zcard(RETRY_KEY)
+        pipe.get(LAST_JOB_KEY)
+        queued, processing, retrying, last_job_id = await pipe.execute()
+
+    return {
+        "queued": queued,
+        "processing": processing,
+        "retrying": retrying,
+        "last_job": await get_delivery_job(last_job_id.decode("utf-8")) if last_job_id else None
+    }
+
+
+async def requeue_jobs():
+    # Put due retries back in the queue, and also the jobs left in the processing list by a worker that died
+    # mid-delivery. ZREM/LREM tell us whether this worker is the one that got to move the job.
+    redis_client = get_async_redis_client()
+    now = time.time()
+
+    for job_id in await redis_client.zrangebyscore(RETRY_KEY, 0, now):
+        if await redis_client.zrem(RETRY_KEY, job_id):
+            await redis_client.lpush(QUEUE_KEY, job_id)
+
+    for job_id in await redis_client.lrange(PROCESSING_KEY, 0, -1):
+        updated_at = await redis_client.hget(job_key(job_id.decode("utf-8")), "updated_at")
+        if updated_at is None or float(updated_at) < now - settings.delivery_visibility_timeout:
+            if await redis_client.lrem(PROCESSING_KEY, 1, job_id):
+                logger.warning(f" - Requeueing abandoned delivery job {job_id.decode('utf-8')}")
+                await redis_client.lpush(QUEUE_KEY, job_id)
+
+
+async def deliver(job_id: str):
+    # Send the job's CSV to httpbin.org, scheduling a retry (with exponential backoff) if it fails
+    redis_client = get_async_redis_client()
+    job = await get_delivery_job(job_id)
+    content = await redis_client.get(content_key(job["content_hash"])) if job else None
+    if content is None:
+        logger.error(f"Delivery job {job_id} (or its CSV) expired before it could be delivered")
+        if job:
+            await redis_client.hset(job_key(job_id), mapping={"status": FAILED, "updated_at": time.time(),
+                                                              "last_error": "CSV expired"})
+        await redis_client.lrem(PROCESSING_KEY, 1, job_id)
+        return
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hincrby(job_key(job_id), "attempts", 1)
+        pipe.hset(job_key(job_id), mapping={"status": DELIVERING, "updated_at": time.time()})
+        attempts, _ = await pipe.execute()
+    try:
+        files = {'file': ('top_10_sorted.csv', content)}
+        with timed("upstream_request_duration_seconds", resource="httpbin"):
+            response = await scheduler.request("POST", settings.httpbin_url, files=files)
+        if response.status_code != 200:
+            raise httpx.HTTPStatusError(f"httpbin.org responded with {response.status_code}",
+                                        request=response.request, response=response)
+    except httpx.HTTPError as exc:
+        logger.error(f"Delivery job {job_id} attempt {attempts} raised an exception: {exc}")
+        async with redis_client.pipeline(transaction=True) as pipe:
+            if attempts >= settings.delivery_max_attempts:
+                # Give up, the next time this CSV is generated it's queued again
+                pipe.hset(job_key(job_id), mapping={"status": FAILED, "updated_at": time.time(),
+                                                    "last_error": str(exc)})
+                recent_jobs.delete(job["content_hash"])
+            else:
+                backoff = min(settings.delivery_backoff_base * 2 ** (attempts - 1), settings.delivery_backoff_max)
+                pipe.hset(job_key(job_id), mapping={"status": RETRYING, "updated_at": time.time(),
+                                                    "last_error": str(exc), "next_attempt_at": time.time() + backoff})
+                pipe.zadd(RETRY_KEY, {job_id: time.time() + backoff})
+            pipe.lrem(PROCESSING_KEY, 1, job_id)
+            await pipe.execute()
+        return
+
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(job_key(job_id), mapping={"status": DELIVERED, "updated_at": time.time(),
+                                            "delivered_at": time.time()})
+        pipe.lrem(PROCESSING_KEY, 1, job_id)
+        await pipe.execute()
+    logger.info(f" - CSV file sent to httpbin.org successfully (job {job_id})")
+
+
+async def process_next_job() -> bool:
+    # Deliver the next job, if there's one. Returns whether there was one.
+    # The queue is polled (no blocking pop), so no pooled connection is held while it's empty.
+    await requeue_jobs()
+    job_id = await get_async_redis_client().lmove(QUEUE_KEY, PROCESSING_KEY, "RIGHT", "LEFT")
+    if job_id is None:
+        return False
+    await deliver(job_id.decode("utf-8"))
+    return True
+
+
+async def wait(stopping: asyncio.Event, timeout: float):
+    # Sleep for timeout seconds, or until the worker is told to stop
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(stopping.wait(), timeout)
+
+
+async def run_delivery_worker(stopping: asyncio.Event):
+    # Deliver queued CSVs until stopping is set (on shutdown). The worker isn't cancelled: the job being delivered is
+    # finished first, so it isn't left in the processing list. While Redis is down (the queue is in Redis) the
+    # worker just waits for it to be back.
+    while not stopping.is_set():
+        if not redis_available():
+            await wait(stopping, settings.delivery_poll_interval)
+            continue
+        try:
+            if not await process_next_job():
+                await wait(stopping, settings.delivery_poll_interval)
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+            await wait(stopping, settings.delivery_poll_interval)
+        except Exception as exc:
+            logger.error(f"Delivery worker raised an exception: {exc}")
+            await wait(stopping, settings.delivery_poll_interval)
@@ -0,0 +1,168 @@
+# ./app/src/dependencies.py
+
+# Dependency tracking of the derived cache entries (e.g. the top 10 list).
+#
+# A derived entry records the version (content hash of the projected data) of every SWAPI entity it was built from:
+# films, characters and species. Whenever primary data is written (cache entries of films, characters and species,
+# or a re-crawl of the bulk store), the new versions are compared with the ones the derived entries were built from.
+# A derived entry that depends on a changed entity is recomputed in the background (incrementally, by the function
+# registered for it, which is told what changed), or invalidated if it has none. Entities that didn't change don't
+# trigger anything, so derived entries can be cached for much longer than the primary data.
+#
+# Redis keys:
+#   dependencies:<derived key>   hash: entity -> version the entry was built from
+#   dependents:<entity>          set: derived keys built from the entity
+# Entities are named <resource>:<id>, e.g. people:1.
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from .config import get_settings
+from .utils import get_async_redis_client
+from .cache import cache_invalidate, cache_set_ttls, content_hash, schedule_refresh, write_listeners
+from .metrics import increment
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+recompute_functions = {}  # Derived key -> async function(changed entities) returning its new data
+
+
+def dependencies_key(derived_key: str) -> str:
+    return f"dependencies:{derived_key}"
+
+
+def dependents_key(entity: str) -> str:
+    return f"dependents:{entity}"
+
+
+def entity_key(url: str) -> str:
+    # https://swapi.dev/api/people/1/ -> people:1
+    resource, id = url.rstrip("/").rsplit("/", 2)[-2:]
+    return f"{resource}:{id}"
+
+
+def derived_ttls() -> Tuple[int, int]:
+    return (settings.derived_cache_ttl or settings.cache_ttl,
+            settings.derived_cache_hard_ttl or settings.cache_hard_ttl)
+
+
+def register_derived(derived_key: str, recompute: Optional[Callable[[Set[str]], Awaitable[Any]]] = None):
+    # Declare a derived entry: it's cached with the derived TTLs, and recomputed with recompute(changed entities)
+    # (or invalidated, without one) when an entity it was built from changes
+    cache_set_ttls(derived_key, derived_ttls)
+    if recompute is not None:
+        recompute_functions[derived_key] = recompute
+
+
+async def record_dependencies(derived_key: str, versions: Dict[str, str]):
+    # Record the entities (and their versions) the derived entry was just built from
+    if not redis_available():
+        return
+    try:
+        redis_client = get_async_redis_client()
+        previous = {entity.decode("utf-8") for entity in await redis_client.hkeys(dependencies_key(derived_key))}
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(dependencies_key(derived_key))
+            if versions:
+                pipe.hset(dependencies_key(derived_key), mapping=versions)
+            for entity in previous - set(versions):
+                pipe.srem(dependents_key(entity), derived_key)
+            for entity in set(versions) - previous:
+                pipe.sadd(dependents_key(entity), derived_key)
+            await pipe.execute()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+
+
+async def recorded_versions(derived_key: str) -> Dict[str, str]:
+    # The entities (and their versions) the derived entry was last built from
+    versions = await get_async_redis_client().hgetall(dependencies_key(derived_key))
+    return {entity.decode("utf-8"): version.decode("utf-8") for entity, version in versions.items()}
+
+
+async def entities_written(versions: Dict[str, str]):
+    # Primary data was written: propagate the entities whose version differs from the one a derived entry was built
+    # from. Two round trips, whatever the number of entities.
+    if not versions or not redis_available():
+        return
+    try:
+        redis_client = get_async_redis_client()
+        entities = list(versions)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for entity in entities:
+                pipe.smembers(dependents_key(entity))
+            dependents = await pipe.execute()
+
+        entities_by_derived = {}
+        for entity, derived_keys in zip(entities, dependents):
+            for derived_key in derived_keys:
+                entities_by_derived.setdefault(derived_key.decode("utf-8"), []).append(entity)
+        if not entities_by_derived:
+            return
+
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for derived_key, derived_entities in entities_by_derived.items():
+                pipe.hmget(dependencies_key(derived_key), derived_entities)
+            built_from = await pipe.execute()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        return
+
+    for (derived_key, derived_entities), built_versions in zip(entities_by_derived.items(), built_from):
+        changed = {entity for entity, version in zip(derived_entities, built_versions)
+                   if version is not None and version.decode("utf-8") != versions[entity]}
+        if changed:
+            await dependencies_changed(derived_key, changed)
+
+
+async def dependencies_changed(derived_key: str, changed: Set[str]):
+    recompute = recompute_functions.get(derived_key)
+    logger.info(f" - {derived_key} depends on changed entities {sorted(changed)}, "
+                f"{'recomputing' if recompute else 'invalidating'} it")
+    if recompute is None:
+        increment("dependency_invalidations_total", derived=derived_key, action="invalidate")
+        await cache_invalidate(derived_key)
+        return
+    increment("dependency_invalidations_total", derived=derived_key, action="recompute")
+    # The current entry is served until the recomputed one replaces it
+    await schedule_refresh(derived_key, lambda: recompute(changed))
+
+
+async def invalidate_entity(entity: str, primary_keys: Iterable[str]) -> List[str]:
+    # Drop the entity's cached data (primary_keys) and every derived entry built from it, so they're all fetched
+    # again on their next read. Returns the keys invalidated.
+    derived_keys = []
+    if redis_available():
+        try:
+            derived_keys = sorted(key.decode("utf-8")
+                                  for key in await get_async_redis_client().smembers(dependents_key(entity)))
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+    for derived_key in derived_keys:
+        increment("dependency_invalidations_total", derived=derived_key, action="admin")
+    invalidated = [*primary_keys, *derived_keys]
+    for key in invalidated:
+        await cache_invalidate(key)
+    return invalidated
+
+
+def primary_versions(items: Dict[str, Any]) -> Dict[str, str]:
+    # Versions of the entities in cache entries being written (films data, characters and species)
+    versions = {}
+    for key, data in items.items():
+        if key == "films_data":
+            versions.update({entity_key(film["url"]): content_hash(film) for film in data["results"]
+                             if "url" in film})
+        elif key.startswith(("character_data:", "species_data:")):
+            versions[entity_key(key.split(":", 1)[1])] = content_hash(data)
+    return versions
+
+
+async def on_cache_write(items: Dict[str, Any]):
+    await entities_written(primary_versions(items))
+
+
+write_listeners.append(on_cache_write)
@@ -0,0 +1,226 @@
+# ./app/src/metrics.py
+
+# Prometheus-style metrics, aggregated across all the workers.
+#
+# Every worker records its observations in memory (no I/O on the request path) and adds them to a Redis hash
+# every settings.metrics_flush_interval seconds, so /metrics returns the totals of all the workers, whichever
+# worker serves it. The hash only ever grows (counters and histogram buckets), like Prometheus expects.
+# Gauges (current values, e.g. concurrency limits) can't be added up: every worker writes its own hash of them, with
+# a worker label, which expires shortly after the worker stops flushing.
+
+from typing import Dict, Tuple
+from collections import Counter
+from contextlib import contextmanager
+from redis.exceptions import RedisError
+from .config import get_settings
+from .utils import get_redis_client
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+METRICS_KEY = "metrics"  # Redis hash: sample -> value, shared by all the workers
+GAUGES_KEY_PREFIX = "metrics:gauges:"  # Redis hash per worker: sample -> value
+GAUGES_TTL_FLUSHES = 5  # A worker's gauges expire if it misses this many flushes
+
+worker = f"{socket.gethostname()}:{os.getpid()}"  # Label of this worker's gauges
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Histogram buckets, in seconds
+
+# Metric name -> (type, help)
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Request latency per route."),
+    "stage_duration_seconds": ("histogram", "Time spent in each stage of building and exporting the top characters "
+                                            "list (films fetch, character fan-out, species fan-out, CSV build, "
+                                            "upload)."),
+    "upstream_request_duration_seconds": ("histogram", "Upstream (SWAPI and httpbin) call latency per resource."),
+    "cache_lookups_total": ("counter", "Cache lookups per tier (local, redis and fallback) and result (hit or miss)."),
+    "redis_command_duration_seconds": ("histogram", "Latency of the Redis cache reads and writes."),
+    "redis_outages_total": ("counter", "Times a worker found Redis unreachable and fell back to its in-process cache."),
+    "upstream_concurrency_limit": ("gauge", "Current concurrency limit of each upstream host (adjusted by AIMD)."),
+    "upstream_max_concurrency": ("gauge", "Process-wide limit of concurrent upstream calls."),
+    "upstream_in_flight": ("gauge", "Upstream calls in flight per host."),
+    "upstream_queue_depth": ("gauge", "Upstream calls waiting for a concurrency slot per host."),
+    "upstream_limit_changes_total": ("counter", "Concurrency limit increases and decreases per upstream host."),
+    "upstream_deduplicated_total": ("counter", "Upstream calls served by an identical call already in flight."),
+    "resource_fetches_total": ("counter", "SWAPI entities read from the bulk store or fetched from upstream, per "
+                                          "resource (the cache hits are in cache_lookups_total)."),
+    "dependency_invalidations_total": ("counter", "Derived cache entries recomputed or invalidated because data they "
+                                                  "were built from changed (or was invalidated by an admin)."),
+}
+
+pending = Counter()  # Observations not flushed to Redis yet (sample -> value)
+gauges = {}  # Current values of this worker's gauges (sample -> value)
+pending_lock = threading.Lock()
+observers = []  # functions(name, value, labels) also called with every observation (see profiling.py)
+
+
+def after_fork():
+    # A worker forked from a preloaded master (gunicorn preload_app) is a worker of its own: its own label, and none
+    # of the master's observations (they'd be counted once per worker)
+    global worker, pending_lock
+    previous, worker = worker, f"{socket.gethostname()}:{os.getpid()}"
+    pending_lock = threading.Lock()
+    pending.clear()
+    relabeled = {sample.replace(f'worker="{previous}"', f'worker="{worker}"'): value for sample, value in gauges.items()}
+    gauges.clear()
+    gauges.update(relabeled)
+
+
+os.register_at_fork(after_in_child=after_fork)
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def sample(name: str, suffix: str = "", **labels) -> str:
+    # Hash field of a sample: the metric name and the sample line without its value (e.g. a bucket)
+    return f"{name}\t{name}{suffix}{format_labels(labels)}"
+
+
+def increment(name: str, amount: float = 1, **labels):
+    if not settings.metrics_enabled:
+        return
+    with pending_lock:
+        pending[sample(name, **labels)] += amount
+
+
+def observe(name: str, value: float, **labels):
+    # Record a histogram observation (cumulative buckets, sum and count)
+    for observer in observers:
+        observer(name, value, labels)
+    if not settings.metrics_enabled:
+        return
+    with pending_lock:
+        for bucket in BUCKETS:
+            # Every bucket is written (even with 0), so every series has all of them
+            pending[sample(name, "_bucket", **labels, le=str(bucket))] += value <= bucket
+        pending[sample(name, "_bucket", **labels, le="+Inf")] += 1
+        pending[sample(name, "_sum", **labels)] += value
+        pending[sample(name, "_count", **labels)] += 1
+
+
+def set_gauge(name: str, value: float, **labels):
+    if not settings.metrics_enabled:
+        return
+    with pending_lock:
+        gauges[sample(name, **labels, worker=worker)] = value
+
+
+@contextmanager
+def timed(name: str, **labels):
+    # Observe how long the block takes (also when it raises)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def flush():
+    # Add this worker's pending observations to the shared totals. They're kept for the next flush if Redis fails.
+    global pending
+
+    with pending_lock:
+        observations, pending = pending, Counter()
+        current_gauges = dict(gauges)
+    if not observations and not current_gauges:
+        return
+    try:
+        with get_redis_client().pipeline(transaction=False) as pipe:
+            for field, value in observations.items():
+                pipe.hincrbyfloat(METRICS_KEY, field, value)
+            if current_gauges:
+                pipe.hset(GAUGES_KEY_PREFIX + worker, mapping=current_gauges)
+                pipe.expire(GAUGES_KEY_PREFIX + worker,
+                            max(1, int(settings.metrics_flush_interval * GAUGES_TTL_FLUSHES)))
+            pipe.execute()
+    except RedisError as exc:
+        logger.warning(f"Unable to flush the metrics: {exc}")
+        with pending_lock:
+            pending.update(observations)
+
+
+async def flush_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(flush)  # Sync Redis client, off the event loop
+
+
+def render() -> str:
+    # The totals of all the workers in the Prometheus text format
+    flush()
+    try:
+        redis_client = get_redis_client()
+        totals = redis_client.hgetall(METRICS_KEY)
+        for key in redis_client.scan_iter(match=GAUGES_KEY_PREFIX + "*"):
+            totals.update(redis_client.hgetall(key))
+    except RedisError as exc:
+        # Redis is down: only this worker's metrics (since its last flush) are available
+        logger.warning(f"Unable to read the metrics of all the workers: {exc}")
+        with pending_lock:
+            totals = {field.encode("utf-8"): value for field, value in {**pending, **gauges}.items()}
+    families = {}
+    for field, value in totals.items():
+        name, line = field.decode("utf-8").split("\t", 1)
+        families.setdefault(name, []).append((line, float(value)))
+
+    lines = []
+    for name in sorted(families):
+        metric_type, description = METRICS.get(name, ("untyped", ""))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{line} {value}" for line, value in sorted(families[name], key=sample_sort_key))
+    return "\n".join(lines) + "\n"
+
+
+def sample_sort_key(item: Tuple[str, float]):
+    # Keep the buckets of a histogram in ascending order (+Inf last), then its sum and count
+    line = item[0]
+    if '_bucket{' in line and 'le="' in line:
+        le = line.rsplit('le="', 1)[1].split('"', 1)[0]
+        return line.rsplit('le="', 1)[0], 0, float("inf") if le == "+Inf" else float(le)
+    return line, 1, 0.0
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware timing every HTTP request, labelled with its route template (not the raw path, so
+    # the number of series stays bounded), method and status code.
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None  # endpoint -> route path, built on the first request
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if self.route_paths is None:
+                self.route_paths = {getattr(route, "endpoint", None): route.path for route in scope["app"].routes}
+            observe("http_request_duration_seconds", time.perf_counter() - start, method=scope["method"],
+                    route=self.route_paths.get(scope.get("endpoint"), "unmatched"), status=str(status_code))
@@ -0,0 +1,248 @@
+# ./app/src/profiling.py
+
+# Opt-in profiling of single requests (e.g. a slow /characters/top_10_sorted call).
+#
+# A request is profiled when it asks for it (X-Profile: 1 header or ?profile=1), comes from a client in
+# settings.profiling_allowlist, and is picked by settings.profiling_sample_rate. Its profile has:
+# - A wall-clock breakdown: the time spent in the stages, Redis commands and upstream calls it went through (every
+#   metrics.observe() of the request, see metrics.py) and in the functions decorated with @profiled (fetch_*_data).
+#   Calls made concurrently overlap, so the breakdown can add up to more than the total.
+# - A sampling CPU profile: the stack of the event loop thread, sampled every settings.profiling_interval seconds
+#   while the request runs (by a background thread), as collapsed stacks (the format of flamegraph.pl and speedscope).
+#   The event loop is shared with the other requests of the worker, so their stacks can show up too.
+# The breakdown is returned in the Server-Timing header, and the whole profile is stored in Redis (for
+# settings.profiling_ttl seconds) to be downloaded from /profiles/{id}, whose id is in the X-Profile-Id header.
+#
+# Requests that aren't profiled only pay for a context variable lookup per observation.
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+from contextvars import ContextVar
+from ipaddress import ip_address, ip_network
+from .config import get_settings
+from .utils import get_async_redis_client
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+from .metrics import observers
+from collections import Counter
+import functools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+PROFILE_KEY_PREFIX = "profile:"  # Redis string per profile: the profile JSON
+
+current_profile = ContextVar("current_profile", default=None)  # RequestProfile of the request being handled, if any
+
+
+def profile_key(profile_id: str) -> str:
+    return PROFILE_KEY_PREFIX + profile_id
+
+
+def timing_name(metric: str, labels: Dict[str, str]) -> Optional[str]:
+    # Server-Timing entry of an observation (None for the ones that aren't part of the breakdown)
+    if metric == "stage_duration_seconds":
+        return labels["stage"]
+    if metric == "redis_command_duration_seconds":
+        return "redis"
+    if metric == "upstream_request_duration_seconds":
+        return f"upstream_{labels['resource']}"
+    return None
+
+
+def client_allowed(host: Optional[str]) -> bool:
+    # Whether the client address is in settings.profiling_allowlist (addresses or networks, e.g. 10.0.0.0/8)
+    if host is None:
+        return False
+    for allowed in settings.profiling_allowlist:
+        if host == allowed:
+            return True
+        try:
+            if ip_address(host) in ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue  # Not an address (e.g. a hostname)
+    return False
+
+
+class StackSampler:
+    # Samples the stack of a thread at a fixed interval, from a background thread, counting the collapsed stacks
+    # (root to leaf, frames separated by ;)
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self) -> Counter:
+        self.stopped.set()
+        self.thread.join()
+        return self.stacks
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+
+class RequestProfile:
+
+    def __init__(self, method: str, path: str, interval: float):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.timings = {}  # name -> [seconds, count]
+        self.lock = threading.Lock()  # Observations can come from the threadpool too
+        self.sampler = StackSampler(threading.get_ident(), interval) if interval > 0 else None
+        self.stacks = Counter()
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def add(self, name: str, seconds: float):
+        if self.duration is not None:
+            return  # Background work the request started, after it finished
+        with self.lock:
+            timing = self.timings.setdefault(name, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start if self.duration is None else self.duration
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        if self.sampler is not None:
+            self.stacks = self.sampler.stop()
+
+    def server_timing(self) -> str:
+        # e.g. films_fetch;dur=12.1, redis;dur=3.4;desc="5 calls", total;dur=40.2 (in milliseconds)
+        with self.lock:
+            timings = list(self.timings.items())
+        entries = [f'{name};dur={seconds * 1000:.1f}' + (f';desc="{count} calls"' if count > 1 else "")
+                   for name, (seconds, count) in timings]
+        return ", ".join(entries + [f"total;dur={self.elapsed() * 1000:.1f}"])
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration": self.elapsed(),
+            "timings": {name: {"seconds": seconds, "count": count} for name, (seconds, count) in self.timings.items()},
+            "sample_interval": self.sampler.interval if self.sampler is not None else None,
+            "samples": sum(self.stacks.values()),
+            "stacks": dict(self.stacks.most_common())
+        }
+
+
+def record(metric: str, seconds: float, labels: Dict[str, str]):
+    # Called by metrics.observe() with every observation
+    profile = current_profile.get()
+    if profile is not None:
+        name = timing_name(metric, labels)
+        if name is not None:
+            profile.add(name, seconds)
+
+
+observers.append(record)
+
+
+def profiled(name: str):
+    # Decorator adding the time spent in an async function to the profile of the request calling it
+    def decorator(function: Callable[..., Awaitable[Any]]):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            profile = current_profile.get()
+            if profile is None:
+                return await function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                profile.add(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def profiling_requested(scope) -> bool:
+    if not settings.profiling_allowlist:
+        return False
+    headers = dict(scope["headers"])
+    query = scope.get("query_string", b"").split(b"&")
+    if headers.get(b"x-profile") not in (b"1", b"true") and b"profile=1" not in query and b"profile=true" not in query:
+        return False
+    client = scope.get("client")
+    return client_allowed(client[0] if client else None) and random.random() < settings.profiling_sample_rate
+
+
+async def store_profile(profile: RequestProfile):
+    if not redis_available():
+        return
+    try:
+        await get_async_redis_client().setex(profile_key(profile.id), settings.profiling_ttl,
+                                             json.dumps(profile.to_dict()))
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+
+
+async def get_profile(profile_id: str) -> Optional[dict]:
+    data = await get_async_redis_client().get(profile_key(profile_id))
+    return json.loads(data) if data is not None else None
+
+
+def collapsed_stacks(profile: dict) -> str:
+    # The CPU profile as collapsed stacks, one "frame;frame;frame count" per line
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
+
+
+class ProfilingMiddleware:
+    # Plain ASGI middleware profiling the requests that ask for it (see above)
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiling_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], settings.profiling_interval)
+        token = current_profile.set(profile)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                # The breakdown so far (a streamed body is still to be sent), the stored profile has the whole request
+                message["headers"] = [*message.get("headers", []),
+                                      (b"server-timing", profile.server_timing().encode("latin-1")),
+                                      (b"x-profile-id", profile.id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            profile.finish()
+            await store_profile(profile)
+            logger.info(f" - Profiled {profile.method} {profile.path}: {profile.server_timing()} (id {profile.id})")
@@ -0,0 +1,66 @@
+# ./app/src/redis_health.py
+
+# Redis outage detection. The first Redis call that fails marks Redis as down for this worker: from then on the
+# callers skip Redis (no request waits for a connection timeout) and fall back to what they can do in process (the
+# fallback cache, in-process appearance counts, no cross-worker leases or circuit breakers). A background task pings
+# Redis every settings.redis_reconnect_interval seconds and marks it as up again once it answers.
+
+from redis.exceptions import RedisError
+from .config import get_settings
+from .utils import get_async_redis_client
+from .metrics import increment
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+REDIS_ERRORS = (RedisError, OSError, asyncio.TimeoutError)  # What a Redis call raises when Redis is unreachable
+
+down_since = None  # When this worker found Redis down, None while it's up
+last_error = None
+
+
+def redis_available() -> bool:
+    return down_since is None
+
+
+def mark_redis_down(exc: BaseException):
+    global down_since, last_error
+
+    last_error = f"{type(exc).__name__}: {exc}"
+    if down_since is None:
+        down_since = time.time()
+        increment("redis_outages_total")
+        logger.error(f"Redis is unreachable ({last_error}), serving from the in-process fallback cache")
+
+
+def mark_redis_up():
+    global down_since, last_error
+
+    if down_since is not None:
+        logger.warning(f"Redis is reachable again after {time.time() - down_since:.1f} seconds")
+    down_since = None
+    last_error = None
+
+
+async def probe_redis() -> bool:
+    # Ping Redis (within the socket timeout) and update the state. Returns whether it's up.
+    try:
+        await asyncio.wait_for(get_async_redis_client().ping(), settings.redis_socket_timeout)
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        return False
+    mark_redis_up()
+    return True
+
+
+async def watch_redis(interval: float):
+    # Reconnect in the background: while Redis is down, check every interval seconds whether it's back
+    while True:
+        await asyncio.sleep(interval)
+        if not redis_available():
+            await probe_redis()
@@ -0,0 +1,155 @@
+# ./app/src/resources.py
+
+# The SWAPI resources the app reads (films, people, species), all fetched by the same engine.
+#
+# A SwapiResource is parameterised by its name (the SWAPI path, also its circuit breaker family), the schema its
+# entities are validated against and the cache key prefix of its entities. It takes care of:
+# - The cache tiers: the bulk store first (for the resources crawled into it), then the cache (local, Redis and
+#   fallback, stale-while-revalidate), then SWAPI for the misses (written back in a single round trip)
+# - Validation and projection: data fetched from SWAPI is validated against the schema and projected to its fields
+#   (the validated model itself isn't needed, so it isn't serialised back). Cached data was validated before it was
+#   cached, so it's only validated again with settings.validate_cache_hits (invalid entries are then fetched again).
+# - use_cache=False: the bulk store and the cache are neither read nor written, every entity comes from SWAPI
+# - Metrics: resource_fetches_total{resource, source}, the entities read from the bulk store or fetched upstream
+#
+# A new SWAPI resource only needs a schema and a SwapiResource.
+
+from typing import Any, Callable, Dict, Generic, List, Optional, Type, TypeVar
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ValidationError
+from .config import get_settings
+from .schemas import Character, Film, Species
+from .circuit_breaker import upstream_get
+from .codec import project
+from .bulk import BULK_RESOURCES, crawl_collection, get_entities
+from .cache import get_or_fetch_many
+from .metrics import increment
+from .redis_health import REDIS_ERRORS, mark_redis_down
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+T = TypeVar("T", bound=BaseModel)
+
+OnResult = Callable[[str, Any], None]  # on_result(url, data or raised exception), called as each entity arrives
+
+
+class SwapiResource(Generic[T]):
+
+    def __init__(self, name: str, schema: Type[T], key_prefix: str, collection_key: Optional[str] = None):
+        self.name = name  # e.g. people, as in https://swapi.dev/api/people/1/
+        self.schema = schema
+        self.key_prefix = key_prefix  # Cache key of an entity: <key_prefix>:<url>
+        self.collection_key = collection_key  # Cache key of the whole collection, for the ones read all at once
+        self.label = schema.__name__.lower()  # For the logs and errors, e.g. character
+
+    def key(self, url: str) -> str:
+        return f"{self.key_prefix}:{url}"
+
+    def validate(self, data: dict) -> dict:
+        # The data projected to the fields of the schema, raising ValidationError if it doesn't match it
+        self.schema(**data)
+        return project(data, self.schema)
+
+    def is_valid(self, data: Any) -> bool:
+        try:
+            self.schema(**data)
+            return True
+        except (ValidationError, TypeError):
+            return False
+
+    async def request(self, url: str) -> dict:
+        # Fetch an entity from SWAPI
+        logger.info(f" - Fetching {self.label}: {url}")
+        increment("resource_fetches_total", resource=self.name, source="upstream")
+        response = await upstream_get(self.name, url)
+        if response.status_code != 200:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail=f"Unable to fetch {self.label} data")
+        try:
+            return self.validate(response.json())
+        except ValidationError as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail=f"Unable to fetch {self.label} data. API response format is invalid")
+
+    async def request_collection(self) -> dict:
+        # Fetch the whole collection from SWAPI (every page of it, in a single list)
+        logger.info(f" - Fetching {self.name}: {settings.swapi_base_url}/{self.name}/")
+        items = await crawl_collection(self.name)
+        increment("resource_fetches_total", len(items), resource=self.name, source="upstream")
+        try:
+            results = [self.validate(item) for item in items]
+        except ValidationError as e:
+            logger.error(e)
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail=f"Unable to fetch {self.name} data. API response format is invalid")
+        return {"count": len(results), "next": None, "previous": None, "results": results}
+
+    async def fetch(self, url: str, use_cache: bool = True) -> dict:
+        # Fetch an entity from the bulk store, the cache or SWAPI
+        data = (await self.fetch_many([url], use_cache))[url]
+        if isinstance(data, BaseException):
+            raise data
+        return data
+
+    async def fetch_many(self, urls: List[str], use_cache: bool = True,
+                         on_result: Optional[OnResult] = None) -> Dict[str, Any]:
+        # Fetch several entities. They're looked up in the bulk store (if the resource is crawled into it), so it
+        # takes the same upstream requests whatever the number of entities. The ones the store doesn't have are
+        # fetched one by one: cached ones are read in a single Redis round trip, only the misses are fetched from
+        # SWAPI (concurrently) and then cached in a single pipelined write.
+        # Returns a dict url -> data, with the raised exception in place of the data for the failed ones.
+        # on_result(url, data), if given, is called as soon as each entity's data is known.
+        results = await self.lookup_bulk_store(urls, use_cache)
+        if results:
+            increment("resource_fetches_total", len(results), resource=self.name, source="bulk")
+        if on_result is not None:
+            for url, data in results.items():
+                on_result(url, data)
+
+        missing = [url for url in urls if url not in results]
+        fetchers = {self.key(url): (lambda url=url: self.request(url)) for url in missing}
+        prefix_length = len(self.key_prefix) + 1
+        fetched = await get_or_fetch_many(fetchers, use_cache, on_result and (
+            lambda key, data: on_result(key[prefix_length:], data)), accept=self.cache_hit_check())
+        results.update({url: fetched[self.key(url)] for url in missing})
+        return {url: results[url] for url in urls}
+
+    async def fetch_collection(self, use_cache: bool = True) -> dict:
+        # Fetch the whole collection from the cache or SWAPI
+        fetched = (await get_or_fetch_many({self.collection_key: self.request_collection}, use_cache,
+                                           accept=self.cache_hit_check(collection=True)))[self.collection_key]
+        if isinstance(fetched, BaseException):
+            raise fetched
+        return fetched
+
+    def cache_hit_check(self, collection: bool = False) -> Optional[Callable[[Any], bool]]:
+        if not settings.validate_cache_hits:
+            return None
+        if collection:
+            return lambda data: all(self.is_valid(item) for item in data["results"])
+        return self.is_valid
+
+    async def lookup_bulk_store(self, urls: List[str], use_cache: bool = True) -> Dict[str, dict]:
+        # The entities the bulk store has (url -> data). If it can't be crawled, they're all fetched one by one.
+        if not use_cache or not settings.bulk_store_enabled or self.name not in BULK_RESOURCES or not urls:
+            return {}
+        try:
+            entities = await get_entities(self.name, urls)
+        except HTTPException as exc:
+            logger.warning(f" - Bulk store of {self.name} unavailable ({exc.detail}), fetching them one by one")
+            return {}
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+            return {}
+        check = self.cache_hit_check()
+        return {url: data for url, data in entities.items() if data is not None and (check is None or check(data))}
+
+
+films = SwapiResource("films", Film, "film_data", collection_key="films_data")
+people = SwapiResource("people", Character, "character_data")
+species = SwapiResource("species", Species, "species_data")
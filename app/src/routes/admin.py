@@ -0,0 +1,63 @@
+# ./app/src/routes/admin.py
+
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Path, status
+from ..config import get_settings
+from ..schemas import InvalidationResult
+from ..utils import get_async_redis_client
+from ..redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+from ..bulk import local_entities, store_key
+from ..dependencies import invalidate_entity
+from enum import Enum
+import hmac
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+
+class Resource(str, Enum):
+    films = "films"
+    people = "people"
+    species = "species"
+
+
+def check_admin_token(token: Optional[str]):
+    if not settings.admin_token:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin endpoints are disabled")
+    if token is None or not hmac.compare_digest(token, settings.admin_token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token")
+
+
+@router.post("/invalidate/{resource}/{id}", response_model=InvalidationResult)
+async def invalidate(resource: Resource, id: int = Path(..., ge=1),
+                     x_admin_token: Optional[str] = Header(None)):
+    """Drops the cached data of a SWAPI entity and of every derived entry (e.g. the top 10 list) built from it."""
+
+    check_admin_token(x_admin_token)
+
+    if resource == Resource.films:
+        # All the films are cached together
+        primary_keys = ["films_data"]
+    else:
+        url = f"{settings.swapi_base_url}/{resource.value}/{id}/"
+        primary_keys = [f"{'character' if resource == Resource.people else 'species'}_data:{url}"]
+        # Also drop it from the bulk store, so it's fetched again on its own
+        if redis_available():
+            try:
+                await get_async_redis_client().hdel(store_key(resource.value), str(id))
+            except REDIS_ERRORS as exc:
+                mark_redis_down(exc)
+        local_entities.clear()
+
+    entity = f"{resource.value}:{id}"
+    invalidated = await invalidate_entity(entity, primary_keys)
+    logger.info(f" - Admin invalidation of {entity}: {invalidated}")
+    return InvalidationResult(entity=entity, invalidated=invalidated)
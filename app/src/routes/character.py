@@ -1,24 +1,39 @@
 # ./app/src/routes/character.py
 
-from fastapi import APIRouter, HTTPException, status, Depends
-from ..config import Settings
-from ..schemas import FilmList, Character, Species, CharacterBasicInfo
-from typing import List
-from pydantic import ValidationError
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from redis import Redis
-from ..utils import get_redis_client
-from .route_description import GET_TOP_10_SORTED_DESCRIPTION
-import json
-import requests
-import pandas as pd
-import os
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from ..config import get_settings
+from ..schemas import (CharacterBasicInfo, CharacterQueryResult, CharacterQuerySortKey, CharacterSortKey, ResponseFormat,
+                       SortOrder, TopQuery, TopQueryBatch, TopQueryResult)
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from operator import itemgetter
+from .. import resources
+from ..singleflight import single_flight
+from ..batch_loader import BatchLoader
+from ..cache import (LocalCache, cache_get, cache_get_last_good, cache_get_with_hash, cache_set, content_hash,
+                     schedule_refresh, ttls, write_listeners, FRESH, MISS, STALE, STALE_IF_ERROR)
+from ..dependencies import entity_key, record_dependencies, recorded_versions, register_derived
+from ..appearances import top_appearances
+from ..character_index import get_character_index
+from ..csv_export import build_csv, iter_csv, save_csv
+from ..variants import (MEDIA_TYPES, VARIANTS_KEY, batch_body, encode_bodies, popular_keys, popular_queries, render,
+                        render_json)
+from ..delivery import enqueue_delivery
+from ..metrics import observe, timed
+from ..profiling import current_profile, profiled
+from ..redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+from .route_description import (GET_TOP_DESCRIPTION, GET_TOP_10_SORTED_DESCRIPTION, GET_TOP_10_SORTED_CSV_DESCRIPTION,
+                                GET_QUERY_DESCRIPTION, POST_BATCH_DESCRIPTION)
+import asyncio
 import logging
 
 
 logger = logging.getLogger(__name__)
 
-settings = Settings()
+settings = get_settings()
+
+exported_csv = LocalCache(max_entries=1, ttl=settings.local_cache_ttl)  # Hash of the last exported top 10 -> job id
+rendered_top_10_sorted = LocalCache(max_entries=1, ttl=settings.local_cache_ttl)  # Hash of the top 10 -> JSON body
 
 router = APIRouter(
     prefix="/characters",
@@ -26,203 +41,401 @@ router = APIRouter(
 )
 
 
-def fetch_films_data(use_cache: bool = True):
-    # Fetch films data from the API or cache if available and requested
-    # The data is validated against the FilmList schema, but the validation is not strict and we use the original data
-    # We'd need to validate the data thoroughly if other parts of the application depended on it, but in this case it's not necessary.
-    cache_data = None
-    if use_cache:
-        redis_client = get_redis_client()
-        cache_key = "films_data"
-        cache_data = redis_client.get(cache_key)
-    if bool(cache_data):
-        logger.info(f" - Cache TTL for films data: {redis_client.ttl(cache_key)} seconds")
-        return json.loads(cache_data.decode("utf-8"))
-    else:
-        url = "https://swapi.dev/api/films"
-        logger.info(f" - Fetching films: {url}")
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
-                                detail="Unable to fetch films data")
-        try:
-            data = response.json()
-            FilmList(**data).dict()
-            if use_cache:
-                redis_client.setex(cache_key, settings.cache_ttl, json.dumps(data))
-            return data
-        except ValidationError as e:
-            logger.error(e)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                                detail="Unable to fetch films data. API response format is invalid")
-
-
-def fetch_character_data(character_url: str, use_cache: bool = True):
-    # Fetch character data from the API or cache if available and requested
-    # The data is validated against the Character schema, but the validation is not strict and we use the original data
-    # We'd need to validate the data thoroughly if other parts of the application depended on it, but in this case it's not necessary.
-    cache_data = None
-    if use_cache:
-        redis_client = get_redis_client()
-        cache_key = f"character_data:{character_url}"
-        cache_data = redis_client.get(cache_key)
-    if bool(cache_data):
-        logger.info(f" - Cache TTL for character data: {redis_client.ttl(cache_key)} seconds")
-        return json.loads(cache_data.decode("utf-8"))
-    else:
-        logger.info(f" - Fetching character: {character_url}")
-        response = requests.get(character_url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                                detail="Unable to fetch character data")
-        try:
-            data = response.json()
-            Character(**data).dict()
-            if use_cache:
-                redis_client.setex(cache_key, settings.cache_ttl, json.dumps(data))
-            return data
-        except ValidationError as e:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                                detail="Unable to fetch character data. API response format is invalid")
-
-
-def fetch_species_data(species_url: str, use_cache: bool = True):
-    # Fetch species data from the API or cache if available and requested
-    # The data is validated against the Species schema, but the validation is not strict and we use the original data
-    # We'd need to validate the data thoroughly if other parts of the application depended on it, but in this case it's not necessary.
-    cache_data = None
-    if use_cache:
-        redis_client = get_redis_client()
-        cache_key = f"species_data:{species_url}"
-        cache_data = redis_client.get(cache_key)
-    if bool(cache_data):
-        logger.info(f" - Cache TTL for species data: {redis_client.ttl(cache_key)} seconds")
-        return json.loads(cache_data.decode("utf-8"))
-    else:
-        logger.info(f" - Fetching species: {species_url}")
-        response = requests.get(species_url)
-        if response.status_code != 200:
-            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
-                                detail="Unable to fetch species data")
+@profiled("fetch_films_data")
+async def fetch_films_data(use_cache: bool = True):
+    # Fetch films data (every film, in a single list) from the cache if available and requested
+    return await resources.films.fetch_collection(use_cache)
+
+
+@profiled("fetch_character_data")
+async def fetch_character_data(character_url: str, use_cache: bool = True):
+    # Fetch character data from the bulk store or the cache if available and requested
+    return await resources.people.fetch(character_url, use_cache)
+
+
+@profiled("fetch_species_data")
+async def fetch_species_data(species_url: str, use_cache: bool = True):
+    # Fetch species data from the bulk store or the cache if available and requested
+    return await resources.species.fetch(species_url, use_cache)
+
+
+@profiled("fetch_many_character_data")
+async def fetch_many_character_data(character_urls: List[str], use_cache: bool = True,
+                                    on_result: Optional[Callable[[str, Any], None]] = None):
+    # Fetch the data of several characters (url -> data, or the raised exception), see SwapiResource.fetch_many
+    return await resources.people.fetch_many(character_urls, use_cache, on_result)
+
+
+@profiled("fetch_many_species_data")
+async def fetch_many_species_data(species_urls: List[str], use_cache: bool = True,
+                                  on_result: Optional[Callable[[str, Any], None]] = None):
+    # Fetch the data of several species, same as fetch_many_character_data
+    return await resources.species.fetch_many(species_urls, use_cache, on_result)
+
+
+async def build_top_characters(n: int, sort_key: str = "height", descending: bool = True,
+                               versions: Optional[Dict[str, str]] = None, use_cache: bool = True):
+    # Build the list of the n characters with the most appearances, sorted by sort_key.
+    # The appearance counts come from the precomputed index, the rest from the (cached) characters and species data.
+    # If versions is given, the version of every film, character and species the list is built from is added to it.
+    # With use_cache=False, all the data is fetched from the API (and not cached).
+    top_character_urls = await rank_characters(n, versions, use_cache)
+    return await assemble_characters(top_character_urls, sort_key, descending, versions, use_cache=use_cache)
+
+
+async def rank_characters(n: int, versions: Optional[Dict[str, str]] = None, use_cache: bool = True) -> List[str]:
+    # The urls of the n characters with the most appearances, most appearances first (the first m of them are the
+    # top m, ties are always ranked the same way)
+
+    # Fetch films data
+    with timed("stage_duration_seconds", stage="films_fetch"):
+        films_data = await fetch_films_data(use_cache)
+
+        # Get the top n characters by appearance count from the index (rebuilt only when the films data changes)
+        top_character_urls = [url for url, _ in await top_appearances(films_data, n, use_cache)]
+
+    if versions is not None:
+        versions.update({entity_key(film["url"]): content_hash(film) for film in films_data["results"]})
+    return top_character_urls
+
+
+async def assemble_characters(character_urls: List[str], sort_key: str, descending: bool,
+                              versions: Optional[Dict[str, str]] = None,
+                              reusable_rows: Optional[Dict[str, dict]] = None,
+                              changed: Set[str] = frozenset(), use_cache: bool = True) -> List[dict]:
+    # The rows of the characters (with their species names), sorted by sort_key.
+    # reusable_rows are rows built before (by character url): they're kept as they are if the character is still at
+    # the version in versions and none of its species is in changed, only the other rows are assembled again.
+
+    # Fan out as a pipeline: each character's species are requested as soon as that character arrives, not once all
+    # the characters are there. The characters (and then the species) known at the same time are read in a single
+    # batch, and each species is only fetched once, even if several characters share it.
+    characters = BatchLoader(lambda urls, on_result: fetch_many_character_data(urls, use_cache, on_result))
+    species = BatchLoader(lambda urls, on_result: fetch_many_species_data(urls, use_cache, on_result))
+    versions = {} if versions is None else versions
+    reusable_rows = reusable_rows or {}
+
+    async def assemble(url: str) -> dict:
         try:
-            data = response.json()
-            Species(**data).dict()
-            if use_cache:
-                redis_client.setex(cache_key, settings.cache_ttl, json.dumps(data))
-            return data
-        except ValidationError as e:
+            character = await characters.load(url)
+        except Exception as exc:
+            logger.error(f"Fetching character {url} raised an exception: {exc}")
             raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                                detail="Unable to fetch species data. API response format is invalid")
+                                detail=f"Unable to fetch character data for {url}")
+        character_version = content_hash(character)
+        if url in reusable_rows and versions.get(entity_key(url)) == character_version and \
+                not any(entity_key(species_url) in changed for species_url in character["species"]):
+            return reusable_rows[url]
+        versions[entity_key(url)] = character_version
 
+        species_futures = [(species_url, species.load(species_url)) for species_url in character["species"]]
+        species_names = []
+        for species_url, species_future in species_futures:
+            try:
+                species_data = await species_future
+            except Exception as exc:
+                logger.error(f"Fetching species {species_url} for character {url} raised an exception: {exc}")
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail=f"Unable to fetch species data for {species_url}")
+            versions[entity_key(species_url)] = content_hash(species_data)
+            species_names.append(species_data["name"])
 
-@router.get("/top_10_sorted", response_model=List[CharacterBasicInfo], description=GET_TOP_10_SORTED_DESCRIPTION)
-def get_top_10_sorted(redis_client: Redis = Depends(get_redis_client), use_cache: bool = True):
+        # A new dict, the cached character data is shared and must not be modified.
+        # Format species names, parse the height and add the appearances count explicitly.
+        return dict(character, species=" & ".join(species_names), height=parse_height(character["height"]),
+                    appearances=len(character["films"]))
+
+    rows = await asyncio.gather(*[assemble(url) for url in character_urls])
+    # The stages overlap: the characters' is until the last character arrived, the species' from the first species
+    # request to the last species
+    observe("stage_duration_seconds", characters.elapsed() or 0.0, stage="character_fan_out")
+    observe("stage_duration_seconds", species.elapsed() or 0.0, stage="species_fan_out")
+
+    return sort_characters(rows, sort_key, descending)
+
+
+async def build_top_10_sorted(use_cache: bool = True):
+    # Build the top 10 list from the API (films -> characters -> species fan-out), sorted by height
+    # The request was to use 10 characters only, /characters/top is the generalised version
+    return await build_top_characters(10, "height", descending=True, use_cache=use_cache)
+
+
+async def build_tracked_top_10_sorted():
+    # Build the top 10 list to be cached, recording what it was built from (see dependencies.py)
+    versions = {}
+    top_10_sorted = await build_top_characters(10, "height", descending=True, versions=versions)
+    await record_dependencies("top_10_sorted_cache", versions)
+    return top_10_sorted
+
+
+async def recompute_top_10_sorted(changed: Set[str]):
+    # Recompute the cached top 10 list after some of the entities it was built from changed, redoing only what they
+    # affect: if a film changed the ranking may have too, so the list is rebuilt. Otherwise the same characters are
+    # still the top 10, and only the rows of the changed characters (or of the characters of a changed species)
+    # are assembled again.
+    previous, _ = await cache_get_last_good("top_10_sorted_cache")
+    if previous is None or any(entity.startswith("films:") for entity in changed):
+        return await build_tracked_top_10_sorted()
+
+    versions = await recorded_versions("top_10_sorted_cache")
+    top_10_sorted = await assemble_characters([row["url"] for row in previous], "height", True, versions,
+                                              reusable_rows={row["url"]: row for row in previous}, changed=changed)
+    await record_dependencies("top_10_sorted_cache", versions)
+    return top_10_sorted
+
+
+register_derived("top_10_sorted_cache", recompute_top_10_sorted)
+
+
+async def build_top_variants(queries: List[TopQuery], versions: Optional[Dict[str, str]] = None,
+                             use_cache: bool = True) -> Dict[str, str]:
+    # The body of every query (by variant key), all rendered from the same data: the films are read and the top
+    # characters assembled once, for the largest n, and each query takes its first n rows in its own order
+    top_character_urls = await rank_characters(max(query.n for query in queries), versions, use_cache)
+    rows = await assemble_characters(top_character_urls, "height", True, versions, use_cache=use_cache)
+    rows_by_url = {row["url"]: row for row in rows}
+    bodies = {}
+    for query in queries:
+        if query.key() not in bodies:
+            top = [rows_by_url[url] for url in top_character_urls[:query.n]]
+            bodies[query.key()] = render(sort_characters(top, query.sort.value, query.order == SortOrder.desc),
+                                         query.format)
+    return bodies
+
+
+async def build_tracked_top_variants():
+    # Build the popular variants to be cached, recording what they were built from (like the top 10 list)
+    versions = {}
+    bodies = await build_top_variants(popular_queries, versions)
+    await record_dependencies(VARIANTS_KEY, versions)
+    return bodies
+
+
+register_derived(VARIANTS_KEY, lambda changed: build_tracked_top_variants())
+
+
+async def precompute_top_variants():
+    # Build the popular variants in the background, unless they're fresh (one worker at a time).
+    # It's not part of the request that triggered it, so it's not added to its profile.
+    if not popular_queries:
+        return
+    _, cache_state = await cache_get(VARIANTS_KEY)
+    if cache_state != FRESH:
+        token = current_profile.set(None)
+        try:
+            await schedule_refresh(VARIANTS_KEY, build_tracked_top_variants)
+        finally:
+            current_profile.reset(token)
+
+
+async def on_cache_write(items: Dict[str, Any]):
+    # Right after the top 10 list is refreshed, the data it was built from is cached: the variants are cheap to build
+    if "top_10_sorted_cache" in items:
+        await precompute_top_variants()
 
+
+write_listeners.append(on_cache_write)
+
+
+async def get_top_variants(queries: List[TopQuery], use_cache: bool = True) -> Tuple[Dict[str, bytes], str]:
+    # The bodies of the queries (by variant key) and the state of the precomputed variants they were read from.
+    # The popular ones are served from the precomputed variants, the others are built together. While the popular
+    # ones aren't precomputed yet, they're all built along with the queries (from the same data) and cached.
+    bodies, cache_state = {}, MISS
+    if use_cache and any(query.key() in popular_keys for query in queries):
+        cached, cache_state, data_hash = await cache_get_with_hash(VARIANTS_KEY)
+        if cache_state == STALE:
+            await schedule_refresh(VARIANTS_KEY, build_tracked_top_variants)
+        if cached is not None:
+            bodies.update(encode_bodies(cached, data_hash))
+
+    missing = [query for query in queries if query.key() not in bodies]
+    if missing:
+        precompute = use_cache and cache_state == MISS and any(query.key() in popular_keys for query in missing)
+        versions = {} if precompute else None
+        built = await build_top_variants(missing + popular_queries if precompute else missing, versions, use_cache)
+        if precompute:
+            await record_dependencies(VARIANTS_KEY, versions)
+            await cache_set(VARIANTS_KEY, {key: built[key] for key in popular_keys})
+        bodies.update({query.key(): built[query.key()].encode("utf-8") for query in missing})
+    return bodies, cache_state
+
+
+def parse_height(height: str) -> Optional[int]:
+    # SWAPI heights are strings, "unknown" when they are not known
+    return int(height) if height.isdigit() else None
+
+
+def sort_characters(characters: List[dict], sort_key: str, descending: bool) -> List[dict]:
+    # Sort by sort_key, characters without a value for it (e.g. unknown height) always go last
+    known = [character for character in characters if character[sort_key] is not None]
+    unknown = [character for character in characters if character[sort_key] is None]
+    return sorted(known, key=itemgetter(sort_key), reverse=descending) + unknown
+
+
+async def read_top_10_sorted_cache():
+    top_10_sorted, _ = await cache_get("top_10_sorted_cache")
+    return top_10_sorted
+
+
+async def rebuild_top_10_sorted_cache():
+    top_10_sorted = await build_tracked_top_10_sorted()
+
+    # Cache the result, it's fresh for the derived TTL and kept (stale) until the derived hard TTL. It's recomputed
+    # before that if the films, characters or species it was built from change.
+    await cache_set("top_10_sorted_cache", top_10_sorted)
+    ttl, hard_ttl = ttls("top_10_sorted_cache")
+    logger.info(f" - Cache set with TTL: {ttl} seconds (hard TTL: {hard_ttl} seconds)")
+
+    return top_10_sorted
+
+
+# The handlers below send prebuilt bodies (a plain Response), so their responses are documented here rather than by a
+# response_model: the list as JSON or, with format=csv, as CSV text
+TOP_RESPONSES = {200: {"model": List[CharacterBasicInfo], "description": "The list (json) or the CSV text (csv)",
+                       "content": {MEDIA_TYPES[ResponseFormat.csv]: {"schema": {"type": "string"}}}}}
+BATCH_RESPONSES = {200: {"model": List[TopQueryResult],
+                         "description": "The results, in the order of the queries (always JSON, CSV results as text)"}}
+
+
+@router.get("/top", response_model=None, responses=TOP_RESPONSES, description=GET_TOP_DESCRIPTION)
+async def get_top(n: int = Query(10, ge=1, le=100),
+                  sort: CharacterSortKey = CharacterSortKey.height,
+                  order: SortOrder = SortOrder.desc,
+                  format: ResponseFormat = ResponseFormat.json):
+
+    query = TopQuery(n=n, sort=sort, order=order, format=format)
+    bodies, cache_state = await get_top_variants([query])
+    # The body is already rendered (and validated), it's sent as it is
+    return Response(content=bodies[query.key()], media_type=MEDIA_TYPES[format], headers={"X-Cache": cache_state})
+
+
+@router.post("/batch", response_model=None, responses=BATCH_RESPONSES, description=POST_BATCH_DESCRIPTION)
+async def batch_top(batch: TopQueryBatch, use_cache: bool = True):
+
+    bodies, cache_state = await get_top_variants(batch.queries, use_cache)
+    return Response(content=batch_body(batch.queries, bodies), media_type="application/json",
+                    headers={"X-Cache": cache_state})
+
+
+@router.get("/query", response_model=CharacterQueryResult, description=GET_QUERY_DESCRIPTION)
+async def query_characters(species: Optional[str] = None,
+                           film: Optional[int] = Query(None, ge=1),
+                           min_height: Optional[int] = Query(None, ge=0),
+                           max_height: Optional[int] = Query(None, ge=0),
+                           sort: CharacterQuerySortKey = CharacterQuerySortKey.height,
+                           order: SortOrder = SortOrder.desc,
+                           offset: int = Query(0, ge=0),
+                           limit: int = Query(10, ge=1, le=100)):
+    """Filter, sort and paginate the whole cast"""
+    index = await get_character_index(await fetch_films_data())
+    total, results = index.query(species, film, min_height, max_height, sort.value, order == SortOrder.desc,
+                                 offset, limit)
+    return {"total": total, "offset": offset, "limit": limit, "results": results}
+
+
+async def get_top_10_sorted_data(use_cache: bool = True):
+    # Return the top 10 list, the state of its cache entry (fresh, stale or miss) and its content hash
     top_10_sorted = None
+    cache_state = MISS
+    data_hash = None
     if use_cache:
-        cache_data = redis_client.get("top_10_sorted_cache")
-    else:
-        cache_data = None
-    if bool(cache_data):
-        logger.info(f" - Cache TTL: {redis_client.ttl('top_10_sorted_cache')} seconds")
-        top_10_sorted = json.loads(cache_data.decode("utf-8"))
-    else:
+        top_10_sorted, cache_state, data_hash = await cache_get_with_hash("top_10_sorted_cache")
+    if cache_state == STALE:
+        # Serve the stale list right away, a single background task rebuilds it
+        await schedule_refresh("top_10_sorted_cache", build_tracked_top_10_sorted)
+    elif use_cache and cache_state == MISS:
         logger.info(" - No cache found, fetching data from API")
-        #this could be dynamic but the request was to use 10 characters only
-        max_characters = 10
-
-        # Fetch films data
-        films_data = fetch_films_data()
-
-        # Count character appearances in all movies
-        character_appearances = {}
-        for film in films_data["results"]:
-            for character_url in film["characters"]:
-                if character_url not in character_appearances:
-                    character_appearances[character_url] = {
-                        "url": character_url,
-                        "count": 0
-                    }
-                character_appearances[character_url]["count"] += 1
-
-        # Sort characters based on appearance count and get top nth characters
-        top_characters_data = {}
-        for character in sorted(character_appearances.values(), key=lambda x: x["count"], reverse=True):
-            top_characters_data[character["url"]] = character
-            if len(top_characters_data) == max_characters:
-                break
-
-        # Fetch character data per character concurrently
-        with ThreadPoolExecutor(max_workers=settings.max_concurrent_workers) as executor:
-            futures_to_character_urls = {executor.submit(
-                fetch_character_data, url): url for url in top_characters_data}
-            for future in as_completed(futures_to_character_urls):
-                url = futures_to_character_urls[future]
-                try:
-                    top_characters_data[url] = future.result()
-                except Exception as exc:
-                    logger.error(f"Fetching character {url} raised an exception: {exc}")
-                    raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                                        detail=f"Unable to fetch character data for {url}")
-
-        # Fetch species data per character concurrently
-        with ThreadPoolExecutor(max_workers=settings.max_concurrent_workers) as executor:
-            futures_to_character_urls_species = {}
-            for url, character in top_characters_data.items():
-                for species_url in character["species"]:
-                    future = executor.submit(fetch_species_data, species_url)
-                    futures_to_character_urls_species[(url, species_url)] = future
-
-            for (url, species_url), future in futures_to_character_urls_species.items():
-                try:
-                    species_data = future.result()
-                    species_index = top_characters_data[url]["species"].index(species_url)
-                    top_characters_data[url]["species"][species_index] = species_data["name"]
-                except Exception as exc:
-                    logger.error(f"Fetching species {species_url} for character {url} raised an exception: {exc}")
-                    raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
-                                        detail=f"Unable to fetch species data for {species_url}")
-
-        # Format species names and add the appearances count explicitly
-        for url, character in top_characters_data.items():
-            top_characters_data[url]["species"] = " & ".join(character["species"])
-            top_characters_data[url]["appearances"] = len(character["films"])
-
-        # Sort characters based on height
-        top_10_sorted = sorted(top_characters_data.values(), key=lambda x: int(x["height"]), reverse=True)
-
-        if use_cache:
-            # Cache the result with a TTL of settings.cache_ttl
-            redis_client.setex("top_10_sorted_cache", settings.cache_ttl, json.dumps(top_10_sorted))
-            logger.info(f" - Cache set with TTL: {settings.cache_ttl} seconds")
-
-    # Create a CSV with the columns: name, species, height, appearances
-    # It's a bit overkill to use Pandas for this simple case, but lets do it anyway.
-
-    # Create a dataframe with the data
-    df = pd.DataFrame(top_10_sorted)
-
-    # Select the columns we want
-    df = df[["name", "species", "height", "appearances"]]
-
-    # There's no need to rename the columns in this case, but we could do it like this:
-    # df = df.rename(columns={"name": "Name", "species": "Species", "height": "Height", "appearances": "Appearances"})
-
-    # Save the dataframe as a CSV file in the ./csv folder. Create the folder if it doesn't exist
-    os.makedirs("csv", exist_ok=True)
-    df.to_csv("csv/top_10_sorted.csv", index=False)
-
-    # Print the csv file content
-    logger.info("\n\n\nCSV file content:\n\n%s" % df.to_csv(index=False))
-
-    # Send the CSV to httpbin.org
-    with open('csv/top_10_sorted.csv', 'rb') as f:
-        files = {'file': f}
-        response = requests.post('https://httpbin.org/post', files=files)
-        if response.status_code != 200:
-            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
-                                detail="Unable to send CSV file to httpbin.org")
-        else:
-            logger.info(" - CSV file sent to httpbin.org successfully")
-
-    return top_10_sorted
\ No newline at end of file
+        # Only one rebuild runs per key (across workers too), concurrent callers wait for its result
+        try:
+            top_10_sorted = await single_flight("top_10_sorted_cache", rebuild_top_10_sorted_cache,
+                                                read_top_10_sorted_cache)
+        except HTTPException as exc:
+            # SWAPI is failing (or its circuit breaker is open): serve the last good list if there's one
+            top_10_sorted, data_hash = await cache_get_last_good("top_10_sorted_cache")
+            if top_10_sorted is None or exc.status_code < 500:
+                raise
+            logger.warning(f" - Serving the last good top 10 list, rebuilding it failed: {exc.detail}")
+            cache_state = STALE_IF_ERROR
+    elif not use_cache:
+        logger.info(" - Cache disabled, fetching data from API")
+        top_10_sorted = await build_top_10_sorted(use_cache=False)
+
+    return top_10_sorted, cache_state, data_hash or content_hash(top_10_sorted)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # Whether the client already has this version (If-None-Match lists the ETags it has, or is "*")
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    client_etags = [client_etag.strip() for client_etag in if_none_match.split(",")]
+    return "*" in client_etags or any(client_etag.removeprefix("W/") == etag for client_etag in client_etags)
+
+
+async def export_top_10_sorted(top_10_sorted: List[dict], data_hash: str) -> Optional[str]:
+    # Save the CSV to disk and queue it to be sent to httpbin.org, returning the delivery job id.
+    # Nothing is regenerated or sent again while the list is unchanged (same content hash).
+    # While Redis is down the CSV is only saved (the delivery queue is in Redis), it's queued once Redis is back.
+    job_id = exported_csv.get(data_hash)
+    if job_id is not None:
+        return job_id
+
+    with timed("stage_duration_seconds", stage="csv_build"):
+        # Create a CSV with the columns: name, species, height, appearances (streamed straight into memory)
+        csv_content = build_csv(top_10_sorted)
+        logger.debug("\n\n\nCSV file content:\n\n%s" % csv_content.decode("utf-8"))
+
+        # Save it to disk (settings.csv_output_path, by default ./csv/top_10_sorted.csv), in a thread so the file
+        # write doesn't block the event loop
+        await asyncio.to_thread(save_csv, csv_content, settings.csv_output_path)
+
+    # Queue the CSV to be sent to httpbin.org in the background (an unchanged CSV isn't sent again, by any worker).
+    # The upload itself runs in the delivery worker, see upstream_request_duration_seconds{resource="httpbin"}.
+    if not redis_available():
+        return None
+    with timed("stage_duration_seconds", stage="upload"):
+        try:
+            job_id, _ = await enqueue_delivery(csv_content)
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+            return None
+    exported_csv.set(data_hash, job_id)
+    return job_id
+
+
+@router.get("/top_10_sorted", response_model=List[CharacterBasicInfo], description=GET_TOP_10_SORTED_DESCRIPTION)
+async def get_top_10_sorted(request: Request, response: Response, use_cache: bool = True):
+
+    top_10_sorted, cache_state, data_hash = await get_top_10_sorted_data(use_cache)
+    job_id = await export_top_10_sorted(top_10_sorted, data_hash)
+
+    headers = {"ETag": f'"{data_hash}"', "X-Cache": cache_state}
+    if job_id is not None:
+        headers["X-Delivery-Job"] = job_id
+    if etag_matches(request, headers["ETag"]):
+        # The client already has this list, don't serialise it again
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # The same list is only validated and serialised once per worker, not on every request
+    body = rendered_top_10_sorted.get(data_hash)
+    if body is None:
+        body = render_json(top_10_sorted)
+        rendered_top_10_sorted.set(data_hash, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/top_10_sorted.csv", response_class=StreamingResponse, description=GET_TOP_10_SORTED_CSV_DESCRIPTION)
+async def get_top_10_sorted_csv(request: Request, use_cache: bool = True):
+
+    top_10_sorted, cache_state, data_hash = await get_top_10_sorted_data(use_cache)
+
+    # Not the same representation as the JSON list, so not the same ETag
+    headers = {"ETag": f'"{data_hash}-csv"', "X-Cache": cache_state}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return StreamingResponse(iter_csv(top_10_sorted), media_type="text/csv", headers={
+        "Content-Disposition": 'attachment; filename="top_10_sorted.csv"',
+        **headers
+    })
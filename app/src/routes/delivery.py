@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException, status
+from ..schemas import DeliveryJob, DeliveryStats
+from ..delivery import delivery_stats, get_delivery_job
+from ..redis_health import REDIS_ERRORS, mark_redis_down
+
+router = APIRouter(
+    prefix="/deliveries",
+    tags=["Deliveries"]
+)
+
+REDIS_UNAVAILABLE = "The delivery queue is in Redis, which is unavailable"
+
+
+@router.get("", response_model=DeliveryStats)
+async def get_delivery_stats():
+    """Returns the depth of the CSV delivery queue and the status of the last queued delivery."""
+
+    try:
+        return await delivery_stats()
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=REDIS_UNAVAILABLE)
+
+
+@router.get("/{job_id}", response_model=DeliveryJob)
+async def get_delivery(job_id: str):
+    """Returns the status of a CSV delivery job."""
+
+    try:
+        job = await get_delivery_job(job_id)
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=REDIS_UNAVAILABLE)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Delivery job not found")
+    return job
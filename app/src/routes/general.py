@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends
-from ..config import Settings
-from ..schemas import AppInfo, HealthCheck
-from redis import Redis
-from ..utils import get_redis_client
-
-settings = Settings()
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from ..config import get_settings
+from ..schemas import AppInfo, CacheStats, HealthCheck
+from ..cache import cache_stats
+from ..circuit_breaker import breaker_states
+from ..metrics import render
+from .. import redis_health
+from ..redis_health import probe_redis, redis_available
+
+settings = get_settings()
 
 router = APIRouter(
     tags=["General"]
@@ -12,16 +16,38 @@ router = APIRouter(
 
 
 @router.get("/healthcheck", response_model=HealthCheck)
-def healthcheck(redis_client: Redis = Depends(get_redis_client)):
+async def healthcheck():
     """Returns the health status of the app."""
     result = {"app": "up", "redis": "disconnected"}
 
-    if redis_client.ping():
+    # A dead Redis is reported as disconnected within the socket timeout, the request doesn't hang on it.
+    # Once it's known to be down it isn't pinged here, the background reconnect checks when it's back.
+    if redis_available() and await probe_redis():
         result["redis"] = "connected"
+    else:
+        result["status"] = "degraded"
+        result["redis_down_since"] = redis_health.down_since
+
+    # Circuit breaker state of each SWAPI resource family (closed, open or half-open)
+    result["upstream"] = await breaker_states()
 
     return result
 
 
+@router.get("/cache/stats", response_model=CacheStats)
+def get_cache_stats():
+    """Returns the hit, miss and eviction counters of each cache tier (local to this worker and Redis)."""
+
+    return cache_stats()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Returns the request, stage, upstream and cache metrics of all the workers in the Prometheus text format."""
+
+    return render()
+
+
 @router.get("/", response_model=AppInfo)
 def root():
     """Returns basic information about the app."""
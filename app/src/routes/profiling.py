@@ -0,0 +1,32 @@
+# ./app/src/routes/profiling.py
+
+from fastapi import APIRouter, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
+from ..schemas import ProfileFormat, RequestProfile
+from ..profiling import client_allowed, collapsed_stacks, get_profile
+from ..redis_health import REDIS_ERRORS, mark_redis_down
+
+router = APIRouter(
+    prefix="/profiles",
+    tags=["Profiling"]
+)
+
+
+@router.get("/{profile_id}", response_model=RequestProfile)
+async def download_profile(request: Request, profile_id: str,
+                           format: ProfileFormat = ProfileFormat.json):
+    """Returns the profile of a request (its id is in the X-Profile-Id header), as JSON or as collapsed stacks."""
+
+    if not client_allowed(request.client.host if request.client else None):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiling isn't allowed for this client")
+    try:
+        profile = await get_profile(profile_id)
+    except REDIS_ERRORS as exc:
+        mark_redis_down(exc)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Profiles are stored in Redis, which is unavailable")
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found (or expired)")
+    if format == ProfileFormat.collapsed:
+        return PlainTextResponse(collapsed_stacks(profile))
+    return profile
@@ -5,7 +5,41 @@
 GET_TOP_10_SORTED_DESCRIPTION = """ 
 Returns a list of the 10 characters that appear the most in all the Star Wars movies (listed in https://swapi.dev/) , sorted by their height in descending order (tall first).
 
-It also generates a CSV file with the columns name, species, films, and height, saves it to disk, and sends it to https://httpbin.org
+It also generates a CSV file with the columns name, species, films, and height, saves it to disk, and queues it to be sent to https://httpbin.org in the background (an unchanged CSV isn't sent again). The X-Delivery-Job response header has the id of the delivery job, its status is available at /deliveries/{job_id}
     
-Internally it uses cache so it can be called multiple times without hitting the API.
-"""
\ No newline at end of file
+Internally it uses cache so it can be called multiple times without hitting the API. Once the cached list is older than the cache TTL it's still served (stale) while it's refreshed in the background.
+The X-Cache response header tells whether the list was fresh, stale or a miss. With use_cache=false the cache is bypassed: every film, character and species is fetched from the API, and nothing is cached.
+
+The response has a strong ETag (a hash of the list). Send it back in If-None-Match and you'll get a 304 Not Modified, with no body, while the list is unchanged. The CSV isn't regenerated or sent again while the list is unchanged either.
+"""
+
+GET_TOP_DESCRIPTION = """
+Returns the n characters that appear the most in all the Star Wars movies (listed in https://swapi.dev/), sorted by the selected field (height, name or appearances) in the selected order.
+
+Characters whose value for the selected field is unknown are listed last.
+
+The appearance counts come from a precomputed index that is only rebuilt when the films data changes, and the character and species data is shared with the other endpoints' cache, so any n is answered without recounting.
+
+Use format=csv to get the list as CSV (columns name, species, height and appearances). The popular variants (POPULAR_VARIANTS, e.g. the top 10 by height as JSON or CSV) are precomputed right after each refresh of the data and served as they are, the X-Cache response header tells whether they were fresh, stale or a miss.
+"""
+
+POST_BATCH_DESCRIPTION = """
+Answers several /characters/top queries in one request. Each query has an n, a sort key (height, name or appearances), an order (asc or desc) and a format (json or csv), and the results are returned in the same order, with the list (json) or the CSV text (csv) in their data field.
+
+The films, the ranking and the characters and species are only read once for the whole batch (for the largest n), and the popular variants are served precomputed. Nothing is saved to disk or sent to https://httpbin.org. With use_cache=false everything is fetched from the API (and not cached).
+"""
+
+GET_TOP_10_SORTED_CSV_DESCRIPTION = """
+Returns the same list as /characters/top_10_sorted as a CSV file download (columns name, species, height and appearances), streamed row by row.
+
+It shares the cache with /characters/top_10_sorted and it also supports ETag / If-None-Match (304 Not Modified), and it doesn't save the file to disk or send it to https://httpbin.org
+"""
+
+GET_QUERY_DESCRIPTION = """
+Returns the characters of all the Star Wars movies (listed in https://swapi.dev/) matching the filters, sorted by the selected field (height, mass or appearances) in the selected order, one page at a time.
+
+Filters (all optional, combined): species (id or name, e.g. 2 or Droid), film (id) and a height range (min_height, max_height, in cm; characters of unknown height don't match a range). Characters whose value for the sort field is unknown are listed last.
+The response has the total number of matching characters, and the offset and limit (at most 100) of the page.
+
+It's answered from an in-memory index of the whole cast (one column per field, species and film inverted indexes and presorted orders), without calling SWAPI. The index is built from the bulk store and rebuilt when the people, species or films data changes.
+"""
@@ -1,10 +1,68 @@
-from pydantic import BaseModel, HttpUrl
-from typing import List, Optional
+from pydantic import BaseModel, Field, HttpUrl, validator
+from typing import Dict, List, Optional, Union
+from enum import Enum
 
 
 class HealthCheck(BaseModel):
     app: str
     redis: str
+    status: str = "ok"  # "degraded" while Redis is down (the in-process fallback cache is served instead)
+    redis_down_since: Optional[float] = None
+    upstream: Dict[str, str] = {}  # Circuit breaker state per SWAPI resource family
+
+
+class CacheTierStats(BaseModel):
+    hits: int
+    misses: int
+    evictions: Optional[int] = None
+    size: Optional[int] = None
+
+
+class CacheStats(BaseModel):
+    local: CacheTierStats
+    redis: CacheTierStats
+    fallback: Optional[CacheTierStats] = None  # Served while Redis is down
+
+
+class DeliveryJob(BaseModel):
+    id: str
+    content_hash: str
+    status: str
+    attempts: int
+    created_at: float
+    updated_at: float
+    delivered_at: Optional[float] = None
+    next_attempt_at: Optional[float] = None
+    last_error: Optional[str] = None
+
+
+class DeliveryStats(BaseModel):
+    queued: int
+    processing: int
+    retrying: int
+    last_job: Optional[DeliveryJob] = None
+
+
+class InvalidationResult(BaseModel):
+    entity: str  # e.g. people:1
+    invalidated: List[str]  # Cache keys dropped (the entity's and the derived entries built from it)
+
+
+class ProfileTiming(BaseModel):
+    seconds: float
+    count: int
+
+
+class RequestProfile(BaseModel):
+    id: str
+    method: str
+    path: str
+    started_at: float
+    duration: float  # in seconds
+    timings: Dict[str, ProfileTiming]  # Wall-clock breakdown (stages, Redis, upstream calls, fetch_*_data)
+    sample_interval: Optional[float] = None  # in seconds, None if the CPU profile was disabled
+    samples: int
+    stacks: Dict[str, int]  # Collapsed stacks of the CPU profile -> samples
 
 
 class AppInfo(BaseModel):
@@ -14,7 +72,11 @@ class AppInfo(BaseModel):
     author: Optional[str] = None
 
 
+# The fields of the SWAPI schemas below are the only ones kept when the data is cached
+
+
 class Film(BaseModel):
+    url: HttpUrl
     characters: List[HttpUrl]
 
 
@@ -23,17 +85,89 @@ class FilmList(BaseModel):
 
 
 class Character(BaseModel):
-    height: int
+    url: HttpUrl
+    name: str
+    height: str  # A number or "unknown"
+    mass: str  # A number (maybe with thousands separators) or "unknown"
     films: List[HttpUrl]
     species: List[HttpUrl]
 
 
 class Species(BaseModel):
+    url: HttpUrl
     name: str
 
 
 class CharacterBasicInfo(BaseModel):
     name: str
-    height: int
+    height: Optional[int]
+    mass: Optional[float] = None
     appearances: int
     species: str
+    url: Optional[str] = None
+
+    @validator("mass", pre=True)
+    def parse_mass(cls, mass):
+        # SWAPI masses are strings like "1,358" or "unknown"
+        if isinstance(mass, str):
+            mass = mass.replace(",", "")
+            return float(mass) if mass.replace(".", "", 1).isdigit() else None
+        return mass
+
+
+class CharacterQueryResult(BaseModel):
+    total: int  # Characters matching the filters
+    offset: int
+    limit: int
+    results: List[CharacterBasicInfo]
+
+
+class CharacterSortKey(str, Enum):
+    name = "name"
+    height = "height"
+    appearances = "appearances"
+
+
+class CharacterQuerySortKey(str, Enum):
+    height = "height"
+    mass = "mass"
+    appearances = "appearances"
+
+
+class SortOrder(str, Enum):
+    asc = "asc"
+    desc = "desc"
+
+
+class ResponseFormat(str, Enum):
+    json = "json"
+    csv = "csv"  # Columns name, species, height and appearances
+
+
+class TopQuery(BaseModel):
+    n: int = Field(10, ge=1, le=100)
+    sort: CharacterSortKey = CharacterSortKey.height
+    order: SortOrder = SortOrder.desc
+    format: ResponseFormat = ResponseFormat.json
+
+    def key(self) -> str:
+        # e.g. 10:height:desc:json, the form settings.popular_variants are listed in
+        return f"{self.n}:{self.sort.value}:{self.order.value}:{self.format.value}"
+
+    @classmethod
+    def parse_key(cls, key: str) -> "TopQuery":
+        n, sort, order, format = key.strip().split(":")
+        return cls(n=n, sort=sort, order=order, format=format)
+
+
+class TopQueryBatch(BaseModel):
+    queries: List[TopQuery] = Field(..., min_items=1, max_items=20)
+
+
+class TopQueryResult(TopQuery):
+    data: Union[List[CharacterBasicInfo], str]  # The list (json) or the CSV text (csv)
+
+
+class ProfileFormat(str, Enum):
+    json = "json"
+    collapsed = "collapsed"  # Collapsed stacks of the CPU profile (flamegraph.pl, speedscope)
@@ -0,0 +1,88 @@
+# ./app/src/singleflight.py
+
+from typing import Any, Awaitable, Callable, Optional
+from redis.exceptions import LockError
+from .config import get_settings
+from .utils import get_async_redis_client
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+in_flight = {}  # Rebuilds currently running in this worker (key -> asyncio.Future)
+
+
+async def single_flight(key: str,
+                        compute: Callable[[], Awaitable[Any]],
+                        read_cached: Callable[[], Awaitable[Optional[Any]]]):
+    # Run compute() at most once per key, no matter how many callers ask for it at the same time.
+    # Callers in the same worker await the rebuild already in flight. Across workers, a Redis lease decides who
+    # rebuilds; the others poll read_cached() until the result shows up in the cache.
+    loop = asyncio.get_running_loop()
+    future = in_flight.get(key)
+    if future is not None and future.get_loop() is loop:
+        logger.info(f" - Joining in-flight rebuild of {key}")
+        return await asyncio.shield(future)
+
+    future = loop.create_future()
+    in_flight[key] = future
+    try:
+        result = await _run_with_lease(key, compute, read_cached)
+        future.set_result(result)
+        return result
+    except BaseException as exc:
+        future.set_exception(exc)
+        # Mark the exception as retrieved, there may be no other callers waiting for it
+        future.exception()
+        raise
+    finally:
+        if in_flight.get(key) is future:
+            del in_flight[key]
+
+
+async def _run_with_lease(key: str,
+                          compute: Callable[[], Awaitable[Any]],
+                          read_cached: Callable[[], Awaitable[Optional[Any]]]):
+    # Only the worker holding the lease rebuilds. The lease expires on its own if that worker dies mid-rebuild.
+    # While Redis is down the workers can't coordinate, each one rebuilds on its own.
+    if not redis_available():
+        return await compute()
+    redis_client = get_async_redis_client()
+    lease = redis_client.lock(f"lease:{key}", timeout=settings.single_flight_lease_ttl)
+    deadline = asyncio.get_running_loop().time() + settings.single_flight_wait_timeout
+
+    while True:
+        try:
+            acquired = await lease.acquire(blocking=False)
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+            return await compute()
+        if acquired:
+            try:
+                # Another worker may have finished the rebuild while we were waiting for the lease
+                cached = await read_cached()
+                if cached is not None:
+                    return cached
+                return await compute()
+            finally:
+                try:
+                    await lease.release()
+                except LockError:
+                    logger.warning(f" - Lease for {key} expired before the rebuild finished")
+                except REDIS_ERRORS as exc:
+                    mark_redis_down(exc)
+
+        cached = await read_cached()
+        if cached is not None:
+            return cached
+
+        if asyncio.get_running_loop().time() >= deadline:
+            # The lease holder is too slow (or gone), rebuild on our own rather than failing the request
+            logger.warning(f" - Timed out waiting for the rebuild of {key}, rebuilding in this worker")
+            return await compute()
+
+        await asyncio.sleep(settings.single_flight_poll_interval)
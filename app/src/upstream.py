@@ -0,0 +1,268 @@
+# ./app/src/upstream.py
+
+# Shared upstream HTTP client and the process-wide scheduler of the upstream calls.
+#
+# Every upstream call of a worker goes through the scheduler, whatever request or background task makes it:
+# - At most settings.upstream_max_concurrency calls are in flight at a time, in total
+# - Every host has its own limit, adjusted by AIMD (additive increase, multiplicative decrease) between
+#   settings.upstream_host_min_concurrency and settings.upstream_host_max_concurrency: it grows by one slot per
+#   limit's worth of successful calls, and it's multiplied by settings.upstream_decrease_factor (at most once per
+#   round trip) when a call fails (connection error, timeout, 5xx or 429), or when settings.upstream_congestion_samples
+#   calls in a row are much slower than the host's baseline latency (settings.upstream_latency_tolerance times it),
+#   i.e. when the host looks congested. The baseline is a moving average of the latency, so it follows the host up
+#   and down and a single slow call (jitter) doesn't count.
+# - Calls over either limit wait in a FIFO queue
+# - Concurrent GETs of the same URL share a single call
+# The limits, calls in flight and queue depth of every host are exported as metrics.
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+from collections import deque
+from urllib.parse import urlsplit
+from .config import get_settings
+from .metrics import increment, set_gauge
+import asyncio
+import httpx
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+upstream_client = None  # Global variable to store the shared upstream HTTP client instance
+upstream_client_loop = None  # Event loop the client was created on (connections can't be shared across loops)
+
+
+def get_upstream_client() -> httpx.AsyncClient:
+    # Return the shared, pooled HTTP/1.1 keep-alive client for this worker.
+    # Every SWAPI (and httpbin) call goes through this client, so connections are reused across requests
+    # instead of paying a new TCP+TLS handshake per URL.
+    global upstream_client, upstream_client_loop
+
+    loop = asyncio.get_running_loop()
+    if upstream_client is None or upstream_client.is_closed or upstream_client_loop is not loop:
+        logger.info("Initializing the upstream HTTP client")
+        upstream_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.upstream_max_connections,
+                max_keepalive_connections=settings.upstream_max_keepalive_connections,
+                keepalive_expiry=settings.upstream_keepalive_expiry
+            ),
+            timeout=httpx.Timeout(settings.upstream_read_timeout, connect=settings.upstream_connect_timeout),
+            follow_redirects=True
+        )
+        upstream_client_loop = loop
+
+    return upstream_client
+
+
+async def close_upstream_client():
+    # Close the shared client (and its pooled connections). Called on application shutdown.
+    global upstream_client, upstream_client_loop
+
+    # A client created on another (already closed) event loop can't be closed from this one, it's just dropped
+    if upstream_client is not None and not upstream_client.is_closed \
+            and upstream_client_loop is asyncio.get_running_loop():
+        await upstream_client.aclose()
+    upstream_client = None
+    upstream_client_loop = None
+
+
+# Upstream responses that mean the host is overloaded (besides connection errors and timeouts)
+OVERLOADED_STATUS_CODES = (429, 500, 502, 503, 504)
+LATENCY_SMOOTHING = 0.1  # Weight of each call in the moving average of a host's latency
+
+
+class HostState:
+
+    def __init__(self, limit: float):
+        self.limit = limit  # Adaptive concurrency limit (fractional, the usable slots are its integer part)
+        self.in_flight = 0
+        self.waiting = 0
+        self.baseline_latency = None  # Moving average of the host's latency, in seconds
+        self.slow_calls = 0  # Calls in a row much slower than the baseline
+        self.last_decrease = 0.0
+
+
+class UpstreamScheduler:
+    # The waiting callers can be on different event loops (e.g. threads running their own loop), so the state is
+    # guarded by a thread lock and the waiters are woken up on their own loop.
+
+    def __init__(self, max_concurrency: int, host_min: int, host_max: int, host_initial: int,
+                 latency_tolerance: float, decrease_factor: float, congestion_samples: int):
+        self.max_concurrency = max_concurrency
+        self.host_min = host_min
+        self.host_max = host_max
+        self.host_initial = host_initial
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.congestion_samples = congestion_samples
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.hosts = {}  # host -> HostState
+        self.queue = deque()  # Waiters, first come first served: [host, loop, future]
+        self.in_flight_gets = {}  # url -> asyncio.Future of the GET in flight
+
+    def host_state(self, host: str) -> HostState:
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(min(max(self.host_initial, self.host_min), self.host_max))
+        return state
+
+    def has_slot(self, state: HostState) -> bool:
+        return self.in_flight < self.max_concurrency and state.in_flight < int(state.limit)
+
+    def start(self, host: str, state: HostState):
+        self.in_flight += 1
+        state.in_flight += 1
+        self.publish(host, state)
+
+    def publish(self, host: str, state: HostState):
+        set_gauge("upstream_max_concurrency", self.max_concurrency)
+        set_gauge("upstream_concurrency_limit", int(state.limit), host=host)
+        set_gauge("upstream_in_flight", state.in_flight, host=host)
+        set_gauge("upstream_queue_depth", state.waiting, host=host)
+
+    async def acquire(self, host: str):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            state = self.host_state(host)
+            # Callers already waiting for this host go first
+            if not state.waiting and self.has_slot(state):
+                self.start(host, state)
+                return
+            waiter = [host, loop, loop.create_future()]
+            self.queue.append(waiter)
+            state.waiting += 1
+            self.publish(host, state)
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            with self.lock:
+                if waiter in self.queue:
+                    self.queue.remove(waiter)
+                    state.waiting -= 1
+                    self.publish(host, state)
+                    raise
+            self.release(host)  # Cancelled after it was given a slot
+            raise
+
+    def release(self, host: str):
+        with self.lock:
+            self.in_flight -= 1
+            state = self.hosts[host]
+            state.in_flight -= 1
+            self.publish(host, state)
+            self.dispatch()
+
+    def dispatch(self):
+        # Give the free slots to the waiters, in order (with the lock held)
+        if self.in_flight >= self.max_concurrency:
+            return
+        for waiter in list(self.queue):
+            host, loop, future = waiter
+            state = self.hosts[host]
+            if not self.has_slot(state):
+                continue
+            self.queue.remove(waiter)
+            state.waiting -= 1
+            self.start(host, state)
+            loop.call_soon_threadsafe(wake_up, future)
+            if self.in_flight >= self.max_concurrency:
+                return
+
+    def record(self, host: str, latency: float, overloaded: bool, now: Optional[float] = None):
+        # AIMD: decrease the host's limit if it failed or looks congested, increase it otherwise
+        with self.lock:
+            state = self.host_state(host)
+            congested = False
+            if not overloaded:
+                if state.baseline_latency is None:
+                    state.baseline_latency = latency
+                slow = latency > state.baseline_latency * self.latency_tolerance
+                state.baseline_latency += (latency - state.baseline_latency) * LATENCY_SMOOTHING
+                state.slow_calls = state.slow_calls + 1 if slow else 0
+                congested = state.slow_calls >= self.congestion_samples
+
+            if overloaded or congested:
+                state.slow_calls = 0
+                # The calls of the same round trip all see the same congestion, only the first one counts
+                now = time.monotonic() if now is None else now
+                if now - state.last_decrease < latency or state.limit <= self.host_min:
+                    return
+                state.limit = max(self.host_min, state.limit * self.decrease_factor)
+                state.last_decrease = now
+                increment("upstream_limit_changes_total", host=host, direction="decrease")
+                logger.warning(f" - Upstream {host} looks {'overloaded' if overloaded else 'congested'} "
+                               f"({latency * 1000:.0f} ms), concurrency limit lowered to {int(state.limit)}")
+            elif state.slow_calls == 0 and state.limit < self.host_max:
+                previous = int(state.limit)
+                state.limit = min(self.host_max, state.limit + 1 / state.limit)
+                if int(state.limit) > previous:
+                    increment("upstream_limit_changes_total", host=host, direction="increase")
+                    self.dispatch()
+            self.publish(host, state)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Send a request with the shared client once there's a free slot for its host
+        host = urlsplit(url).netloc
+        await self.acquire(host)
+        start = time.perf_counter()
+        overloaded = True
+        try:
+            response = await get_upstream_client().request(method, url, **kwargs)
+            overloaded = response.status_code in OVERLOADED_STATUS_CODES
+            return response
+        finally:
+            self.record(host, time.perf_counter() - start, overloaded)
+            self.release(host)
+
+    async def deduplicate(self, url: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        # Run fetch() once for all the concurrent callers asking for url (in this event loop), they share its
+        # result (or exception). The result is shared, so it must be treated as read-only.
+        loop = asyncio.get_running_loop()
+        future = self.in_flight_gets.get(url)
+        if future is not None and future.get_loop() is loop:
+            increment("upstream_deduplicated_total", host=urlsplit(url).netloc)
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self.in_flight_gets[url] = future
+        try:
+            result = await fetch()
+            future.set_result(result)
+            return result
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # Retrieved, there may be no other callers waiting for it
+            raise
+        finally:
+            if self.in_flight_gets.get(url) is future:
+                del self.in_flight_gets[url]
+
+    def reset(self):
+        # Forget every host (their limits and latencies) and the GETs in flight
+        with self.lock:
+            self.in_flight = 0
+            self.hosts.clear()
+            self.queue.clear()
+            self.in_flight_gets.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {host: {"limit": int(state.limit), "in_flight": state.in_flight, "waiting": state.waiting}
+                    for host, state in self.hosts.items()}
+
+
+def wake_up(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+    # else: it was cancelled meanwhile, its caller gives the slot back
+
+
+scheduler = UpstreamScheduler(settings.upstream_max_concurrency, settings.upstream_host_min_concurrency,
+                              settings.upstream_host_max_concurrency, settings.upstream_host_initial_concurrency,
+                              settings.upstream_latency_tolerance, settings.upstream_decrease_factor,
+                              settings.upstream_congestion_samples)
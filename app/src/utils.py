@@ -1,25 +1,104 @@
 # ./src/utils.py
 
-from fastapi import HTTPException, status
+# Redis clients of this worker, both with their own connection pool.
+# The asyncio client is the one used on the request path, it's created on startup (FastAPI lifespan) and closed on
+# shutdown. The sync client is kept for what runs outside the event loop (the cache invalidation listener thread,
+# sync routes running in the threadpool, the CLI).
+# Both connect to a single Redis (host/port, or a redis://, rediss:// or unix:// URL) or to the master monitored
+# by Redis Sentinel.
+
 from redis import Redis
-from .config import Settings
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+from .config import get_settings
+import logging
+import redis
+import redis.asyncio
+
+logger = logging.getLogger(__name__)
 
-settings = Settings()
+settings = get_settings()
 
 redis_client = None  # Global variable to store the Redis client instance
+async_redis_client = None  # Global variable to store the asyncio Redis client instance
+
+
+def connection_options(is_async: bool) -> dict:
+    # Pool, timeout and reconnect settings shared by every connection
+    retry_class = AsyncRetry if is_async else Retry
+    return {
+        "db": settings.redis_db,
+        "password": settings.redis_password,
+        "max_connections": settings.redis_max_connections,
+        "socket_timeout": settings.redis_socket_timeout,
+        "socket_connect_timeout": settings.redis_socket_connect_timeout,
+        "health_check_interval": settings.redis_health_check_interval,
+        "retry": retry_class(ExponentialBackoff(cap=1.0, base=0.05), settings.redis_retry_attempts),
+        "retry_on_error": [ConnectionError, TimeoutError]
+    }
+
 
+def create_redis_client(is_async: bool = False):
+    module = redis.asyncio if is_async else redis
+    options = connection_options(is_async)
 
-def get_redis_client():
+    if settings.redis_sentinels:
+        sentinels = [(host, int(port)) for host, port in (sentinel.rsplit(":", 1)
+                                                          for sentinel in settings.redis_sentinels)]
+        logger.info(f"Connecting to the Redis master {settings.redis_sentinel_master} through Sentinel {sentinels}")
+        sentinel_options = {"socket_timeout": settings.redis_socket_timeout,
+                            "socket_connect_timeout": settings.redis_socket_connect_timeout}
+        sentinel = module.Sentinel(sentinels, sentinel_kwargs=sentinel_options, **options)
+        return sentinel.master_for(settings.redis_sentinel_master)
+
+    if settings.redis_url:
+        logger.info("Connecting to Redis at %s" % settings.redis_url.split("@")[-1])  # Without the credentials
+        # Options given in the URL (e.g. ?db=1) win over the settings
+        return module.Redis.from_url(settings.redis_url, **options)
+
+    logger.info(f"Connecting to Redis at {settings.redis_host}:{settings.redis_port}")
+    return module.Redis(host=settings.redis_host, port=settings.redis_port, **options)
+
+
+def get_redis_client() -> Redis:
     global redis_client
 
     if redis_client is None:
         # Create Redis client instance if it doesn't exist yet. If this fails we'll get a 500 error, which is fine.
-        print("Initializing the redis client")
-        redis_client = Redis(
-            host=settings.redis_host,
-            port=settings.redis_port,
-            db=settings.redis_db,
-            password=settings.redis_password
-        )
+        redis_client = create_redis_client()
 
     return redis_client
+
+
+def get_async_redis_client() -> redis.asyncio.Redis:
+    # Created on startup, or on first use if the app runs without its lifespan (e.g. a script)
+    global async_redis_client
+
+    if async_redis_client is None:
+        async_redis_client = create_redis_client(is_async=True)
+
+    return async_redis_client
+
+
+async def async_redis_dependency() -> redis.asyncio.Redis:
+    # FastAPI dependency (async, so it doesn't take a threadpool thread)
+    return get_async_redis_client()
+
+
+async def open_redis_clients():
+    # Startup hook: create the asyncio client (no connection is opened until it's used)
+    get_async_redis_client()
+
+
+async def close_redis_clients():
+    # Shutdown hook: close the connection pools of this worker
+    global redis_client, async_redis_client
+
+    if async_redis_client is not None:
+        await async_redis_client.aclose()
+        async_redis_client = None
+    if redis_client is not None:
+        redis_client.close()
+        redis_client = None
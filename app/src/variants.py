@@ -0,0 +1,65 @@
+# ./app/src/variants.py
+
+# Response variants of the top characters list: a TopQuery (n, sort key, order and format) and its rendered body.
+#
+# Bodies are rendered once, when the list is built: the rows are validated against CharacterBasicInfo (what the
+# response_model would do on every request) and encoded with orjson (JSON) or the csv writer (CSV). The popular ones
+# (settings.popular_variants) are precomputed into a single derived cache entry right after each refresh of the data
+# (see routes/character.py), so a request for one of them is answered with the cached body as it is: no pydantic
+# validation and no serialisation per request. The bodies are kept encoded (bytes) in process, by the content hash
+# of the cache entry they come from.
+
+from typing import Dict, List, Optional
+from .config import get_settings
+from .schemas import CharacterBasicInfo, ResponseFormat, TopQuery
+from .codec import CODECS, json_dumps
+from .csv_export import build_csv
+from .cache import LocalCache
+
+
+settings = get_settings()
+
+VARIANTS_KEY = "top_variants"  # Derived cache entry: variant key -> body of every popular variant
+
+MEDIA_TYPES = {ResponseFormat.json: "application/json", ResponseFormat.csv: "text/csv"}
+
+dumps = CODECS["orjson"][1] if "orjson" in CODECS else json_dumps
+
+popular_queries = [TopQuery.parse_key(key) for key in settings.popular_variants]
+popular_keys = {query.key() for query in popular_queries}
+
+encoded_bodies = LocalCache(max_entries=2, ttl=settings.local_cache_ttl)  # Hash of the variants entry -> encoded bodies
+
+
+def render_json(rows: List[dict]) -> bytes:
+    # The body the response_model would give: the rows validated and projected to CharacterBasicInfo
+    return dumps([CharacterBasicInfo(**row).dict() for row in rows])
+
+
+def render(rows: List[dict], format: ResponseFormat) -> str:
+    # The body of a variant, as text so it can be cached with any codec
+    if format == ResponseFormat.csv:
+        return build_csv(rows).decode("utf-8")
+    return render_json(rows).decode("utf-8")
+
+
+def encode_bodies(bodies: Dict[str, str], data_hash: Optional[str]) -> Dict[str, bytes]:
+    # The bodies of the cached variants entry, encoded once per worker and per version of the entry
+    encoded = encoded_bodies.get(data_hash) if data_hash else None
+    if encoded is None:
+        encoded = {key: body.encode("utf-8") for key, body in bodies.items()}
+        if data_hash:
+            encoded_bodies.set(data_hash, encoded)
+    return encoded
+
+
+def batch_body(queries: List[TopQuery], bodies: Dict[str, bytes]) -> bytes:
+    # The JSON list of the results of a batch (TopQueryResult), spliced from the bodies without decoding them
+    results = []
+    for query in queries:
+        body = bodies[query.key()]
+        data = body if query.format == ResponseFormat.json else dumps(body.decode("utf-8"))
+        fields = dumps({"n": query.n, "sort": query.sort.value, "order": query.order.value,
+                        "format": query.format.value})
+        results.append(fields[:-1] + b',"data":' + data + b"}")
+    return b"[" + b",".join(results) + b"]"
@@ -0,0 +1,157 @@
+# ./app/src/warmup.py
+
+# Warm-up subsystem: crawls SWAPI once into a compact snapshot file, and loads that snapshot into the cache on
+# startup so the service starts hot, even if SWAPI is slow or down.
+#
+# Usage (CLI): python -m src.warmup --output snapshots/swapi.json.gz
+
+from typing import Optional
+from .config import get_settings
+from .utils import close_redis_clients, get_async_redis_client
+from .upstream import close_upstream_client
+from .cache import cache_get_many, cache_set_many, MISS
+from .bulk import BULK_RESOURCES, crawl_collection, ingested_at_key, store_entities
+from .codec import project
+from .redis_health import REDIS_ERRORS, mark_redis_down, redis_available
+from .schemas import Character, Film, Species
+import asyncio
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+settings = get_settings()
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_RESOURCES = ("films", "people", "species")
+
+
+async def crawl_snapshot() -> dict:
+    # Crawl films, people and species once. The data isn't validated here, it's stored the way SWAPI returns it
+    # and validated (if needed) when it's used, same as the data fetched on demand.
+    resources = await asyncio.gather(*[crawl_collection(resource) for resource in SNAPSHOT_RESOURCES])
+    return {
+        "version": SNAPSHOT_VERSION,
+        "crawled_at": time.time(),
+        "base_url": settings.swapi_base_url,
+        **dict(zip(SNAPSHOT_RESOURCES, resources))
+    }
+
+
+def write_snapshot(path: str, snapshot: dict):
+    # Write the snapshot (gzipped if the file name ends with .gz) atomically, workers may be reading it
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = json.dumps(snapshot, separators=(",", ":")).encode("utf-8")
+    if path.endswith(".gz"):
+        import gzip
+        data = gzip.compress(data)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path: str) -> dict:
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.endswith(".gz"):
+        import gzip
+        data = gzip.decompress(data)
+    snapshot = json.loads(data.decode("utf-8"))
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {snapshot.get('version')}")
+    return snapshot
+
+
+def snapshot_cache_entries(snapshot: dict) -> dict:
+    # Map the snapshot to the cache entries the fetchers read (same keys and same shape as the API responses)
+    # (projected to the fields the app uses, like the data fetched on demand)
+    entries = {"films_data": {"count": len(snapshot["films"]), "next": None, "previous": None,
+                              "results": [project(film, Film) for film in snapshot["films"]]}}
+    entries.update({f"character_data:{character['url']}": project(character, Character)
+                    for character in snapshot["people"]})
+    entries.update({f"species_data:{species['url']}": project(species, Species) for species in snapshot["species"]})
+    return entries
+
+
+async def load_snapshot(snapshot: dict, overwrite: bool = False) -> int:
+    # Load the snapshot into the cache (Redis and the local cache) and the bulk store. Unless overwrite is set,
+    # entries that are already cached are left alone, they're at least as recent as the snapshot.
+    entries = snapshot_cache_entries(snapshot)
+    if not overwrite:
+        cached = await cache_get_many(list(entries))
+        entries = {key: data for key, data in entries.items() if cached[key][1] == MISS}
+    await cache_set_many(entries)
+
+    redis_client = get_async_redis_client()
+    for resource in BULK_RESOURCES:
+        if overwrite or not await redis_client.exists(ingested_at_key(resource)):
+            await store_entities(resource, snapshot[resource])
+    logger.info(f" - Loaded {len(entries)} cache entries from the snapshot")
+    return len(entries)
+
+
+async def load_snapshot_file(path: Optional[str]) -> int:
+    # Startup hook: load the snapshot file, if there's one. A missing or broken snapshot isn't fatal,
+    # the service just starts cold.
+    if not path:
+        return 0
+    try:
+        return await load_snapshot(read_snapshot(path))
+    except FileNotFoundError:
+        logger.warning(f"Snapshot file {path} not found, starting with a cold cache")
+    except Exception as exc:
+        logger.error(f"Unable to load the snapshot file {path}: {exc}")
+    return 0
+
+
+async def refresh_periodically(interval: float, path: Optional[str]):
+    # Re-crawl SWAPI every interval seconds and refresh the cache (and the snapshot file).
+    # Only one worker crawls per interval, the others skip their turn.
+    while True:
+        await asyncio.sleep(interval)
+        if not redis_available():
+            continue  # The snapshot would be loaded into the cache, wait for Redis to be back
+        try:
+            if not await get_async_redis_client().set("lease:snapshot_refresh", 1, nx=True,
+                                                      ex=max(int(interval), 1)):
+                continue
+        except REDIS_ERRORS as exc:
+            mark_redis_down(exc)
+            continue
+        try:
+            snapshot = await crawl_snapshot()
+            await load_snapshot(snapshot, overwrite=True)
+            if path:
+                write_snapshot(path, snapshot)
+        except Exception as exc:
+            logger.error(f"Periodic snapshot refresh raised an exception: {exc}")
+
+
+async def crawl_to_file(path: str):
+    try:
+        snapshot = await crawl_snapshot()
+        write_snapshot(path, snapshot)
+        logger.info(" - Snapshot written to %s (%s)" % (path, ", ".join(
+            f"{len(snapshot[resource])} {resource}" for resource in SNAPSHOT_RESOURCES)))
+    finally:
+        await close_upstream_client()
+        await close_redis_clients()
+
+
+def main():
+    import argparse  # Only the CLI needs it, not the app workers
+    parser = argparse.ArgumentParser(description="Crawl films, people and species from SWAPI into a snapshot file.")
+    parser.add_argument("--output", default=settings.snapshot_path or "snapshots/swapi.json.gz",
+                        help="Snapshot file to write (gzipped if it ends with .gz)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.getLevelName(settings.logging_level))
+    asyncio.run(crawl_to_file(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from benchmarks.fake_upstream import FakeUpstream
+from src import bulk, cache, character_index, delivery, metrics, redis_health, upstream, utils, variants
+from src.config import get_settings
+from src.routes import character
+import fakeredis
+import fakeredis.aioredis
+import pytest
+import threading
+
+
+class ThreadLocalAsyncRedis(threading.local):
+    # One asyncio client per thread (so per event loop, like one per worker), all backed by the same server.
+    # An asyncio connection pool can't be shared by several event loops.
+
+    def __init__(self, server: fakeredis.FakeServer):
+        self.client = fakeredis.aioredis.FakeRedis(server=server)
+
+    def __getattr__(self, name: str):
+        return getattr(self.client, name)
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    # In-memory Redis shared by every module, through the sync and the asyncio clients of utils
+    # Tests can emulate a Redis outage with fake_redis.server.connected = False
+    server = fakeredis.FakeServer()
+    redis_client = fakeredis.FakeRedis(server=server)
+    redis_client.server = server
+    monkeypatch.setattr(utils, "redis_client", redis_client)
+    monkeypatch.setattr(utils, "async_redis_client", ThreadLocalAsyncRedis(server))
+    cache.local_cache.clear()
+    delivery.recent_jobs.clear()
+    character.exported_csv.clear()
+    character.rendered_top_10_sorted.clear()
+    variants.encoded_bodies.clear()
+    metrics.pending.clear()
+    metrics.gauges.clear()
+    bulk.local_entities.clear()
+    character_index.index = None
+    cache.fallback_cache.clear()
+    redis_health.down_since = None
+    redis_health.last_error = None
+    upstream.scheduler.reset()
+    yield redis_client
+    server.connected = True
+    redis_client.flushall()
+    cache.local_cache.clear()
+    delivery.recent_jobs.clear()
+    character.exported_csv.clear()
+    character.rendered_top_10_sorted.clear()
+    variants.encoded_bodies.clear()
+    metrics.pending.clear()
+    metrics.gauges.clear()
+    bulk.local_entities.clear()
+    character_index.index = None
+    cache.fallback_cache.clear()
+    redis_health.down_since = None
+    redis_health.last_error = None
+    upstream.scheduler.reset()
+
+
+@pytest.fixture
+def swapi_stub(monkeypatch):
+    # Local stand-in for swapi.dev and httpbin.org, serving the checked-in fixture
+    stub = FakeUpstream(latency=0.05).start()
+    # A fresh upstream client per test, not one with connections pooled to the stub of a previous test
+    monkeypatch.setattr(upstream, "upstream_client", None)
+    monkeypatch.setattr(upstream, "upstream_client_loop", None)
+    # Every module shares the same settings instance
+    monkeypatch.setattr(get_settings(), "swapi_base_url", stub.base_url)
+    monkeypatch.setattr(get_settings(), "httpbin_url", stub.httpbin_url)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture(autouse=True)
+def csv_output_path(monkeypatch, tmp_path):
+    # The top 10 CSV is saved in the test's own directory, not in the source tree
+    path = tmp_path / "top_10_sorted.csv"
+    monkeypatch.setattr(get_settings(), "csv_output_path", str(path))
+    return path
@@ -0,0 +1,95 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import cache, delivery, variants
+from src.routes import character
+import asyncio
+import csv
+import io
+
+
+client = TestClient(app)
+
+
+async def precompute():
+    await character.precompute_top_variants()
+    while cache.background_tasks:
+        await asyncio.gather(*list(cache.background_tasks))
+
+
+def test_batch_shares_the_upstream_data(fake_redis, swapi_stub):
+    queries = [{"n": 10}, {"n": 10, "format": "csv"}, {"n": 5, "sort": "name", "order": "asc"},
+               {"n": 14, "sort": "appearances", "format": "csv"}]
+    response = client.post("/characters/batch", json={"queries": queries})
+    assert response.status_code == 200
+    results = response.json()
+    assert [(result["n"], result["sort"], result["order"], result["format"]) for result in results] == [
+        (10, "height", "desc", "json"), (10, "height", "desc", "csv"), (5, "name", "asc", "json"),
+        (14, "appearances", "desc", "csv")]
+
+    # The films and the characters are only read once for the whole batch, and nothing is exported
+    assert swapi_stub.count("/api/films/") == 1
+    assert all(n == 1 for path, n in swapi_stub.calls.items() if path.startswith("/api/people/"))
+    assert swapi_stub.count("/post") == 0 and fake_redis.llen(delivery.QUEUE_KEY) == 0
+
+    assert results[0]["data"] == client.get("/characters/top", params={"n": 10}).json()
+    assert [row["name"] for row in csv.DictReader(io.StringIO(results[1]["data"]))] == \
+        [row["name"] for row in results[0]["data"]]
+    assert results[2]["data"] == client.get("/characters/top", params={"n": 5, "sort": "name",
+                                                                       "order": "asc"}).json()
+    assert results[3]["data"] == client.get("/characters/top", params={"n": 14, "sort": "appearances",
+                                                                       "format": "csv"}).text
+
+    assert client.post("/characters/batch", json={"queries": []}).status_code == 422
+    assert client.post("/characters/batch", json={"queries": [{"n": 10}] * 21}).status_code == 422
+
+
+def test_popular_variants_are_served_precomputed(fake_redis, swapi_stub, monkeypatch):
+    asyncio.run(precompute())
+    bodies = asyncio.run(cache.cache_get(variants.VARIANTS_KEY))[0]
+    assert set(bodies) == variants.popular_keys
+    assert b"top_variants" in fake_redis.smembers("dependents:people:1")
+
+    # Served as they were cached: not built, validated or serialised again
+    async def build(*args, **kwargs):
+        raise AssertionError("The variant was built again")
+    monkeypatch.setattr(character, "build_top_variants", build)
+    monkeypatch.setattr(variants, "dumps", build)
+
+    response = client.get("/characters/top", params={"n": 10, "format": "csv"})
+    assert response.status_code == 200 and response.headers["x-cache"] == cache.FRESH
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text == bodies["10:height:desc:csv"]
+    response = client.get("/characters/top", params={"n": 10, "sort": "name", "order": "asc"})
+    assert response.content == bodies["10:name:asc:json"].encode("utf-8")
+
+
+def test_cold_popular_variant_caches_every_popular_variant(fake_redis, swapi_stub, monkeypatch):
+    builds = []
+    build = character.build_top_variants
+    monkeypatch.setattr(character, "build_top_variants", lambda *args, **kwargs: builds.append(args) or
+                        build(*args, **kwargs))
+
+    # The popular variants are built with the request (in the same pass) and cached, not precomputed again
+    response = client.get("/characters/top", params={"n": 10, "format": "csv"})
+    assert response.status_code == 200 and response.headers["x-cache"] == cache.MISS
+    assert len(builds) == 1 and not cache.background_tasks
+    bodies, cache_state = asyncio.run(cache.cache_get(variants.VARIANTS_KEY))
+    assert cache_state == cache.FRESH and set(bodies) == variants.popular_keys
+    assert response.text == bodies["10:height:desc:csv"]
+    assert b"top_variants" in fake_redis.smembers("dependents:people:1")
+
+
+def test_top_10_sorted_is_serialised_once(fake_redis, swapi_stub, monkeypatch):
+    renders = []
+    monkeypatch.setattr(character, "render_json", lambda rows: renders.append(rows) or variants.render_json(rows))
+    first = client.get("/characters/top_10_sorted")
+    second = client.get("/characters/top_10_sorted")
+    assert first.content == second.content and len(first.json()) == 10
+    assert len(renders) == 1
+
+
+def test_openapi_documents_both_formats():
+    paths = client.get("/openapi.json").json()["paths"]
+    assert set(paths["/characters/top"]["get"]["responses"]["200"]["content"]) == {"application/json", "text/csv"}
+    batch = paths["/characters/batch"]["post"]["responses"]["200"]["content"]
+    assert batch["application/json"]["schema"]["items"] == {"$ref": "#/components/schemas/TopQueryResult"}
@@ -0,0 +1,68 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import bulk, cache
+from src.routes import character
+import asyncio
+import time
+
+
+client = TestClient(app)
+
+
+def test_upstream_requests_do_not_depend_on_the_number_of_characters(fake_redis, swapi_stub):
+    for n in (1, 14):
+        fake_redis.flushall()
+        cache.local_cache.clear()
+        bulk.local_entities.clear()
+        swapi_stub.reset_calls()
+        assert len(client.get("/characters/top", params={"n": n}).json()) == n
+        # One page of films, two pages of people (fetched in parallel) and one page of species
+        assert swapi_stub.count("/api/films/") == 1
+        assert swapi_stub.count("/api/people/") == 2
+        assert swapi_stub.count("/api/species/") == 1
+
+    assert fake_redis.hlen(bulk.store_key("people")) == 14
+    assert bulk.entity_id(f"{swapi_stub.base_url}/people/13/") == "13"
+    assert fake_redis.hexists(bulk.store_key("people"), "13")
+
+
+def test_entities_missing_from_the_store_are_fetched_one_by_one(fake_redis, swapi_stub):
+    asyncio.run(bulk.ingest("people"))
+    fake_redis.hdel(bulk.store_key("people"), "13")
+    swapi_stub.reset_calls()
+
+    chewbacca = asyncio.run(character.fetch_character_data(f"{swapi_stub.base_url}/people/13/"))
+    assert chewbacca["name"] == "Chewbacca"
+    assert dict(swapi_stub.calls) == {"/api/people/13/": 1}
+
+
+def test_stale_store_is_crawled_again_in_the_background(fake_redis, swapi_stub):
+    asyncio.run(bulk.ingest("species"))
+    fake_redis.set(bulk.ingested_at_key("species"), time.time() - bulk.settings.bulk_store_ttl - 1)
+    swapi_stub.reset_calls()
+
+    async def lookup():
+        data = await bulk.get_entities("species", [f"{swapi_stub.base_url}/species/3/"])
+        await asyncio.gather(*bulk.background_tasks)
+        return data
+
+    assert asyncio.run(lookup())[f"{swapi_stub.base_url}/species/3/"]["name"] == "Wookie"
+    assert swapi_stub.count("/api/species/") == 1
+    assert time.time() - float(fake_redis.get(bulk.ingested_at_key("species"))) < 5
+
+
+def test_local_entities_are_dropped_when_another_worker_refreshes_the_store(fake_redis, swapi_stub):
+    with TestClient(app) as client:
+        client.get("/characters/top_10_sorted")
+        assert bulk.local_entities.entries
+
+        # Our own refreshes already dropped them, only the other workers' are listened to
+        fake_redis.publish(cache.INVALIDATION_CHANNEL, cache.invalidation_message(bulk.store_key("people")))
+        time.sleep(0.2)
+        assert bulk.local_entities.entries
+
+        fake_redis.publish(cache.INVALIDATION_CHANNEL, f"another-worker:{bulk.store_key('people')}")
+        deadline = time.time() + 5
+        while bulk.local_entities.entries:
+            assert time.time() < deadline, "The entities weren't dropped"
+            time.sleep(0.01)
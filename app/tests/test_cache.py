@@ -0,0 +1,162 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import bulk, cache, utils
+from src.routes import character
+from redis.asyncio.client import Pipeline
+from types import SimpleNamespace
+import asyncio
+import json
+import time
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out waiting for the condition"
+        time.sleep(0.01)
+
+
+def test_top_10_sorted_cache_states(fake_redis, swapi_stub, monkeypatch):
+    with TestClient(app) as client:
+        response = client.get("/characters/top_10_sorted")
+        assert response.status_code == 200
+        assert response.headers["X-Cache"] == "miss"
+        assert swapi_stub.count("/api/films/") == 1
+
+        response = client.get("/characters/top_10_sorted")
+        assert response.headers["X-Cache"] == "fresh"
+        assert swapi_stub.count("/api/films/") == 1
+
+        response = client.get("/characters/top_10_sorted", params={"use_cache": False})
+        assert response.headers["X-Cache"] == "miss"
+
+
+def test_stale_entries_are_served_and_refreshed_in_the_background(fake_redis, swapi_stub, monkeypatch):
+    with TestClient(app) as client:
+        top_10_sorted = client.get("/characters/top_10_sorted").json()
+
+        # Move the clock past the soft TTL, but still within the hard TTL
+        now = time.time() + cache.settings.cache_ttl + 1
+        monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: now, sleep=time.sleep))
+        responses = [client.get("/characters/top_10_sorted") for _ in range(5)]
+        assert responses[0].headers["X-Cache"] == "stale"
+        assert all(response.headers["X-Cache"] in ("stale", "fresh") for response in responses)
+        assert all(response.json() == top_10_sorted for response in responses)
+
+        # A single background refresh of the list (and of the stale films data it reads)
+        wait_for(lambda: not cache.refreshing)
+        assert client.get("/characters/top_10_sorted").headers["X-Cache"] == "fresh"
+        assert swapi_stub.count("/api/films/") == 2
+        assert fake_redis.get("refresh:top_10_sorted_cache") is None
+
+
+def test_entries_past_the_hard_ttl_are_fetched_synchronously(fake_redis, swapi_stub, monkeypatch):
+    with TestClient(app) as client:
+        client.get("/characters/top_10_sorted")
+
+        # Redis keeps the entries until the stale-if-error TTL, but they aren't served past the hard TTL
+        assert cache.settings.cache_hard_ttl < fake_redis.ttl("top_10_sorted_cache") \
+            <= cache.settings.cache_stale_if_error_ttl
+        now = time.time() + cache.settings.cache_hard_ttl + 1
+        monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: now, sleep=time.sleep))
+        cache.local_cache.clear()
+
+        response = client.get("/characters/top_10_sorted")
+        assert response.headers["X-Cache"] == "miss"
+        assert swapi_stub.count("/api/films/") == 2
+
+
+def test_hot_requests_are_served_from_the_local_cache(fake_redis, swapi_stub):
+    with TestClient(app) as client:
+        top_10_sorted = client.get("/characters/top_10_sorted").json()
+
+        # Redis goes away, hot entries don't need it
+        fake_redis.server.connected = False
+        response = client.get("/characters/top_10_sorted")
+        assert response.status_code == 200
+        assert response.headers["X-Cache"] == "fresh"
+        assert response.json() == top_10_sorted
+
+
+def test_local_cache_is_invalidated_over_pub_sub(fake_redis, swapi_stub):
+    with TestClient(app) as client:
+        client.get("/characters/top_10_sorted")
+        assert "top_10_sorted_cache" in cache.local_cache.entries
+
+        # Another worker refreshed the entry
+        fake_redis.publish(cache.INVALIDATION_CHANNEL, "another-worker:top_10_sorted_cache")
+        wait_for(lambda: "top_10_sorted_cache" not in cache.local_cache.entries)
+
+        # Our own invalidations are ignored
+        asyncio.run(cache.cache_set("films_data", {"results": []}))
+        fake_redis.publish(cache.INVALIDATION_CHANNEL, f"{cache.worker_id}:films_data")
+        time.sleep(0.2)
+        assert "films_data" in cache.local_cache.entries
+
+
+def test_local_cache_lru_and_ttl_eviction():
+    local_cache = cache.LocalCache(max_entries=2, ttl=60)
+    local_cache.set("a", 1)
+    local_cache.set("b", 2)
+    assert local_cache.get("a") == 1
+    local_cache.set("c", 3)  # Evicts "b", the least recently used one
+    assert local_cache.get("b") is None
+    assert local_cache.get("c") == 3
+
+    local_cache.set("d", 4, ttl=0)  # Evicts "a", then expires right away
+    assert local_cache.get("d") is None
+    assert local_cache.stats == {"hits": 2, "misses": 2, "evictions": 3}
+
+
+def test_cache_stats(fake_redis, swapi_stub):
+    with TestClient(app) as client:
+        client.get("/characters/top_10_sorted")
+        client.get("/characters/top_10_sorted")
+
+        response = client.get("/cache/stats")
+        assert response.status_code == 200
+        stats = response.json()
+        assert stats["local"]["hits"] >= 1
+        assert stats["local"]["size"] >= 1
+        assert stats["redis"]["misses"] >= 1
+
+
+def test_cold_top_10_assembly_on_a_warm_cache_is_batched(fake_redis, swapi_stub, monkeypatch):
+    top_10_sorted = asyncio.run(character.build_top_10_sorted())
+    upstream_calls = sum(swapi_stub.calls.values())
+
+    # Another worker, with an empty local cache, assembles the list from the warm Redis cache
+    cache.local_cache.clear()
+    bulk.local_entities.clear()
+    commands = []
+    async_redis_client = utils.get_async_redis_client().client  # The client of this thread
+    execute_command = async_redis_client.execute_command
+
+    def recording_execute_command(*args, **kwargs):
+        commands.append(args[0])
+        return execute_command(*args, **kwargs)
+
+    pipeline_execute = Pipeline.execute
+
+    def recording_pipeline_execute(pipe, *args, **kwargs):
+        commands.append(" ".join(command[0][0] for command in pipe.command_stack))
+        return pipeline_execute(pipe, *args, **kwargs)
+
+    monkeypatch.setattr(async_redis_client, "execute_command", recording_execute_command)
+    monkeypatch.setattr(Pipeline, "execute", recording_pipeline_execute)
+
+    assert asyncio.run(character.build_top_10_sorted()) == top_10_sorted
+    # Films, the appearance index, then all the characters and then all the species (from the bulk store)
+    assert commands == ["MGET", "ZREVRANGE", "GET HMGET", "GET HMGET"]
+    assert sum(swapi_stub.calls.values()) == upstream_calls
+
+
+def test_values_stored_by_the_previous_version_are_fetched_again(fake_redis, swapi_stub):
+    # The list as the app stored it before the cache entries were wrapped ({"fetched_at", "hash", "data"})
+    fake_redis.set("top_10_sorted_cache", json.dumps([{"name": "Luke Skywalker"}]))
+    with TestClient(app) as client:
+        response = client.get("/characters/top_10_sorted")
+        assert response.status_code == 200
+        assert response.headers["X-Cache"] == "miss"
+        assert len(response.json()) == 10
+        assert swapi_stub.count("/api/films/") == 1
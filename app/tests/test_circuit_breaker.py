@@ -0,0 +1,84 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import cache, circuit_breaker
+from types import SimpleNamespace
+import asyncio
+import time
+
+
+client = TestClient(app)
+
+
+def test_breaker_opens_and_fails_fast(fake_redis, swapi_stub, monkeypatch):
+    monkeypatch.setattr(circuit_breaker.settings, "breaker_failure_threshold", 2)
+    swapi_stub.down = True
+
+    assert client.get("/characters/top", params={"n": 1}).status_code == 503
+    assert client.get("/characters/top", params={"n": 1}).status_code == 503  # Negative cached, no new call
+    assert swapi_stub.count("/api/films/") == 1
+
+    fake_redis.delete(circuit_breaker.negative_key(f"{swapi_stub.base_url}/films/"))
+    assert client.get("/characters/top", params={"n": 1}).status_code == 503
+    assert swapi_stub.count("/api/films/") == 2
+    assert client.get("/healthcheck").json()["upstream"] == {"films": "open", "people": "closed",
+                                                             "species": "closed"}
+
+    # Open: requests fail fast, even for URLs that aren't negative cached
+    fake_redis.delete(circuit_breaker.negative_key(f"{swapi_stub.base_url}/films/"))
+    response = client.get("/characters/top", params={"n": 1})
+    assert response.status_code == 503
+    assert "circuit breaker open" in response.json()["detail"]
+    assert swapi_stub.count("/api/films/") == 2
+
+    # Half-open: a single probe goes through, and it closes the breaker once SWAPI is back
+    swapi_stub.down = False
+    fake_redis.delete(circuit_breaker.open_key("films"), circuit_breaker.negative_key(f"{swapi_stub.base_url}/films/"))
+    assert asyncio.run(circuit_breaker.breaker_state("films")) == circuit_breaker.HALF_OPEN
+    assert client.get("/characters/top", params={"n": 1}).status_code == 200
+    assert asyncio.run(circuit_breaker.breaker_states())["films"] == circuit_breaker.CLOSED
+
+
+def test_failed_probe_opens_the_breaker_again(fake_redis, swapi_stub):
+    swapi_stub.down = True
+    fake_redis.set(circuit_breaker.tripped_key("films"), 1)
+
+    assert client.get("/characters/top", params={"n": 1}).status_code == 503
+    assert asyncio.run(circuit_breaker.breaker_state("films")) == circuit_breaker.OPEN
+    assert swapi_stub.count("/api/films/") == 1
+
+
+def test_not_found_probe_closes_the_breaker(fake_redis, swapi_stub):
+    # SWAPI answered, so the probe succeeded: the breaker closes and the probe slot is freed
+    fake_redis.set(circuit_breaker.tripped_key("people"), 1)
+    url = f"{swapi_stub.base_url}/people/999/"
+
+    response = asyncio.run(circuit_breaker.upstream_get("people", url))
+    assert response.status_code == 404
+    assert asyncio.run(circuit_breaker.breaker_state("people")) == circuit_breaker.CLOSED
+    assert not fake_redis.exists(circuit_breaker.probe_key("people"))
+    assert fake_redis.exists(circuit_breaker.negative_key(url))
+
+
+def test_last_good_data_is_served_while_swapi_is_down(fake_redis, swapi_stub, monkeypatch):
+    top_10_sorted = client.get("/characters/top_10_sorted").json()
+
+    # Past the hard TTL the entries aren't served anymore, unless SWAPI fails
+    now = time.time() + cache.settings.cache_hard_ttl + 1
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: now, sleep=time.sleep))
+    cache.local_cache.clear()
+    swapi_stub.down = True
+
+    # The list is rebuilt from the last good character and species data
+    assert client.get("/characters/top", params={"n": 10}).json() == top_10_sorted
+    # Except when the cache is bypassed: everything comes from SWAPI
+    assert client.get("/characters/top_10_sorted", params={"use_cache": False}).status_code == 503
+
+    # Nothing to rebuild it from: the last good list itself is served
+    fake_redis.delete("films_data")
+    response = client.get("/characters/top_10_sorted")
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "stale-if-error"
+    assert response.json() == top_10_sorted
+    # The popular variants were cached when they were rebuilt, the others can't be built anymore
+    assert client.get("/characters/top", params={"n": 10}).json() == top_10_sorted
+    assert client.get("/characters/top", params={"n": 11}).status_code == 503
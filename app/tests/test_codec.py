@@ -0,0 +1,49 @@
+from benchmarks.fake_upstream import FIXTURE_PATH
+from src import codec
+from src.schemas import Character
+import json
+import pytest
+
+
+with open(FIXTURE_PATH) as f:
+    SNAPSHOT = json.load(f)
+
+
+@pytest.mark.parametrize("name", sorted(codec.CODECS))
+def test_every_installed_codec_round_trips(monkeypatch, name):
+    monkeypatch.setattr(codec, "codec_name", name)
+    entry = {"fetched_at": 1700000000.5, "hash": "abc", "data": SNAPSHOT["people"][0]}
+    data = codec.encode(entry)
+    assert data[:2] == bytes((codec.FORMAT_VERSION, codec.CODECS[name][0]))
+    assert codec.decode(data) == entry
+
+
+def test_large_payloads_are_compressed(monkeypatch):
+    monkeypatch.setattr(codec.settings, "cache_compression_threshold", 1024)
+    small = codec.encode(SNAPSHOT["species"][0])
+    large = codec.encode(SNAPSHOT["people"])
+    assert not small[2] & codec.COMPRESSED
+    assert large[2] & codec.COMPRESSED
+    assert len(large) < len(json.dumps(SNAPSHOT["people"])) / 3
+    assert codec.decode(large) == SNAPSHOT["people"]
+
+    monkeypatch.setattr(codec.settings, "cache_compression_threshold", 0)
+    assert not codec.encode(SNAPSHOT["people"])[2] & codec.COMPRESSED
+
+
+def test_legacy_and_unknown_payloads():
+    # Entries written before the header existed are plain JSON
+    assert codec.decode(json.dumps({"data": [1, 2]}).encode("utf-8")) == {"data": [1, 2]}
+    # Entries written in a newer format (or with a codec that isn't installed) can't be read: cache misses
+    assert codec.decode(bytes((codec.FORMAT_VERSION + 1, 0, 0)) + b"{}") is None
+    assert codec.decode(bytes((codec.FORMAT_VERSION, 200, 0)) + b"{}") is None
+    # Empty or corrupt payloads too
+    assert codec.decode(b"") is None
+    assert codec.decode(b"{not json") is None
+    assert codec.decode(bytes((codec.FORMAT_VERSION, 0, codec.COMPRESSED)) + b"not zlib") is None
+
+
+def test_projection_keeps_the_schema_fields():
+    character = codec.project(SNAPSHOT["people"][0], Character)
+    assert set(character) == {"url", "name", "height", "mass", "films", "species"}
+    assert len(codec.encode(character)) < len(json.dumps(SNAPSHOT["people"][0]))
@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src.csv_export import build_csv, iter_csv
+from src import delivery
+from src.routes import character
+import csv
+import hashlib
+import io
+
+
+client = TestClient(app)
+
+
+def test_build_csv():
+    rows = [{"name": "Luke, Jr.", "species": "", "height": 172, "appearances": 4, "mass": "77"},
+            {"name": "R2-D2", "species": "Droid", "height": None, "appearances": 6}]
+    assert build_csv(rows) == b'name,species,height,appearances\n"Luke, Jr.",,172,4\nR2-D2,Droid,,6\n'
+    assert list(iter_csv(rows, ["name"])) == ["name\n", '"Luke, Jr."\n', "R2-D2\n"]
+
+
+def test_top_10_sorted_csv_download(fake_redis, swapi_stub):
+    response = client.get("/characters/top_10_sorted.csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="top_10_sorted.csv"'
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 10
+    assert rows[0] == {"name": "Chewbacca", "species": "Wookie", "height": "228", "appearances": "4"}
+    assert rows[-1]["name"] == "Yoda"
+
+    # Same data as the JSON endpoint, which still saves the CSV and queues its upload
+    assert client.get("/characters/top_10_sorted").json()[0]["name"] == "Chewbacca"
+    with open(character.settings.csv_output_path, "rb") as f:
+        assert f.read() == response.content
+    assert fake_redis.get(delivery.content_key(hashlib.sha256(response.content).hexdigest())) == response.content
@@ -0,0 +1,76 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import cache, redis_health
+from src.cache import FallbackCache
+import asyncio
+
+
+client = TestClient(app)
+
+
+def test_top_10_sorted_is_served_while_redis_is_down(fake_redis, swapi_stub):
+    expected = client.get("/characters/top_10_sorted").json()
+    swapi_stub.reset_calls()
+
+    # Redis goes down and this worker's L1 is cold: the fallback cache answers, without calling SWAPI
+    fake_redis.server.connected = False
+    cache.local_cache.clear()
+    response = client.get("/characters/top_10_sorted")
+    assert response.status_code == 200
+    assert response.json() == expected
+    assert sum(swapi_stub.calls.values()) == 0
+    assert not redis_health.redis_available()
+
+    health = client.get("/healthcheck").json()
+    assert health["status"] == "degraded"
+    assert health["redis"] == "disconnected"
+    assert health["redis_down_since"] is not None
+
+    # Once Redis answers again, the reconnect marks it as up
+    fake_redis.server.connected = True
+    assert asyncio.run(redis_health.probe_redis())
+    health = client.get("/healthcheck").json()
+    assert (health["status"], health["redis"], health["redis_down_since"]) == ("ok", "connected", None)
+
+
+def test_cold_start_while_redis_is_down(fake_redis, swapi_stub):
+    # Nothing cached anywhere: the request is answered from SWAPI
+    fake_redis.server.connected = False
+    response = client.get("/characters/top_10_sorted")
+    assert response.status_code == 200
+    assert len(response.json()) == 10
+    assert client.get("/healthcheck").json()["status"] == "degraded"
+
+
+def test_fallback_cache_file(tmp_path):
+    path = str(tmp_path / "fallback.sqlite")
+    fallback = FallbackCache(10, 60, path)
+    fallback.set("films", {"fetched_at": 1.0, "hash": "0", "data": {"count": 6}})
+    fallback.set("expired", {"data": None}, ttl=-1)
+    fallback.set("deleted", {"data": None})
+    fallback.delete("deleted")
+
+    # A worker restarted during the outage reads the entries back
+    restarted = FallbackCache(10, 60, path)
+    assert restarted.get("films") == {"fetched_at": 1.0, "hash": "0", "data": {"count": 6}}
+    assert restarted.get("expired") is None
+    assert restarted.get("deleted") is None
+
+
+def test_redis_hits_only_write_new_versions_to_the_fallback_file(fake_redis, swapi_stub, tmp_path, monkeypatch):
+    client.get("/characters/top_10_sorted")
+    monkeypatch.setattr(cache.fallback_cache, "db", None)
+    cache.fallback_cache.open(str(tmp_path / "fallback.sqlite"))
+    cache.fallback_cache.clear()
+    writes = []
+    execute = cache.fallback_cache.execute
+    monkeypatch.setattr(cache.fallback_cache, "execute", lambda *args: writes.append(args[0]) or execute(*args))
+
+    # The first L2 hit keeps the entry; the next ones (same version) don't write it again
+    cache.local_cache.clear()
+    asyncio.run(cache.cache_get("films_data"))
+    assert len(writes) == 1
+    cache.local_cache.clear()
+    asyncio.run(cache.cache_get("films_data"))
+    assert len(writes) == 1
+    cache.fallback_cache.db.close()
@@ -0,0 +1,118 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import delivery, redis_health
+import asyncio
+import pytest
+import time
+
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(delivery.settings, "delivery_backoff_base", 0)
+
+
+def run_worker(jobs: int):
+    async def process():
+        for _ in range(jobs):
+            assert await delivery.process_next_job()
+    asyncio.run(process())
+
+
+def test_top_10_sorted_queues_the_csv_delivery(fake_redis, swapi_stub):
+    response = client.get("/characters/top_10_sorted")
+    assert response.status_code == 200
+    job_id = response.headers["X-Delivery-Job"]
+    assert swapi_stub.count("/post") == 0
+    assert client.get("/deliveries").json()["queued"] == 1
+    assert client.get(f"/deliveries/{job_id}").json()["status"] == "queued"
+
+    run_worker(1)
+    job = client.get(f"/deliveries/{job_id}").json()
+    assert job["status"] == "delivered"
+    assert job["attempts"] == 1
+    assert swapi_stub.count("/post") == 1
+
+    # The CSV didn't change, it isn't sent again
+    response = client.get("/characters/top_10_sorted", params={"use_cache": False})
+    assert response.headers["X-Delivery-Job"] == job_id
+    assert client.get("/deliveries").json() == {"queued": 0, "processing": 0, "retrying": 0,
+                                                 "last_job": client.get(f"/deliveries/{job_id}").json()}
+
+
+def test_failed_deliveries_are_retried(fake_redis, swapi_stub, no_backoff):
+    swapi_stub.failing_posts = 2
+    job_id = client.get("/characters/top_10_sorted").headers["X-Delivery-Job"]
+
+    run_worker(1)
+    job = client.get(f"/deliveries/{job_id}").json()
+    assert job["status"] == "retrying"
+    assert "503" in job["last_error"]
+    assert client.get("/deliveries").json()["retrying"] == 1
+
+    run_worker(2)
+    job = client.get(f"/deliveries/{job_id}").json()
+    assert job["status"] == "delivered"
+    assert job["attempts"] == 3
+    assert swapi_stub.count("/post") == 3
+
+
+def test_deliveries_give_up_and_can_be_queued_again(fake_redis, swapi_stub, no_backoff, monkeypatch):
+    monkeypatch.setattr(delivery.settings, "delivery_max_attempts", 2)
+    swapi_stub.failing_posts = 2
+    job_id, queued = asyncio.run(delivery.enqueue_delivery(b"name\nYoda\n"))
+    assert queued
+
+    run_worker(2)
+    assert asyncio.run(delivery.get_delivery_job(job_id))["status"] == "failed"
+    assert not asyncio.run(delivery.process_next_job())
+
+    # A failed CSV is queued again the next time it's generated
+    new_job_id, queued = asyncio.run(delivery.enqueue_delivery(b"name\nYoda\n"))
+    assert queued and new_job_id != job_id
+    run_worker(1)
+    assert asyncio.run(delivery.get_delivery_job(new_job_id))["status"] == "delivered"
+
+
+def test_abandoned_deliveries_are_requeued(fake_redis, swapi_stub, monkeypatch):
+    monkeypatch.setattr(delivery.settings, "delivery_visibility_timeout", 0)
+    job_id, _ = asyncio.run(delivery.enqueue_delivery(b"name\nYoda\n"))
+
+    # A worker took the job and died
+    fake_redis.lmove(delivery.QUEUE_KEY, delivery.PROCESSING_KEY, "RIGHT", "LEFT")
+    run_worker(1)
+    assert asyncio.run(delivery.get_delivery_job(job_id))["status"] == "delivered"
+
+
+def test_unknown_delivery_job(fake_redis):
+    response = client.get("/deliveries/does-not-exist")
+    assert response.status_code == 404
+
+
+def test_delivery_endpoints_while_redis_is_down(fake_redis):
+    fake_redis.server.connected = False
+    assert client.get("/deliveries").status_code == 503
+    assert client.get("/deliveries/some-job").status_code == 503
+    assert not redis_health.redis_available()
+
+
+def test_worker_waits_while_redis_is_down(fake_redis, monkeypatch):
+    monkeypatch.setattr(delivery.settings, "delivery_poll_interval", 0.01)
+    monkeypatch.setattr(redis_health, "down_since", time.time())
+    polls = []
+
+    async def process_next_job():
+        polls.append(time.time())
+    monkeypatch.setattr(delivery, "process_next_job", process_next_job)
+
+    async def run():
+        stopping = asyncio.Event()
+        worker = asyncio.ensure_future(delivery.run_delivery_worker(stopping))
+        await asyncio.sleep(0.05)
+        stopping.set()
+        await asyncio.wait_for(worker, 1)
+
+    asyncio.run(run())
+    assert polls == []
@@ -0,0 +1,114 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import bulk, cache, dependencies
+from src.routes import admin, character
+import asyncio
+
+
+client = TestClient(app)
+
+
+async def settle():
+    # Wait for the background recomputes
+    while cache.background_tasks:
+        await asyncio.gather(*list(cache.background_tasks))
+
+
+def read_top_10_sorted():
+    async def read():
+        return await cache.cache_get_last_good("top_10_sorted_cache")
+    return asyncio.run(read())[0]
+
+
+def test_dependencies_are_recorded(fake_redis, swapi_stub, monkeypatch):
+    monkeypatch.setattr(character, "popular_queries", [])  # No precomputed variants depending on the data too
+    top_10_sorted = client.get("/characters/top_10_sorted").json()
+    versions = asyncio.run(dependencies.recorded_versions("top_10_sorted_cache"))
+    assert {f"films:{id}" for id in range(1, 7)} <= set(versions)
+    assert {dependencies.entity_key(row["url"]) for row in top_10_sorted} <= set(versions)
+    assert "species:2" in versions  # Droids
+    assert fake_redis.smembers("dependents:people:1") == {b"top_10_sorted_cache"}
+
+
+def test_changed_character_only_recomputes_its_row(fake_redis, swapi_stub, monkeypatch):
+    client.get("/characters/top_10_sorted")
+    top_10_sorted = read_top_10_sorted()
+    people = asyncio.run(bulk.get_all("people"))[1]
+    swapi_stub.reset_calls()
+
+    async def rebuild():
+        raise AssertionError("The list was rebuilt instead of recomputed")
+    monkeypatch.setattr(character, "build_tracked_top_10_sorted", rebuild)
+
+    async def write(people):
+        await bulk.store_entities("people", people)
+        await settle()
+
+    # Re-crawled without changes: nothing to recompute
+    asyncio.run(write(people))
+    assert read_top_10_sorted() == top_10_sorted
+
+    # Luke grew: only his row is assembled again, and the list re-sorted
+    luke = f"{swapi_stub.base_url}/people/1/"
+    asyncio.run(write([dict(person, height="300") if person["url"] == luke else person for person in people]))
+    recomputed = read_top_10_sorted()
+    assert recomputed[0]["url"] == luke and recomputed[0]["height"] == 300
+    assert sorted(recomputed[1:], key=lambda row: row["url"]) == \
+        sorted([row for row in top_10_sorted if row["url"] != luke], key=lambda row: row["url"])
+    assert sum(swapi_stub.calls.values()) == 0
+    versions = asyncio.run(dependencies.recorded_versions("top_10_sorted_cache"))
+    assert versions["people:1"] != cache.content_hash(next(person for person in people if person["url"] == luke))
+
+
+def test_changed_film_rebuilds_the_list(fake_redis, swapi_stub):
+    top_10_sorted = client.get("/characters/top_10_sorted").json()
+    films_data = asyncio.run(cache.cache_get("films_data"))[0]
+    luke = f"{swapi_stub.base_url}/people/1/"
+
+    # Luke isn't in A New Hope anymore: the ranking may have changed, the list is built again
+    films = [dict(film, characters=[url for url in film["characters"] if url != luke]) for film in films_data["results"]]
+
+    async def write():
+        await cache.cache_set("films_data", dict(films_data, results=films))
+        await settle()
+
+    asyncio.run(write())
+    versions = asyncio.run(dependencies.recorded_versions("top_10_sorted_cache"))
+    assert versions["films:1"] == cache.content_hash(films[0])
+    assert versions["films:4"] == cache.content_hash(films_data["results"][3])  # No Luke in The Phantom Menace
+    assert len(read_top_10_sorted()) == len(top_10_sorted)
+
+
+def test_admin_invalidation(fake_redis, swapi_stub, monkeypatch):
+    monkeypatch.setattr(character, "popular_queries", [])
+    client.get("/characters/top_10_sorted")
+    url = "/admin/invalidate/people/1"
+
+    monkeypatch.setattr(admin.settings, "admin_token", None)
+    assert client.post(url, headers={"X-Admin-Token": "secret"}).status_code == 403
+
+    monkeypatch.setattr(admin.settings, "admin_token", "secret")
+    assert client.post(url).status_code == 401
+    assert client.post(url, headers={"X-Admin-Token": "wrong"}).status_code == 401
+
+    response = client.post(url, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json() == {"entity": "people:1",
+                               "invalidated": [f"character_data:{swapi_stub.base_url}/people/1/",
+                                               "top_10_sorted_cache"]}
+    assert fake_redis.hget(bulk.store_key("people"), "1") is None
+    assert read_top_10_sorted() is None
+
+    # Rebuilt on the next read, Luke fetched again on his own
+    swapi_stub.reset_calls()
+    assert client.get("/characters/top_10_sorted").status_code == 200
+    assert swapi_stub.count("/api/people/1/") == 1
+
+
+def test_derived_ttls_follow_the_settings(monkeypatch):
+    monkeypatch.setattr(dependencies.settings, "derived_cache_ttl", None)
+    monkeypatch.setattr(dependencies.settings, "cache_ttl", 0)
+    assert cache.ttls("top_10_sorted_cache") == (0, dependencies.settings.derived_cache_hard_ttl
+                                                 or dependencies.settings.cache_hard_ttl)
+    monkeypatch.setattr(dependencies.settings, "derived_cache_ttl", 600)
+    assert cache.ttls("top_10_sorted_cache")[0] == 600
@@ -0,0 +1,62 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import metrics
+from src.routes import character
+
+
+client = TestClient(app)
+
+
+def parse_metrics(text):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line and not line.startswith("#")}
+
+
+def test_metrics_endpoint(fake_redis, swapi_stub, monkeypatch):
+    monkeypatch.setattr(character, "popular_queries", [])  # Not the stages of the precomputed variants
+    assert client.get("/characters/top_10_sorted").status_code == 200
+    client.get("/characters/top_10_sorted")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    samples = parse_metrics(response.text)
+
+    route = 'method="GET",route="/characters/top_10_sorted",status="200"'
+    assert samples[f"http_request_duration_seconds_count{{{route}}}"] == 2
+    assert samples[f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}'] == 2
+    for stage in ("films_fetch", "character_fan_out", "species_fan_out", "csv_build", "upload"):
+        assert samples[f'stage_duration_seconds_count{{stage="{stage}"}}'] == 1
+    # People and species are crawled a page at a time into the bulk store
+    assert samples['upstream_request_duration_seconds_count{resource="people",status="200"}'] == 2
+    assert samples['upstream_request_duration_seconds_count{resource="species",status="200"}'] == 1
+    assert samples['cache_lookups_total{tier="local",result="hit"}'] >= 1
+    assert samples['redis_command_duration_seconds_count{command="mget"}'] >= 1
+
+
+def test_metrics_add_up_across_workers(fake_redis):
+    # Each worker flushes its own observations into the shared totals
+    metrics.observe("stage_duration_seconds", 0.2, stage="films_fetch")
+    metrics.flush()
+    metrics.observe("stage_duration_seconds", 3.0, stage="films_fetch")
+    metrics.increment("cache_lookups_total", 2, tier="redis", result="hit")
+
+    text = metrics.render()
+    samples = parse_metrics(text)
+    assert samples['stage_duration_seconds_count{stage="films_fetch"}'] == 2
+    assert samples['stage_duration_seconds_sum{stage="films_fetch"}'] == 3.2
+    assert samples['stage_duration_seconds_bucket{stage="films_fetch",le="0.25"}'] == 1
+    assert samples['stage_duration_seconds_bucket{stage="films_fetch",le="5.0"}'] == 2
+    assert samples['cache_lookups_total{tier="redis",result="hit"}'] == 2
+
+    # Buckets are listed in ascending order, +Inf last
+    buckets = [line for line in text.splitlines() if line.startswith("stage_duration_seconds_bucket")]
+    assert buckets[0].startswith('stage_duration_seconds_bucket{stage="films_fetch",le="0.005"}')
+    assert 'le="+Inf"' in buckets[-1]
+
+    # Nothing is lost while Redis is down, it's flushed once it's back
+    metrics.increment("cache_lookups_total", tier="redis", result="miss")
+    fake_redis.server.connected = False
+    metrics.flush()
+    fake_redis.server.connected = True
+    assert parse_metrics(metrics.render())['cache_lookups_total{tier="redis",result="miss"}'] == 1
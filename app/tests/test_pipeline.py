@@ -0,0 +1,56 @@
+from src import upstream
+from src.batch_loader import BatchLoader
+from src.routes import character
+import asyncio
+import time
+
+
+SLOW = 0.4  # Seconds
+
+
+def test_batch_loader_batches_and_resolves_each_key_on_arrival():
+    batches = []
+
+    async def load_many(keys, on_result=None):
+        batches.append(keys)
+        results = {}
+        for key in keys:
+            await asyncio.sleep(0.05 if key == "slow" else 0)
+            results[key] = key.upper()
+            on_result(key, results[key])
+        return results
+
+    async def run():
+        loader = BatchLoader(load_many)
+        fast, slow, again = loader.load("fast"), loader.load("slow"), loader.load("fast")
+        assert again is fast
+        assert await fast == "FAST"
+        assert not slow.done()  # The fast key didn't wait for the slow one
+        assert await slow == "SLOW"
+        # Keys asked for later go in a new batch, keys already loaded aren't loaded again
+        assert await loader.load("late") == "LATE"
+        assert await loader.load("slow") == "SLOW"
+
+    asyncio.run(run())
+    assert batches == [["fast", "slow"], ["late"]]
+
+
+def test_cold_fan_out_latency_is_the_critical_path(fake_redis, swapi_stub, monkeypatch):
+    # Every character and species is fetched on its own (no bulk store), with one slow character (without species)
+    # and one slow species (of a fast character). With a barrier between the character and the species phases, it
+    # takes at least both slow calls one after the other; pipelined, only the slowest character -> species chain.
+    monkeypatch.setattr(character.settings, "bulk_store_enabled", False)
+    monkeypatch.setattr(upstream.scheduler, "host_initial", 20)
+    monkeypatch.setattr(upstream.scheduler, "host_max", 20)
+    swapi_stub.latency = 0.01
+    swapi_stub.path_latency = {"/api/people/1/": SLOW, "/api/species/6/": SLOW}
+
+    start = time.perf_counter()
+    top_10_sorted = asyncio.run(character.build_top_10_sorted())
+    elapsed = time.perf_counter() - start
+
+    assert {"Luke Skywalker", "Yoda"} <= {row["name"] for row in top_10_sorted}
+    assert next(row for row in top_10_sorted if row["name"] == "Yoda")["species"] == "Yoda's species"
+    assert SLOW <= elapsed < 2 * SLOW  # Two phases would take more than 2 * SLOW (plus the films)
+    # Each species only once
+    assert all(swapi_stub.count(f"/api/species/{species_id}/") == 1 for species_id in (2, 3, 6))
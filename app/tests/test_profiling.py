@@ -0,0 +1,56 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import profiling
+
+
+client = TestClient(app)  # Its requests come from the "testclient" host
+
+
+def test_requests_are_not_profiled_by_default(fake_redis, swapi_stub, monkeypatch):
+    response = client.get("/characters/top_10_sorted", headers={"X-Profile": "1"})
+    assert "server-timing" not in response.headers
+
+    # Asked for, but not from an allowed client
+    monkeypatch.setattr(profiling.settings, "profiling_allowlist", ["10.0.0.0/8"])
+    response = client.get("/characters/top_10_sorted", params={"profile": 1})
+    assert "server-timing" not in response.headers
+
+    # Allowed, but not asked for, or not sampled
+    monkeypatch.setattr(profiling.settings, "profiling_allowlist", ["testclient"])
+    assert "server-timing" not in client.get("/characters/top_10_sorted").headers
+    monkeypatch.setattr(profiling.settings, "profiling_sample_rate", 0.0)
+    assert "server-timing" not in client.get("/characters/top_10_sorted", headers={"X-Profile": "1"}).headers
+
+
+def test_profiled_request(fake_redis, swapi_stub, monkeypatch):
+    monkeypatch.setattr(profiling.settings, "profiling_allowlist", ["testclient"])
+    monkeypatch.setattr(profiling.settings, "profiling_interval", 0.001)
+
+    response = client.get("/characters/top_10_sorted", headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    timings = dict(entry.split(";", 1) for entry in response.headers["server-timing"].split(", "))
+    assert {"films_fetch", "fetch_films_data", "fetch_many_character_data", "character_fan_out", "species_fan_out",
+            "upstream_films", "redis", "csv_build", "total"} <= set(timings)
+
+    profile = client.get(f"/profiles/{response.headers['x-profile-id']}").json()
+    assert profile["path"] == "/characters/top_10_sorted"
+    assert profile["timings"]["fetch_films_data"]["count"] == 1
+    assert profile["duration"] >= profile["timings"]["films_fetch"]["seconds"]
+    assert profile["samples"] > 0 and sum(profile["stacks"].values()) == profile["samples"]
+
+    collapsed = client.get(f"/profiles/{profile['id']}", params={"format": "collapsed"}).text
+    assert len(collapsed.splitlines()) == len(profile["stacks"])
+    assert client.get("/profiles/unknown").status_code == 404
+
+    # Only for the allowed clients
+    monkeypatch.setattr(profiling.settings, "profiling_allowlist", ["127.0.0.1"])
+    assert client.get(f"/profiles/{profile['id']}").status_code == 403
+
+
+def test_client_allowlist(monkeypatch):
+    monkeypatch.setattr(profiling.settings, "profiling_allowlist", ["10.0.0.0/8", "192.168.1.7", "testclient"])
+    assert profiling.client_allowed("10.1.2.3")
+    assert profiling.client_allowed("192.168.1.7")
+    assert profiling.client_allowed("testclient")
+    assert not profiling.client_allowed("192.168.1.8")
+    assert not profiling.client_allowed(None)
@@ -0,0 +1,67 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import character_index
+import asyncio
+import time
+
+
+client = TestClient(app)
+
+
+def query(**params) -> dict:
+    response = client.get("/characters/query", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_query_filters(fake_redis, swapi_stub):
+    droids = query(species="droid", sort="height", order="asc")
+    assert droids["total"] == 3
+    assert [character["name"] for character in droids["results"]] == ["R2-D2", "R5-D4", "C-3PO"]
+    assert query(species=2)["total"] == 3
+    assert query(species="Sith")["total"] == 0
+
+    # Filters are combined
+    film_4_droids = query(species=2, film=4)
+    assert [character["name"] for character in film_4_droids["results"]] == ["C-3PO", "R2-D2"]
+
+    tall = query(min_height=180, max_height=202, sort="height", order="desc")
+    assert [(character["name"], character["height"]) for character in tall["results"]] == [
+        ("Darth Vader", 202), ("Obi-Wan Kenobi", 182), ("Wilhuff Tarkin", 180), ("Han Solo", 180)]
+
+
+def test_query_sort_and_pagination(fake_redis, swapi_stub):
+    by_mass = query(sort="mass", order="desc", limit=100)
+    assert by_mass["total"] == 14
+    assert by_mass["results"][0] == {"name": "Darth Vader", "height": 202, "mass": 136.0, "appearances": 4,
+                                     "species": "", "url": f"{swapi_stub.base_url}/people/4/"}
+    # Unknown values go last whatever the order
+    assert by_mass["results"][-1]["name"] == "Wilhuff Tarkin"
+    assert query(sort="mass", order="asc", limit=100)["results"][-1]["name"] == "Wilhuff Tarkin"
+
+    pages = [query(sort="appearances", offset=offset, limit=5) for offset in (0, 5, 10)]
+    assert [len(page["results"]) for page in pages] == [5, 5, 4]
+    assert [character for page in pages for character in page["results"]] == \
+        query(sort="appearances", limit=100)["results"]
+
+    assert client.get("/characters/query", params={"limit": 101}).status_code == 422
+    assert client.get("/characters/query", params={"sort": "name"}).status_code == 422
+
+
+def test_query_is_answered_in_memory(fake_redis, swapi_stub):
+    query()
+    swapi_stub.reset_calls()
+
+    for params in ({}, {"species": "human"}, {"film": 1, "sort": "mass"}, {"min_height": 100, "order": "asc"}):
+        query(**params)
+    assert sum(swapi_stub.calls.values()) == 0
+
+    # Whole-cast queries take well under a millisecond
+    index = asyncio.run(character_index.get_character_index(
+        {"results": [], "count": 0, "next": None, "previous": None}))
+    timings = []
+    for _ in range(50):
+        start = time.perf_counter()
+        index.query(sort="mass", descending=True, offset=0, limit=100)
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < 0.001
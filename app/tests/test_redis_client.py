@@ -0,0 +1,62 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import utils
+from redis.asyncio.sentinel import SentinelConnectionPool
+import asyncio
+import fakeredis
+import fakeredis.aioredis
+import time
+
+
+client = TestClient(app)
+
+
+def test_client_options(monkeypatch):
+    monkeypatch.setattr(utils.settings, "redis_max_connections", 7)
+    monkeypatch.setattr(utils.settings, "redis_socket_timeout", 0.5)
+
+    tcp = utils.create_redis_client(is_async=True)
+    assert tcp.connection_pool.max_connections == 7
+    assert tcp.connection_pool.connection_kwargs["socket_timeout"] == 0.5
+    assert tcp.connection_pool.connection_kwargs["health_check_interval"] == utils.settings.redis_health_check_interval
+
+    monkeypatch.setattr(utils.settings, "redis_url", "unix:///run/redis/redis.sock?db=3")
+    unix_socket = utils.create_redis_client(is_async=True)
+    assert unix_socket.connection_pool.connection_kwargs["path"] == "/run/redis/redis.sock"
+    assert unix_socket.connection_pool.connection_kwargs["db"] == 3
+    assert utils.create_redis_client().connection_pool.connection_kwargs["path"] == "/run/redis/redis.sock"
+
+    monkeypatch.setattr(utils.settings, "redis_sentinels", ["sentinel-1:26379", "sentinel-2:26379"])
+    sentinel = utils.create_redis_client(is_async=True)
+    assert isinstance(sentinel.connection_pool, SentinelConnectionPool)
+    assert sentinel.connection_pool.max_connections == 7
+
+
+def test_healthcheck_does_not_hang_on_a_dead_redis(monkeypatch):
+    # Nothing listens there: the connection is refused (or times out) well within a request
+    monkeypatch.setattr(utils.settings, "redis_port", 1)
+    monkeypatch.setattr(utils.settings, "redis_retry_attempts", 0)
+    monkeypatch.setattr(utils, "async_redis_client", utils.create_redis_client(is_async=True))
+
+    start = time.time()
+    response = client.get("/healthcheck")
+    assert response.status_code == 200
+    assert response.json()["redis"] == "disconnected"
+    assert response.json()["upstream"] == {"films": "unknown", "people": "unknown", "species": "unknown"}
+    assert time.time() - start < utils.settings.redis_socket_timeout + 1
+
+
+def test_lifespan_opens_and_closes_the_clients(fake_redis, monkeypatch):
+    def create_redis_client(is_async=False):
+        return (fakeredis.aioredis.FakeRedis if is_async else fakeredis.FakeRedis)(server=fake_redis.server)
+
+    monkeypatch.setattr(utils, "async_redis_client", None)
+    monkeypatch.setattr(utils, "create_redis_client", create_redis_client)
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            assert utils.async_redis_client is not None
+            assert await utils.async_redis_client.ping()
+        assert utils.async_redis_client is None
+
+    asyncio.run(run())
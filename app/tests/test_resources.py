@@ -0,0 +1,54 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import appearances, cache, resources
+import asyncio
+
+
+client = TestClient(app)
+
+
+def test_cache_bypass_is_cold(fake_redis, swapi_stub):
+    top_10_sorted = client.get("/characters/top_10_sorted").json()
+    keys = set(fake_redis.keys())
+    swapi_stub.reset_calls()
+
+    # Everything is fetched from SWAPI (each character and species on its own, not from the bulk store)...
+    response = client.get("/characters/top_10_sorted", params={"use_cache": False})
+    assert response.json() == top_10_sorted
+    assert swapi_stub.count("/api/films/") == 1
+    assert sum(count for path, count in swapi_stub.calls.items() if path.startswith("/api/people/")) == 10
+    assert swapi_stub.count("/api/species/") > 0
+
+    # ... and nothing is cached
+    assert set(fake_redis.keys()) - keys <= {b"metrics"}
+
+
+def test_cache_bypass_leaves_the_appearance_index_alone(fake_redis, swapi_stub):
+    response = client.get("/characters/top_10_sorted", params={"use_cache": False})
+    assert response.status_code == 200 and len(response.json()) == 10
+    assert not fake_redis.exists(appearances.APPEARANCES_KEY)
+
+
+def test_cache_hits_are_only_validated_when_enabled(fake_redis, swapi_stub, monkeypatch):
+    url = f"{swapi_stub.base_url}/species/2/"
+    invalid = {"url": url}  # No name
+
+    async def fetch():
+        await cache.cache_set(resources.species.key(url), invalid)
+        return await resources.species.fetch(url, use_cache=True)
+
+    monkeypatch.setattr(resources.settings, "bulk_store_enabled", False)
+    assert asyncio.run(fetch()) == invalid
+    assert swapi_stub.count("/api/species/2/") == 0
+
+    monkeypatch.setattr(resources.settings, "validate_cache_hits", True)
+    assert asyncio.run(fetch()) == {"url": url, "name": "Droid"}
+    assert swapi_stub.count("/api/species/2/") == 1
+
+
+def test_entities_are_projected(fake_redis, swapi_stub):
+    luke = asyncio.run(resources.people.fetch(f"{swapi_stub.base_url}/people/1/", use_cache=False))
+    assert set(luke) == set(resources.people.schema.__fields__)
+    films_data = asyncio.run(resources.films.fetch_collection(use_cache=False))
+    assert films_data["count"] == len(films_data["results"]) == 6
+    assert all(set(film) == {"url", "characters"} for film in films_data["results"])
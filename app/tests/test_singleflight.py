@@ -0,0 +1,66 @@
+from fastapi import Request, Response
+from src.app import app
+from src import delivery, upstream
+from src.routes import character
+import asyncio
+import json
+import httpx
+import threading
+
+
+PARALLEL_REQUESTS = 20
+
+
+def assert_single_fan_out(fake_redis, swapi_stub):
+    # Exactly the calls of one films -> characters -> species fan-out, no matter how many callers
+    assert swapi_stub.count("/api/films/") == 1
+    # People and species come from the bulk store, crawled a page at a time (two pages of people, one of species)
+    assert swapi_stub.count("/api/people/") == 2
+    assert all(n == 1 for path, n in swapi_stub.calls.items() if path.startswith("/api/people/"))
+    assert swapi_stub.count("/api/species/") == 1
+    assert fake_redis.llen(delivery.QUEUE_KEY) == 1  # The same CSV is only queued once
+
+
+def test_top_10_sorted_parallel_requests_coalesce(fake_redis, swapi_stub):
+    async def fire():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            return await asyncio.gather(*[client.get("/characters/top_10_sorted")
+                                          for _ in range(PARALLEL_REQUESTS)])
+
+    responses = asyncio.run(fire())
+
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json() == responses[0].json() for response in responses)
+    assert responses[0].json()[0]["name"] == "Chewbacca"
+    assert responses[0].json()[-1]["name"] == "Yoda"
+    assert_single_fan_out(fake_redis, swapi_stub)
+
+
+def test_top_10_sorted_coalesces_across_workers(fake_redis, swapi_stub, monkeypatch):
+    # Each thread runs its own event loop, like a separate gunicorn worker; only the Redis lease is shared
+    results = [None] * PARALLEL_REQUESTS
+
+    # So each worker also has its own upstream client (the module's one is per process, not per thread)
+    clients = threading.local()
+    monkeypatch.setattr(upstream, "get_upstream_client", lambda: clients.client)
+
+    async def get_top_10_sorted():
+        clients.client = httpx.AsyncClient()
+        async with clients.client:
+            request = Request({"type": "http", "headers": []})
+            return await character.get_top_10_sorted(request, Response(), use_cache=True)
+
+    def worker(index):
+        results[index] = asyncio.run(get_top_10_sorted())
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(PARALLEL_REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The list is returned already serialised
+    assert all(result.body == results[0].body for result in results)
+    assert len(json.loads(results[0].body)) == 10
+    assert_single_fan_out(fake_redis, swapi_stub)
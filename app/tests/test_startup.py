@@ -0,0 +1,35 @@
+from src import cache, codec, metrics, utils
+from src.config import get_settings
+import json
+import os
+
+
+def test_settings_are_shared():
+    assert get_settings() is utils.settings is cache.settings is codec.settings
+
+
+def test_forked_workers_get_their_own_identity():
+    # gunicorn preload_app: the workers are forked from the master that imported the app
+    metrics.set_gauge("upstream_max_concurrency", 20)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write_fd, json.dumps({"worker": metrics.worker, "worker_id": cache.worker_id,
+                                           "gauges": list(metrics.gauges)}).encode("utf-8"))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        child = json.loads(f.read())
+    os.waitpid(pid, 0)
+
+    assert child["worker"] == f"{metrics.worker.split(':')[0]}:{pid}"
+    assert child["worker_id"] != cache.worker_id
+    assert child["gauges"] == [metrics.sample("upstream_max_concurrency", worker=child["worker"])]
+    metrics.gauges.clear()
+
+
+def test_fallback_cache_file_is_opened_on_startup():
+    # Not on import: a sqlite connection can't be shared with the forked workers
+    assert cache.fallback_cache.db is None
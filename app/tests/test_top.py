@@ -0,0 +1,76 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import appearances, cache
+from src.routes import character
+from src.csv_export import build_csv
+import asyncio
+
+
+client = TestClient(app)
+
+
+def test_top_characters_by_appearances(fake_redis, swapi_stub):
+    response = client.get("/characters/top", params={"n": 3, "sort": "appearances", "order": "desc"})
+    assert response.status_code == 200
+    top = response.json()
+    assert [character["name"] for character in top] == ["C-3PO", "R2-D2", "Obi-Wan Kenobi"]
+    assert all(character["appearances"] == 6 for character in top)
+
+
+def test_top_characters_any_n_and_order(fake_redis, swapi_stub):
+    top_10 = client.get("/characters/top", params={"n": 10}).json()
+    assert top_10 == client.get("/characters/top_10_sorted").json()
+
+    top_14 = client.get("/characters/top", params={"n": 50, "sort": "name", "order": "asc"}).json()
+    assert len(top_14) == 14
+    assert [character["name"] for character in top_14] == sorted(character["name"] for character in top_14)
+
+    # Characters are only fetched once, whatever the n
+    assert all(n == 1 for path, n in swapi_stub.calls.items() if path.startswith("/api/people/"))
+
+    response = client.get("/characters/top", params={"n": 0})
+    assert response.status_code == 422
+
+
+def test_appearance_index_is_only_rebuilt_when_films_change(fake_redis):
+    films_data = {"results": [{"characters": ["a", "b"]}, {"characters": ["b", "c"]}, {"characters": ["c", "d"]}]}
+    assert asyncio.run(appearances.top_appearances(films_data, 3)) == [("b", 2), ("c", 2), ("a", 1)]
+    films_hash = fake_redis.get(appearances.APPEARANCES_FILMS_HASH_KEY)
+
+    # Same films data: the index is left alone
+    fake_redis.zadd(appearances.APPEARANCES_KEY, {"a": 10 * appearances.TIE_BREAK_SCALE})
+    assert asyncio.run(appearances.top_appearances(films_data, 1)) == [("a", 10)]
+
+    # New films data: the index is rebuilt
+    films_data["results"].append({"characters": ["d", "d"]})
+    assert asyncio.run(appearances.top_appearances(films_data, 1)) == [("d", 3)]
+    assert fake_redis.get(appearances.APPEARANCES_FILMS_HASH_KEY) != films_hash
+
+
+def test_top_10_sorted_etag(fake_redis, swapi_stub, monkeypatch):
+    response = client.get("/characters/top_10_sorted")
+    etag = response.headers["etag"]
+    assert response.status_code == 200 and etag.startswith('"')
+
+    # The client already has this version: 304 without a body, and the CSV isn't rebuilt or queued again
+    csv_builds = []
+    monkeypatch.setattr(character, "build_csv", lambda rows: csv_builds.append(rows) or build_csv(rows))
+    not_modified = client.get("/characters/top_10_sorted", headers={"If-None-Match": f'W/"old", {etag}'})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.headers["x-delivery-job"] == response.headers["x-delivery-job"]
+    assert client.get("/characters/top_10_sorted", headers={"If-None-Match": '"old"'}).status_code == 200
+
+    # The CSV download has its own ETag
+    csv_etag = client.get("/characters/top_10_sorted.csv").headers["etag"]
+    assert csv_etag != etag
+    assert client.get("/characters/top_10_sorted.csv", headers={"If-None-Match": csv_etag}).status_code == 304
+
+    # The ETag follows the content: a rebuilt but identical list keeps it, a different one changes it
+    assert client.get("/characters/top_10_sorted", params={"use_cache": False}).headers["etag"] == etag
+    assert csv_builds == []
+    top_10_sorted, _ = asyncio.run(cache.cache_get("top_10_sorted_cache"))
+    asyncio.run(cache.cache_set("top_10_sorted_cache", top_10_sorted[:9]))
+    assert client.get("/characters/top_10_sorted").headers["etag"] != etag
+    assert len(csv_builds) == 1
@@ -0,0 +1,124 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import circuit_breaker, metrics, upstream
+from src.upstream import UpstreamScheduler
+from types import SimpleNamespace
+import asyncio
+
+
+client = TestClient(app)
+
+
+class FakeClient:
+    # Stand-in for the shared httpx client: records how many calls are in flight, per host and in total
+    def __init__(self, latency: float = 0.01, status_code: int = 200):
+        self.latency = latency
+        self.status_code = status_code
+        self.in_flight = {}
+        self.max_in_flight = {}
+
+    async def request(self, method, url, **kwargs):
+        host = url.split("/")[2]
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        self.max_in_flight[host] = max(self.max_in_flight.get(host, 0), self.in_flight[host])
+        self.max_in_flight["total"] = max(self.max_in_flight.get("total", 0), sum(self.in_flight.values()))
+        try:
+            await asyncio.sleep(self.latency)
+            return SimpleNamespace(status_code=self.status_code)
+        finally:
+            self.in_flight[host] -= 1
+
+
+def make_scheduler(**options) -> UpstreamScheduler:
+    return UpstreamScheduler(**{"max_concurrency": 3, "host_min": 1, "host_max": 2, "host_initial": 2,
+                                "latency_tolerance": 2.0, "decrease_factor": 0.5, "congestion_samples": 3,
+                                **options})
+
+
+def test_global_and_per_host_limits(monkeypatch):
+    fake_client = FakeClient()
+    monkeypatch.setattr(upstream, "get_upstream_client", lambda: fake_client)
+    scheduler = make_scheduler()
+
+    async def fire():
+        await asyncio.gather(*[scheduler.request("GET", f"http://{host}/{i}")
+                               for i in range(10) for host in ("a", "b")])
+
+    asyncio.run(fire())
+    assert fake_client.max_in_flight["a"] == 2
+    assert fake_client.max_in_flight["b"] == 2
+    assert fake_client.max_in_flight["total"] == 3
+    assert scheduler.in_flight == 0
+    assert scheduler.stats()["a"] == {"limit": 2, "in_flight": 0, "waiting": 0}
+
+
+def test_limits_adapt_to_errors_and_latency():
+    scheduler = make_scheduler(max_concurrency=50, host_max=8, host_initial=2)
+    clock = iter(range(1000))  # A second between the calls: each one is a round trip of its own
+
+    def record(latency, overloaded=False):
+        scheduler.record("a", latency, overloaded, now=next(clock))
+        return scheduler.stats()["a"]["limit"]
+
+    # Additive increase while the host is healthy, up to the maximum
+    assert [record(0.01) for _ in range(40)][-1] == 8
+
+    # Multiplicative decrease when it fails, once per round trip
+    assert record(0.01, overloaded=True) == 4
+    scheduler.record("a", 0.01, True, now=scheduler.hosts["a"].last_decrease + 0.001)
+    assert scheduler.stats()["a"]["limit"] == 4
+
+    # Jitter (a slow call now and then) isn't congestion
+    for _ in range(10):
+        assert record(0.01) >= 4 and record(0.05) >= 4
+    limit = record(0.01)
+
+    # Slow calls in a row are
+    baseline = scheduler.hosts["a"].baseline_latency
+    assert [record(baseline * 10) for _ in range(3)] == [limit, limit, limit // 2]
+
+    # The baseline follows a host that got slower for good, which can then grow its limit again
+    assert [record(baseline * 10) for _ in range(100)][-1] == 8
+    assert scheduler.hosts["a"].baseline_latency > baseline * 5
+
+
+def test_cancelled_waiters_give_their_slot_back(monkeypatch):
+    fake_client = FakeClient(latency=0.05)
+    monkeypatch.setattr(upstream, "get_upstream_client", lambda: fake_client)
+    scheduler = make_scheduler(max_concurrency=1)
+
+    async def fire():
+        first = asyncio.ensure_future(scheduler.request("GET", "http://a/1"))
+        waiting = asyncio.ensure_future(scheduler.request("GET", "http://a/2"))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["a"]["waiting"] == 1
+        waiting.cancel()
+        await first
+        await scheduler.request("GET", "http://a/3")
+
+    asyncio.run(fire())
+    assert scheduler.in_flight == 0
+    assert scheduler.stats()["a"] == {"limit": 2, "in_flight": 0, "waiting": 0}
+
+
+def test_concurrent_gets_of_a_url_are_deduplicated(fake_redis, swapi_stub):
+    url = f"{swapi_stub.base_url}/people/1/"
+
+    async def fire():
+        return await asyncio.gather(*[circuit_breaker.upstream_get("people", url) for _ in range(5)])
+
+    responses = asyncio.run(fire())
+    assert all(response.json()["name"] == "Luke Skywalker" for response in responses)
+    assert swapi_stub.count("/api/people/1/") == 1
+
+
+def test_scheduler_metrics(fake_redis, swapi_stub):
+    assert client.get("/characters/top_10_sorted").status_code == 200
+    host = swapi_stub.base_url.split("/")[2]
+    assert metrics.gauges[metrics.sample("upstream_in_flight", host=host, worker=metrics.worker)] == 0
+    assert metrics.gauges[metrics.sample("upstream_queue_depth", host=host, worker=metrics.worker)] == 0
+
+    body = client.get("/metrics").text
+    assert "# TYPE upstream_concurrency_limit gauge" in body
+    assert f'upstream_concurrency_limit{{host="{host}",worker="{metrics.worker}"}}' in body
+    assert f'upstream_max_concurrency{{worker="{metrics.worker}"}} {float(upstream.settings.upstream_max_concurrency)}' in body
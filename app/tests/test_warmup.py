@@ -0,0 +1,73 @@
+from fastapi.testclient import TestClient
+from src.app import app
+from src import redis_health, upstream, warmup
+from benchmarks.fake_upstream import FIXTURE_PATH
+import asyncio
+import pytest
+import time
+
+
+@pytest.fixture
+def no_upstream(monkeypatch):
+    # Any upstream call fails the test
+    calls = []
+
+    def get_upstream_client():
+        calls.append(True)
+        raise AssertionError("Unexpected upstream call")
+
+    monkeypatch.setattr(upstream, "get_upstream_client", get_upstream_client)
+    return calls
+
+
+def test_startup_loads_the_snapshot(fake_redis, no_upstream, monkeypatch):
+    monkeypatch.setattr(warmup.settings, "snapshot_path", FIXTURE_PATH)
+
+    with TestClient(app) as client:
+        assert fake_redis.exists("films_data", "character_data:https://swapi.dev/api/people/13/",
+                                 "species_data:https://swapi.dev/api/species/3/") == 3
+
+        response = client.get("/characters/top", params={"n": 10})
+        assert response.status_code == 200
+        assert response.json()[0]["name"] == "Chewbacca"
+        assert response.json()[-1]["name"] == "Yoda"
+
+    assert no_upstream == []
+
+
+def test_snapshot_does_not_overwrite_cached_entries(fake_redis, no_upstream):
+    snapshot = warmup.read_snapshot(FIXTURE_PATH)
+    entries = 1 + len(snapshot["people"]) + len(snapshot["species"])  # All the films go in a single entry
+    assert asyncio.run(warmup.load_snapshot(snapshot)) == entries
+    assert asyncio.run(warmup.load_snapshot(snapshot)) == 0
+    assert asyncio.run(warmup.load_snapshot(snapshot, overwrite=True)) == entries
+
+
+def test_missing_snapshot_starts_cold(fake_redis):
+    assert asyncio.run(warmup.load_snapshot_file("does/not/exist.json.gz")) == 0
+    assert asyncio.run(warmup.load_snapshot_file(None)) == 0
+
+
+def test_crawl_snapshot_round_trip(fake_redis, swapi_stub, monkeypatch, tmp_path):
+    path = str(tmp_path / "swapi.json.gz")
+
+    asyncio.run(warmup.crawl_to_file(path))
+    snapshot = warmup.read_snapshot(path)
+    fixture = warmup.read_snapshot(FIXTURE_PATH)
+    assert [len(snapshot[resource]) for resource in warmup.SNAPSHOT_RESOURCES] == \
+        [len(fixture[resource]) for resource in warmup.SNAPSHOT_RESOURCES]
+
+    # Every page is fetched once (people has two pages), nothing else
+    assert swapi_stub.count("/api/people/") == 2
+    assert sum(swapi_stub.calls.values()) == 4
+
+
+def test_periodic_refresh_survives_a_redis_outage(fake_redis, no_upstream, monkeypatch):
+    monkeypatch.setattr(warmup.settings, "snapshot_refresh_interval", 0.01)
+
+    # The lease can't be taken: Redis is marked down and the task keeps going (so the shutdown is clean)
+    with TestClient(app):
+        fake_redis.server.connected = False
+        time.sleep(0.1)
+        assert not redis_health.redis_available()
+    assert no_upstream == []